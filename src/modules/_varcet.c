@@ -26,6 +26,113 @@
 
 #include <Python.h>
 
+/*
+ * An iterator over the attributes of an action.  Actions may use other
+ * mappings than a dictionary for their attributes; those of a
+ * pkg.actions.generic.CompactAttrs object are read from the table of
+ * attribute name positions and the tuple of values it keeps, rather than
+ * copying them into a new dictionary.
+ */
+typedef struct {
+	PyObject *names;	/* dict of names to values or positions */
+	PyObject *values;	/* tuple of values, or NULL */
+	Py_ssize_t pos;
+} attr_iter;
+
+/*
+ * Prepares the given iterator for the attributes of the given action.
+ * Returns -1 with an exception set on failure.
+ */
+static int
+attrs_init(attr_iter *it, PyObject *action)
+{
+	PyObject *attrs, *index, *values, *d;
+
+	it->names = it->values = NULL;
+	it->pos = 0;
+
+	if ((attrs = PyObject_GetAttrString(action, "attrs")) == NULL)
+		return (-1);
+	if (PyDict_Check(attrs)) {
+		it->names = attrs;
+		return (0);
+	}
+
+	if ((index = PyObject_GetAttrString(attrs,
+	    "_CompactAttrs__index")) != NULL) {
+		if ((values = PyObject_GetAttrString(attrs,
+		    "_CompactAttrs__values")) == NULL) {
+			Py_DECREF(index);
+			Py_DECREF(attrs);
+			return (-1);
+		}
+		Py_DECREF(attrs);
+		if (index == Py_None && PyDict_Check(values)) {
+			/* The attributes have been moved to a dictionary. */
+			Py_DECREF(index);
+			it->names = values;
+			return (0);
+		}
+		if (PyDict_Check(index) && PyTuple_Check(values)) {
+			it->names = index;
+			it->values = values;
+			return (0);
+		}
+		Py_DECREF(index);
+		Py_DECREF(values);
+		PyErr_SetString(PyExc_TypeError,
+		    "invalid CompactAttrs object");
+		return (-1);
+	}
+	if (!PyErr_ExceptionMatches(PyExc_AttributeError)) {
+		Py_DECREF(attrs);
+		return (-1);
+	}
+	PyErr_Clear();
+
+	/* Any other mapping is copied. */
+	if ((d = PyDict_New()) != NULL && PyDict_Merge(d, attrs, 1) == -1)
+		Py_CLEAR(d);
+	Py_DECREF(attrs);
+	if (d == NULL)
+		return (-1);
+	it->names = d;
+	return (0);
+}
+
+/*
+ * Sets 'name' and 'value' to borrowed references to the next attribute of
+ * the action and returns 1, or returns 0 if there are no more attributes.
+ * Returns -1 with an exception set on failure.
+ */
+static int
+attrs_next(attr_iter *it, PyObject **name, PyObject **value)
+{
+	Py_ssize_t i;
+
+	if (!PyDict_Next(it->names, &it->pos, name, value))
+		return (0);
+	if (it->values == NULL)
+		return (1);
+
+	i = PyLong_AsSsize_t(*value);
+	if (i < 0 || i >= PyTuple_GET_SIZE(it->values)) {
+		if (!PyErr_Occurred())
+			PyErr_SetString(PyExc_IndexError,
+			    "CompactAttrs index out of range");
+		return (-1);
+	}
+	*value = PyTuple_GET_ITEM(it->values, i);
+	return (1);
+}
+
+static void
+attrs_release(attr_iter *it)
+{
+	Py_CLEAR(it->names);
+	Py_CLEAR(it->values);
+}
+
 /*ARGSUSED*/
 static PyObject *
 _allow_facet(PyObject *self, PyObject *args, PyObject *kwargs)
@@ -34,7 +141,7 @@ _allow_facet(PyObject *self, PyObject *args, PyObject *kwargs)
 	PyObject *facets = NULL;
 	PyObject *keylist = NULL;
 
-	PyObject *act_attrs = NULL;
+	attr_iter act_attrs;
 	PyObject *attr = NULL;
 	PyObject *value = NULL;
 
@@ -43,8 +150,8 @@ _allow_facet(PyObject *self, PyObject *args, PyObject *kwargs)
 	PyObject *any_ret = NULL;
 	PyObject *facet_ret = NULL;
 	PyObject *ret = Py_True;
-	Py_ssize_t fpos = 0;
 	Py_ssize_t klen = 0;
+	int more;
 	/* This parameter is ignored. */
 	PyObject *publisher = NULL;
 	static char *kwlist[] = {"facets", "action", "publisher", NULL};
@@ -53,28 +160,28 @@ _allow_facet(PyObject *self, PyObject *args, PyObject *kwargs)
 	    kwlist, &facets, &action, &publisher))
 		return (NULL);
 
-	if ((act_attrs = PyObject_GetAttrString(action, "attrs")) == NULL)
+	if (attrs_init(&act_attrs, action) == -1)
 		return (NULL);
 
 	if ((keylist = PyObject_GetAttrString(facets,
 	    "_Facets__keylist")) == NULL) {
-		Py_DECREF(act_attrs);
+		attrs_release(&act_attrs);
 		return (NULL);
 	}
 	klen = PyList_GET_SIZE(keylist);
 
 	if ((res = PyObject_GetAttrString(facets, "_Facets__res")) == NULL) {
-		Py_DECREF(act_attrs);
+		attrs_release(&act_attrs);
 		Py_DECREF(keylist);
 		return (NULL);
 	}
 
 #define	CLEANUP_FREFS \
-	Py_DECREF(act_attrs);\
+	attrs_release(&act_attrs);\
 	Py_DECREF(keylist);\
 	Py_DECREF(res);
 
-	while (PyDict_Next(act_attrs, &fpos, &attr, &value)) {
+	while ((more = attrs_next(&act_attrs, &attr, &value)) == 1) {
 		const char *as = PyUnicode_AsUTF8(attr);
 		if (strncmp(as, "facet.", 6) != 0)
 			continue;
@@ -178,6 +285,8 @@ prep_ret:
 	}
 
 	CLEANUP_FREFS;
+	if (more == -1)
+		return (NULL);
 	if (all_ret == Py_False || any_ret == Py_False)
 		ret = Py_False;
 
@@ -191,10 +300,10 @@ _allow_variant(PyObject *self, PyObject *args, PyObject *kwargs)
 {
 	PyObject *action = NULL;
 	PyObject *vars = NULL;
-	PyObject *act_attrs = NULL;
+	attr_iter act_attrs;
 	PyObject *attr = NULL;
 	PyObject *value = NULL;
-	Py_ssize_t pos = 0;
+	int more;
 	/* This parameter is ignored. */
 	PyObject *publisher = NULL;
 	static char *kwlist[] = {"vars", "action", "publisher", NULL};
@@ -203,10 +312,10 @@ _allow_variant(PyObject *self, PyObject *args, PyObject *kwargs)
 	    kwlist, &vars, &action, &publisher))
 		return (NULL);
 
-	if ((act_attrs = PyObject_GetAttrString(action, "attrs")) == NULL)
+	if (attrs_init(&act_attrs, action) == -1)
 		return (NULL);
 
-	while (PyDict_Next(act_attrs, &pos, &attr, &value)) {
+	while ((more = attrs_next(&act_attrs, &attr, &value)) == 1) {
 		const char *as = PyUnicode_AsUTF8(attr);
 		if (strncmp(as, "variant.", 8) == 0) {
 			const char *av = PyUnicode_AsUTF8(value);
@@ -220,7 +329,7 @@ _allow_variant(PyObject *self, PyObject *args, PyObject *kwargs)
 				 * would fail anyway.
 				 */
 				PyErr_Clear();
-				Py_DECREF(act_attrs);
+				attrs_release(&act_attrs);
 				Py_RETURN_FALSE;
 			}
 
@@ -233,7 +342,7 @@ _allow_variant(PyObject *self, PyObject *args, PyObject *kwargs)
 				 */
 				if ((strncmp(as, "variant.debug.", 14) == 0) &&
 				    (strncmp(av, "false", 5) != 0)) {
-					Py_DECREF(act_attrs);
+					attrs_release(&act_attrs);
 					Py_RETURN_FALSE;
 				}
 				continue;
@@ -245,13 +354,15 @@ _allow_variant(PyObject *self, PyObject *args, PyObject *kwargs)
 				 * If system variant value doesn't match action
 				 * variant value, don't allow this action.
 				 */
-				Py_DECREF(act_attrs);
+				attrs_release(&act_attrs);
 				Py_RETURN_FALSE;
 			}
 		}
 	}
 
-	Py_DECREF(act_attrs);
+	attrs_release(&act_attrs);
+	if (more == -1)
+		return (NULL);
 	Py_RETURN_TRUE;
 }
 
@@ -39,8 +39,10 @@ This package has two data members:
   "payload_types", a dictionary which maps action names that deliver payload
   to the classes that represent them.
 
-This package also has one function: "fromstr", which creates an action instance
-based on a str() representation of an action.
+This package also has two functions: "fromstr", which creates an action
+instance based on a str() representation of an action, and "fromcontent",
+which creates the action instances for all of the actions found in the
+content of a manifest.
 """
 
 import inspect
@@ -230,7 +232,7 @@ class InvalidActionAttributesError(ActionError):
 
 # This must be imported *after* all of the exception classes are defined as
 # _actions module init needs the exception objects.
-from ._actions import fromstr
+from ._actions import fromstr, fromcontent
 
 def attrsfromstr(string):
         """Create an attribute dict given a string w/ key=value pairs.
@@ -29,6 +29,7 @@
 #include <stdbool.h>
 #include <string.h>
 
+static PyObject *ActionError;
 static PyObject *MalformedActionError;
 static PyObject *InvalidActionError;
 static PyObject *UnknownActionError;
@@ -135,16 +136,20 @@ set_invaliderr(const char *str, const char *msg)
  * support is provided by the Manifest class.
  */
 
-/*ARGSUSED*/
+/*
+ * Parse the action found in the given NUL-terminated UTF-8 string of length
+ * 'strl' and return a new reference to the resulting action object with its
+ * data set to 'act_data', or NULL with an exception set on failure.  The
+ * string is owned by the caller and must remain valid until this returns.
+ */
 static PyObject *
-fromstr(PyObject *self, PyObject *args, PyObject *kwdict)
+_fromstr(char *str, int strl, PyObject *act_data)
 {
 	char *s = NULL;
-	char *str = NULL;
 	char *hashstr = NULL;
 	char *keystr = NULL;
 	int *slashmap = NULL;
-	int strl, typestrl;
+	int typestrl;
 	int i, ks, vs, keysize;
 	int smlen = 0, smpos = 0;
 	int hash_allowed;
@@ -152,7 +157,6 @@ fromstr(PyObject *self, PyObject *args, PyObject *kwdict)
 	char quote = '\0';
 	PyObject *act_args = NULL;
 	PyObject *act_class = NULL;
-	PyObject *act_data = NULL;
 	PyObject *action = NULL;
 	PyObject *hash = NULL;
 	PyObject *attrs = NULL;
@@ -167,47 +171,23 @@ fromstr(PyObject *self, PyObject *args, PyObject *kwdict)
 
 	/*
 	 * If malformed() or invalid() are used, CLEANUP_REFS can only be used
-	 * after.  Likewise, PyMem_Free(str) should not be called before using
-	 * malformed() or invalid().  Failure to order this properly will cause
-	 * corruption of the exception messages.
+	 * after.  Failure to order this properly will cause corruption of the
+	 * exception messages.
 	 */
 #define	malformed(msg) set_malformederr(str, i, (msg))
 #define	invalid(msg) set_invaliderr(str, (msg))
 #define	CLEANUP_REFS \
-	PyMem_Free(str);\
 	Py_XDECREF(key);\
 	Py_XDECREF(attr);\
 	Py_XDECREF(attrs);\
 	Py_XDECREF(hash);\
 	free(hashstr);
 
-	/*
-	 * Positional arguments must be included in the keyword argument list in
-	 * the order you want them to be assigned.  (A subtle point missing from
-	 * the Python documentation.)
-	 */
-	static char *kwlist[] = { "string", "data", NULL };
-
-	/* Assume data=None by default. */
-	act_data = Py_None;
-
-	/*
-	 * The action string is currently assumed to be a stream of bytes that
-	 * are valid UTF-8.  This method works regardless of whether the string
-	 * object provided is a Unicode object, string object, or a character
-	 * buffer.
-	 */
-	if (PyArg_ParseTupleAndKeywords(args, kwdict, "et#|O:fromstr", kwlist,
-	    "utf-8", &str, &strl, &act_data) == 0) {
-		return (NULL);
-	}
-
 	s = strpbrk(str, " \t\n");
 
 	i = strl;
 	if (s == NULL) {
 		malformed("no attributes");
-		PyMem_Free(str);
 		return (NULL);
 	}
 
@@ -263,7 +243,6 @@ fromstr(PyObject *self, PyObject *args, PyObject *kwdict)
 		    str, typestrl)) != NULL) {
 			PyErr_SetObject(UnknownActionError, act_args);
 			Py_DECREF(act_args);
-			PyMem_Free(str);
 			return (NULL);
 		}
 
@@ -272,16 +251,13 @@ fromstr(PyObject *self, PyObject *args, PyObject *kwdict)
 		 * general type exception instead.
 		 */
 		PyErr_SetString(PyExc_TypeError, "unknown action type");
-		PyMem_Free(str);
 		return (NULL);
 	}
 
 	ks = vs = typestrl;
 	prevstate = state = WS;
-	if ((attrs = PyDict_New()) == NULL) {
-		PyMem_Free(str);
+	if ((attrs = PyDict_New()) == NULL)
 		return (NULL);
-	}
 	for (i = s - str; str[i]; i++) {
 		if (state == KEY) {
 			keysize = i - ks;
@@ -378,10 +354,8 @@ fromstr(PyObject *self, PyObject *args, PyObject *kwdict)
 				if (slashmap == NULL) {
 					smlen = 16;
 					slashmap = calloc(smlen, sizeof (int));
-					if (slashmap == NULL) {
-						PyMem_Free(str);
+					if (slashmap == NULL)
 						return (PyErr_NoMemory());
-					}
 					smpos = 0;
 					/*
 					 * Terminate slashmap with an invalid
@@ -393,10 +367,8 @@ fromstr(PyObject *self, PyObject *args, PyObject *kwdict)
 					smlen *= 2;
 					slashmap = realloc(slashmap,
 					    smlen * sizeof (int));
-					if (slashmap == NULL) {
-						PyMem_Free(str);
+					if (slashmap == NULL)
 						return (PyErr_NoMemory());
-					}
 				}
 				i++;
 				if (str[i] == '\\' || str[i] == quote) {
@@ -418,7 +390,6 @@ fromstr(PyObject *self, PyObject *args, PyObject *kwdict)
 					attrlen = i - vs;
 					sattr = calloc(1, attrlen + 1);
 					if (sattr == NULL) {
-						PyMem_Free(str);
 						free(slashmap);
 						return (PyErr_NoMemory());
 					}
@@ -561,7 +532,6 @@ fromstr(PyObject *self, PyObject *args, PyObject *kwdict)
 		return (NULL);
 	}
 
-	PyMem_Free(str);
 	Py_XDECREF(key);
 	Py_XDECREF(attr);
 
@@ -602,8 +572,318 @@ fromstr(PyObject *self, PyObject *args, PyObject *kwdict)
 	return (action);
 }
 
+/*ARGSUSED*/
+static PyObject *
+fromstr(PyObject *self, PyObject *args, PyObject *kwdict)
+{
+	char *str = NULL;
+	int strl;
+	PyObject *act_data = NULL;
+	PyObject *action = NULL;
+
+	/*
+	 * Positional arguments must be included in the keyword argument list in
+	 * the order you want them to be assigned.  (A subtle point missing from
+	 * the Python documentation.)
+	 */
+	static char *kwlist[] = { "string", "data", NULL };
+
+	/* Assume data=None by default. */
+	act_data = Py_None;
+
+	/*
+	 * The action string is currently assumed to be a stream of bytes that
+	 * are valid UTF-8.  This method works regardless of whether the string
+	 * object provided is a Unicode object, string object, or a character
+	 * buffer.
+	 */
+	if (PyArg_ParseTupleAndKeywords(args, kwdict, "et#|O:fromstr", kwlist,
+	    "utf-8", &str, &strl, &act_data) == 0) {
+		return (NULL);
+	}
+
+	action = _fromstr(str, strl, act_data);
+	PyMem_Free(str);
+	return (action);
+}
+
+/*
+ * Returns the length of the line terminator found at the start of the given
+ * buffer or 0 if there is none.  The terminators recognized are the same as
+ * those used by Python's str.splitlines().
+ */
+static inline Py_ssize_t
+line_term(const char *s, Py_ssize_t len)
+{
+	switch ((unsigned char)s[0]) {
+	case '\r':
+		return ((len > 1 && s[1] == '\n') ? 2 : 1);
+	case '\n':
+	case '\v':
+	case '\f':
+	case '\x1c':
+	case '\x1d':
+	case '\x1e':
+		return (1);
+	case 0xc2:
+		/* U+0085 */
+		return ((len > 1 && (unsigned char)s[1] == 0x85) ? 2 : 0);
+	case 0xe2:
+		/* U+2028, U+2029 */
+		return ((len > 2 && (unsigned char)s[1] == 0x80 &&
+		    ((unsigned char)s[2] == 0xa8 ||
+		    (unsigned char)s[2] == 0xa9)) ? 3 : 0);
+	}
+	return (0);
+}
+
+/*
+ * Returns the length of the whitespace character found at the start of the
+ * given buffer or 0 if there is none.  The characters recognized are those
+ * that Python's str.lstrip() removes, other than the line terminators.
+ */
+static inline Py_ssize_t
+space_len(const char *s, Py_ssize_t len)
+{
+	const unsigned char *u = (const unsigned char *)s;
+
+	switch (u[0]) {
+	case ' ':
+	case '\t':
+	case '\x1f':
+		return (1);
+	case 0xc2:
+		/* U+00A0 */
+		return ((len > 1 && u[1] == 0xa0) ? 2 : 0);
+	case 0xe1:
+		/* U+1680 */
+		return ((len > 2 && u[1] == 0x9a && u[2] == 0x80) ? 3 : 0);
+	case 0xe2:
+		if (len < 3)
+			return (0);
+		/* U+2000 - U+200A, U+202F */
+		if (u[1] == 0x80 && ((u[2] >= 0x80 && u[2] <= 0x8a) ||
+		    u[2] == 0xaf))
+			return (3);
+		/* U+205F */
+		return ((u[1] == 0x81 && u[2] == 0x9f) ? 3 : 0);
+	case 0xe3:
+		/* U+3000 */
+		return ((len > 2 && u[1] == 0x80 && u[2] == 0x80) ? 3 : 0);
+	}
+	return (0);
+}
+
+/*
+ * Returns a boolean value indicating whether the given action should be
+ * included based on the list of exclude callables given; this is the same
+ * as Action.include_this().  Returns -1 with an exception set on failure.
+ */
+static int
+include_action(PyObject *action, PyObject *excludes, PyObject *exkw)
+{
+	Py_ssize_t i, len = PySequence_Fast_GET_SIZE(excludes);
+	PyObject **items = PySequence_Fast_ITEMS(excludes);
+	PyObject *exargs;
+	int ret = 1;
+
+	if ((exargs = PyTuple_Pack(1, action)) == NULL)
+		return (-1);
+
+	for (i = 0; i < len && ret == 1; i++) {
+		PyObject *res = PyObject_Call(items[i], exargs, exkw);
+
+		if (res == NULL) {
+			ret = -1;
+			break;
+		}
+		ret = PyObject_IsTrue(res);
+		Py_DECREF(res);
+	}
+	Py_DECREF(exargs);
+	return (ret);
+}
+
+/*
+ * Parse all of the actions found in the given manifest content in a single
+ * call.  The content may be a str or any object supporting the buffer
+ * protocol containing UTF-8 (e.g. the raw bytes of a manifest file) and is
+ * split into actions the same way the Manifest class does: leading
+ * whitespace is ignored, a trailing backslash continues an action on the
+ * next line, and blank lines and comments are skipped.
+ *
+ * If 'excludes' is provided, it must be a list of callables as used by
+ * Action.include_this() and actions they don't allow are omitted; each is
+ * called with the action and 'publisher' as a keyword argument.
+ *
+ * Returns a tuple of the list of actions parsed and the list of ActionError
+ * exceptions raised for any actions that couldn't be; each exception has its
+ * 'lineno' attribute set to the line number at which the action ends.
+ */
+/*ARGSUSED*/
+static PyObject *
+fromcontent(PyObject *self, PyObject *args, PyObject *kwdict)
+{
+	const char *buf;
+	char *line = NULL;
+	Py_ssize_t buflen, pos, start, end, term, space;
+	size_t linelen = 0, linesz = 0;
+	long lineno = 0;
+	bool release = false;
+	Py_buffer view;
+	PyObject *content = NULL;
+	PyObject *excludes = Py_None;
+	PyObject *publisher = Py_None;
+	PyObject *exkw = NULL;
+	PyObject *alist = NULL;
+	PyObject *errors = NULL;
+	PyObject *result = NULL;
+
+	static char *kwlist[] = { "content", "excludes", "publisher", NULL };
+
+	if (PyArg_ParseTupleAndKeywords(args, kwdict, "O|OO:fromcontent",
+	    kwlist, &content, &excludes, &publisher) == 0) {
+		return (NULL);
+	}
+
+	if (PyUnicode_Check(content)) {
+		/* The UTF-8 form is cached by the str object itself. */
+		if ((buf = PyUnicode_AsUTF8AndSize(content, &buflen)) == NULL)
+			return (NULL);
+	} else {
+		if (PyObject_GetBuffer(content, &view, PyBUF_SIMPLE) == -1)
+			return (NULL);
+		release = true;
+		buf = view.buf;
+		buflen = view.len;
+	}
+
+	if (excludes == Py_None) {
+		excludes = NULL;
+	} else {
+		if ((excludes = PySequence_Fast(excludes,
+		    "excludes must be a sequence")) == NULL)
+			goto out;
+		if (PySequence_Fast_GET_SIZE(excludes) == 0) {
+			Py_CLEAR(excludes);
+		} else if ((exkw = Py_BuildValue("{s:O}", "publisher",
+		    publisher)) == NULL) {
+			goto out;
+		}
+	}
+
+	if ((alist = PyList_New(0)) == NULL ||
+	    (errors = PyList_New(0)) == NULL)
+		goto out;
+
+	for (pos = 0; pos < buflen; pos = end + term) {
+		PyObject *action;
+		bool cont;
+		size_t len;
+
+		lineno++;
+		for (end = pos, term = 0; end < buflen; end++) {
+			if ((term = line_term(&buf[end], buflen - end)) != 0)
+				break;
+		}
+
+		/* Leading whitespace is ignored. */
+		for (start = pos; start < end; start += space) {
+			if ((space = space_len(&buf[start], end - start)) == 0)
+				break;
+		}
+
+		/* Elide the backslash of continued lines. */
+		cont = (end > start && buf[end - 1] == '\\');
+		len = end - start - (cont ? 1 : 0);
+
+		if (linelen + len + 1 > linesz) {
+			char *nline;
+
+			linesz = (linelen + len + 1) * 2;
+			if ((nline = realloc(line, linesz)) == NULL) {
+				PyErr_NoMemory();
+				goto out;
+			}
+			line = nline;
+		}
+		memcpy(&line[linelen], &buf[start], len);
+		linelen += len;
+		if (cont)
+			continue;
+
+		line[linelen] = '\0';
+		len = linelen;
+		linelen = 0;
+
+		/* Ignore blank lines and comments. */
+		if (len == 0 || line[0] == '#')
+			continue;
+
+		if ((action = _fromstr(line, (int)len, Py_None)) == NULL) {
+			PyObject *type, *value, *tb, *lno;
+			int ret;
+
+			/* Only action errors are reported per-line. */
+			if (!PyErr_ExceptionMatches(ActionError))
+				goto out;
+
+			PyErr_Fetch(&type, &value, &tb);
+			PyErr_NormalizeException(&type, &value, &tb);
+			Py_XDECREF(type);
+			Py_XDECREF(tb);
+			if (value == NULL)
+				goto out;
+
+			if ((lno = PyLong_FromLong(lineno)) == NULL) {
+				Py_DECREF(value);
+				goto out;
+			}
+			ret = PyObject_SetAttrString(value, "lineno", lno);
+			Py_DECREF(lno);
+			if (ret == 0)
+				ret = PyList_Append(errors, value);
+			Py_DECREF(value);
+			if (ret == -1)
+				goto out;
+			continue;
+		}
+
+		if (excludes != NULL) {
+			int ret = include_action(action, excludes, exkw);
+
+			if (ret != 1) {
+				Py_DECREF(action);
+				if (ret == -1)
+					goto out;
+				continue;
+			}
+		}
+
+		if (PyList_Append(alist, action) == -1) {
+			Py_DECREF(action);
+			goto out;
+		}
+		Py_DECREF(action);
+	}
+
+	result = Py_BuildValue("(OO)", alist, errors);
+
+out:
+	free(line);
+	if (release)
+		PyBuffer_Release(&view);
+	Py_XDECREF(excludes);
+	Py_XDECREF(exkw);
+	Py_XDECREF(alist);
+	Py_XDECREF(errors);
+	return (result);
+}
+
 static PyMethodDef methods[] = {
 	{ "fromstr", (PyCFunction)fromstr, METH_VARARGS | METH_KEYWORDS },
+	{ "fromcontent", (PyCFunction)fromcontent,
+	    METH_VARARGS | METH_KEYWORDS },
 	{ NULL, NULL, 0, NULL }
 };
 
@@ -657,6 +937,8 @@ moduleinit(void)
 	 * them now ensures that garbage cleanup will work as expected during
 	 * process exit.  This applies to the action type caching below as well.
 	 */
+	ActionError = PyObject_GetAttrString(pkg_actions, "ActionError");
+	Py_DECREF(ActionError);
 	MalformedActionError = \
 	    PyObject_GetAttrString(pkg_actions, "MalformedActionError");
 	Py_DECREF(MalformedActionError);
@@ -84,6 +84,61 @@ set_invalid_action_error(const char *name, PyObject *action,
  * return value is usually None.
  */
 
+/*
+ * Intern the given attribute value (or the values of the given list) in place
+ * so that the many identical values found across actions (e.g. owner=root or
+ * mode=0755) share a single string object.  Actions created by fromstr()
+ * already have interned values; this covers those constructed directly.
+ */
+static inline int
+intern_value(PyObject **value)
+{
+	if (PyUnicode_CheckExact(*value)) {
+		if (!PyUnicode_CHECK_INTERNED(*value))
+			PyUnicode_InternInPlace(value);
+	} else if (PyList_CheckExact(*value)) {
+		Py_ssize_t i;
+
+		for (i = 0; i < PyList_GET_SIZE(*value); i++) {
+			PyObject *item = PyList_GET_ITEM(*value, i);
+
+			if (!PyUnicode_CheckExact(item) ||
+			    PyUnicode_CHECK_INTERNED(item))
+				continue;
+
+			/* PyList_SetItem() steals the new reference. */
+			Py_INCREF(item);
+			PyUnicode_InternInPlace(&item);
+			if (PyList_SetItem(*value, i, item) == -1)
+				return (-1);
+		}
+	}
+	return (0);
+}
+
+static inline int
+intern_attrs(PyObject *attrs)
+{
+	Py_ssize_t pos = 0;
+	PyObject *key, *value;
+
+	while (PyDict_Next(attrs, &pos, &key, &value)) {
+		PyObject *ivalue = value;
+		int ret = 0;
+
+		Py_INCREF(ivalue);
+		if (intern_value(&ivalue) == -1)
+			ret = -1;
+		else if (ivalue != value)
+			/* Replacing the value of a key is safe here. */
+			ret = PyDict_SetItem(attrs, key, ivalue);
+		Py_DECREF(ivalue);
+		if (ret == -1)
+			return (-1);
+	}
+	return (0);
+}
+
 /*ARGSUSED*/
 static inline PyObject *
 _generic_init_common(PyObject *action, PyObject *data, PyObject *attrs)
@@ -99,6 +154,8 @@ _generic_init_common(PyObject *action, PyObject *data, PyObject *attrs)
 	 * set as set_data() relies on it.
 	 */
 	if (attrs != NULL) {
+		if (intern_attrs(attrs) == -1)
+			return (NULL);
 		if (PyObject_SetAttrString(action, "attrs", attrs) == -1)
 			return (NULL);
 	} else {
@@ -40,6 +40,7 @@ except AttributeError:
 import six
 import stat
 import types
+from collections.abc import MutableMapping
 from io import BytesIO
 
 import pkg.actions
@@ -136,6 +137,84 @@ class NSG(type):
                 return pkg.actions.fromstr(state)
 
 
+class CompactAttrs(MutableMapping):
+        """A mapping of action attributes that stores its values in a tuple
+        indexed by a table of attribute names shared by all instances with
+        the same names; this uses a fraction of the memory of a dictionary.
+
+        It is intended for actions that are held in large numbers and rarely
+        modified (see Action.compact()); the first modification moves the
+        attributes into a private dictionary."""
+
+        __slots__ = ["__index", "__values"]
+
+        # Tables mapping attribute names to value positions keyed by the
+        # tuple of attribute names they're for.  So that it can't grow without
+        # bound, the cache is emptied once it holds __max_tables of them;
+        # the tables remain shared by the instances already using them.
+        __tables = {}
+        __max_tables = 4096
+
+        def __init__(self, attrs=EmptyDict):
+                names = tuple(attrs)
+                index = self.__tables.get(names)
+                if index is None:
+                        if len(self.__tables) >= self.__max_tables:
+                                self.__tables.clear()
+                        index = self.__tables.setdefault(names,
+                            dict((k, i) for i, k in enumerate(names)))
+                self.__index = index
+                self.__values = tuple(attrs[k] for k in names)
+
+        def __unshare(self):
+                if self.__index is not None:
+                        self.__values = dict(zip(self.__index, self.__values))
+                        self.__index = None
+                return self.__values
+
+        def __getitem__(self, key):
+                index = self.__index
+                if index is None:
+                        return self.__values[key]
+                return self.__values[index[key]]
+
+        def __setitem__(self, key, value):
+                self.__unshare()[key] = value
+
+        def __delitem__(self, key):
+                del self.__unshare()[key]
+
+        def __contains__(self, key):
+                index = self.__index
+                if index is None:
+                        return key in self.__values
+                return key in index
+
+        def __iter__(self):
+                index = self.__index
+                if index is None:
+                        return iter(self.__values)
+                return iter(index)
+
+        def __len__(self):
+                return len(self.__values)
+
+        def __repr__(self):
+                return repr(dict(self))
+
+        def get(self, key, default=None):
+                index = self.__index
+                if index is None:
+                        return self.__values.get(key, default)
+                i = index.get(key)
+                if i is None:
+                        return default
+                return self.__values[i]
+
+        def copy(self):
+                return dict(self)
+
+
 # metaclass-assignment; pylint: disable=W1623
 @six.add_metaclass(NSG)
 class Action(object):
@@ -743,6 +822,15 @@ class Action(object):
                     (v, self.attrs[v]) for v in self.get_varcet_keys()[0]
                 )))
 
+        def compact(self):
+                """Store the action's attributes in a CompactAttrs object to
+                reduce the memory used by actions that are held in large numbers
+                and rarely modified; returns the action."""
+
+                if type(self.attrs) is dict:
+                        self.attrs = CompactAttrs(self.attrs)
+                return self
+
         def strip(self, preserve=EmptyDict):
                 """Strip actions of attributes which are unnecessary once
                 those actions have been installed in an image.  Stripped
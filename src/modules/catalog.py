@@ -26,18 +26,26 @@
 that operate on lists of package FMRIs."""
 
 from __future__ import  print_function
+import bisect
 import copy
 import calendar
 import collections
+import concurrent.futures
 import datetime
 import errno
 import fnmatch
 import hashlib
+import itertools
+import mmap
 import os
+import re
 import six
 import stat
+import struct
+import sys
 import threading
 import types
+import weakref
 
 from collections import OrderedDict
 from operator import itemgetter
@@ -199,12 +207,546 @@ class _JSONWriter(object):
                         self.__sha_1.update(l)
 
 
+class _JSONReader(object):
+        """Private helper class used to sequentially read the package entries
+        of a serialized catalog part without decoding all of its data.  The
+        version entries for each package stem are returned as raw JSON text
+        so that callers only pay the cost of decoding the entries they need.
+        """
+
+        # Matches the characters that affect the nesting of JSON values.
+        __struct_re = re.compile(r'[\[\]{}"]')
+        # Matches the remainder of a JSON string, including its closing quote.
+        __string_re = re.compile(r'(?:[^"\\]|\\.)*"', re.S)
+
+        def __init__(self, fobj, bufsz=32 * 1024):
+                self.__buf = ""
+                self.__bufsz = bufsz
+                self.__eof = False
+                self.__fobj = fobj
+                self.__pos = 0
+
+        def __fill(self, size=None):
+                """Reads more data into the buffer, discarding any that has
+                already been consumed.  Returns False if no more data could
+                be read."""
+
+                if self.__eof:
+                        return False
+                if self.__pos:
+                        self.__buf = self.__buf[self.__pos:]
+                        self.__pos = 0
+                data = self.__fobj.read(max(size or 0, self.__bufsz))
+                if not data:
+                        self.__eof = True
+                        return False
+                self.__buf += data
+                return True
+
+        def __peek(self):
+                """Skips any whitespace at the current position and returns
+                the next character, or an empty string if there is none."""
+
+                while True:
+                        buf = self.__buf
+                        pos = self.__pos
+                        while pos < len(buf) and buf[pos] in " \t\r\n":
+                                pos += 1
+                        self.__pos = pos
+                        if pos < len(buf) or not self.__fill():
+                                return buf[pos:pos + 1]
+
+        def __expect(self, char):
+                if self.__peek() != char:
+                        raise ValueError("expected '{0}' at offset {1:d}".format(
+                            char, self.__pos))
+                self.__pos += 1
+
+        def __value(self, first):
+                """Returns the raw text of the JSON object, array, or string at
+                the current position and advances past it.  'first' is the
+                character the value is expected to begin with."""
+
+                if self.__peek() != first:
+                        raise ValueError("expected '{0}' at offset {1:d}".format(
+                            first, self.__pos))
+
+                # Offsets are tracked relative to the start of the value since
+                # reading more data discards the consumed part of the buffer.
+                depth = 1
+                in_string = first == '"'
+                rel = 1
+                while depth:
+                        buf = self.__buf
+                        start = self.__pos
+                        if in_string:
+                                m = self.__string_re.match(buf, start + rel)
+                                if not m:
+                                        # Read at least as much as has been
+                                        # buffered for the value so far so
+                                        # that large values aren't rescanned
+                                        # repeatedly.
+                                        if not self.__fill(len(buf) - start):
+                                                break
+                                        continue
+                                rel = m.end() - start
+                                in_string = False
+                                if first == '"':
+                                        depth = 0
+                                continue
+
+                        m = self.__struct_re.search(buf, start + rel)
+                        if not m:
+                                rel = len(buf) - start
+                                if not self.__fill(rel):
+                                        break
+                                continue
+
+                        c = m.group()
+                        rel = m.end() - start
+                        if c == '"':
+                                in_string = True
+                        elif c in "[{":
+                                depth += 1
+                        else:
+                                depth -= 1
+
+                if depth:
+                        raise ValueError("unexpected end of data")
+
+                start = self.__pos
+                self.__pos += rel
+                return self.__buf[start:self.__pos]
+
+        def entries(self):
+                """A generator function that produces tuples of the form (pub,
+                stem, raw) in the order they are stored, where 'raw' is the
+                JSON text of the list of version entries for the package stem.
+                Entries in the reserved catalog namespace (such as signature
+                data) are skipped."""
+
+                for pub in self.__members():
+                        if pub.startswith("_"):
+                                # Part of the reserved catalog namespace.
+                                self.__value(self.__peek())
+                                continue
+                        for stem in self.__members():
+                                yield pub, stem, self.__value("[")
+
+                if self.__peek():
+                        raise ValueError("unexpected data at offset "
+                            "{0:d}".format(self.__pos))
+
+        def __members(self):
+                """A generator function that produces the key of each member of
+                the JSON object at the current position.  The caller must
+                consume the value of each member before resuming."""
+
+                self.__expect("{")
+                if self.__peek() == "}":
+                        self.__pos += 1
+                        return
+
+                while True:
+                        key = json.loads(self.__value('"'))
+                        self.__expect(":")
+                        yield key
+                        c = self.__peek()
+                        if c == "}":
+                                self.__pos += 1
+                                return
+                        self.__expect(",")
+
+
+class _BinaryPart(object):
+        """Private helper class used to read and write the binary companion
+        of a catalog part.
+
+        The companion is stored as <part pathname>.bin and contains one JSON
+        record per package stem, each record being a dict of the version
+        entries for that stem indexed by publisher prefix.  Records are
+        sorted by stem and located using a table of fixed-width offsets, so
+        a single stem can be found by binary search over the memory-mapped
+        file without decoding any other part of the catalog.
+
+        The size and modification time of the JSON part the companion was
+        generated from are recorded in its header; if they no longer match
+        the part on-disk, the companion is considered stale and ignored."""
+
+        SUFFIX = ".bin"
+
+        # magic, source size, source mtime (ns), stem count, table offset
+        __HEADER = struct.Struct("<8sQqQQ")
+        # stem offset, stem length, record offset, record length
+        __ENTRY = struct.Struct("<QIQI")
+        __MAGIC = b"PKG5CBP1"
+
+        def __init__(self, fobj, mm, count, table_offset):
+                self.__cache = {}
+                self.__count = count
+                self.__fobj = fobj
+                self.__mm = mm
+                self.__table_offset = table_offset
+
+        @classmethod
+        def open(cls, src_pathname):
+                """Returns a _BinaryPart object for the companion of the
+                catalog part at 'src_pathname', or None if the companion
+                does not exist, is invalid, or is stale."""
+
+                try:
+                        src_stat = os.stat(src_pathname)
+                        fobj = open(src_pathname + cls.SUFFIX, "rb")
+                except EnvironmentError:
+                        return None
+
+                try:
+                        mm = mmap.mmap(fobj.fileno(), 0,
+                            access=mmap.ACCESS_READ)
+                except (EnvironmentError, ValueError):
+                        # Empty or unmappable file.
+                        fobj.close()
+                        return None
+
+                try:
+                        magic, size, mtime, count, toff = \
+                            cls.__HEADER.unpack_from(mm, 0)
+                except struct.error:
+                        magic = None
+
+                if magic != cls.__MAGIC or size != src_stat.st_size or \
+                    mtime != src_stat.st_mtime_ns or \
+                    toff + count * cls.__ENTRY.size > len(mm):
+                        mm.close()
+                        fobj.close()
+                        return None
+                return cls(fobj, mm, count, toff)
+
+        @classmethod
+        def write(cls, src_pathname, data, file_mode):
+                """Writes the binary companion for the catalog part at
+                'src_pathname' using the part's 'data'.  The part must have
+                already been written so that its size and modification time
+                can be recorded."""
+
+                records = {}
+                for pub in data:
+                        if pub[0] == "_":
+                                # Reserved catalog namespace.
+                                continue
+                        for stem, ver_list in six.iteritems(data[pub]):
+                                records.setdefault(misc.force_bytes(stem),
+                                    OrderedDict())[pub] = ver_list
+
+                stems = sorted(records)
+                src_stat = os.stat(src_pathname)
+                pathname = src_pathname + cls.SUFFIX
+                tmp_pathname = pathname + ".new"
+
+                try:
+                        with open(tmp_pathname, "wb") as tfile:
+                                toff = cls.__HEADER.size
+                                tfile.write(cls.__HEADER.pack(cls.__MAGIC,
+                                    src_stat.st_size, src_stat.st_mtime_ns,
+                                    len(stems), toff))
+
+                                # Leave room for the offset table; it is
+                                # filled in once all records are written.
+                                tfile.write(b"\0" * (len(stems) *
+                                    cls.__ENTRY.size))
+
+                                table = []
+                                offset = toff + len(stems) * cls.__ENTRY.size
+                                for stem in stems:
+                                        rec = misc.force_bytes(json.dumps(
+                                            records[stem]))
+                                        tfile.write(stem)
+                                        tfile.write(rec)
+                                        table.append(cls.__ENTRY.pack(offset,
+                                            len(stem), offset + len(stem),
+                                            len(rec)))
+                                        offset += len(stem) + len(rec)
+
+                                tfile.seek(toff)
+                                tfile.write(b"".join(table))
+                        os.chmod(tmp_pathname, file_mode)
+                        portable.rename(tmp_pathname, pathname)
+                except EnvironmentError as e:
+                        if e.errno == errno.EACCES:
+                                raise api_errors.PermissionsException(
+                                    e.filename)
+                        if e.errno == errno.EROFS:
+                                raise api_errors.ReadOnlyFileSystemException(
+                                    e.filename)
+                        raise
+
+        def close(self):
+                """Releases the mapping of the companion file."""
+
+                if self.__mm is not None:
+                        self.__mm.close()
+                        self.__fobj.close()
+                self.__mm = self.__fobj = None
+                self.__cache = {}
+
+        def get(self, stem):
+                """Returns a dict of the version entries for 'stem' indexed by
+                publisher prefix, or None if the stem is not present.  Callers
+                should not modify any of the data that is returned."""
+
+                try:
+                        return self.__cache[stem]
+                except KeyError:
+                        pass
+
+                mm = self.__mm
+                esize = self.__ENTRY.size
+                toff = self.__table_offset
+                target = misc.force_bytes(stem)
+
+                rec = None
+                lo, hi = 0, self.__count
+                while lo < hi:
+                        mid = (lo + hi) // 2
+                        soff, slen, roff, rlen = self.__ENTRY.unpack_from(mm,
+                            toff + mid * esize)
+                        cur = mm[soff:soff + slen]
+                        if cur < target:
+                                lo = mid + 1
+                        elif cur > target:
+                                hi = mid
+                        else:
+                                rec = json.loads(misc.force_text(
+                                    mm[roff:roff + rlen]))
+                                break
+
+                self.__cache[stem] = rec
+                return rec
+
+
+class _StemIndex(object):
+        """Private helper class providing a sorted index of the package stems
+        in a catalog, along with a reverse index of the stems indexed by
+        their leaf name (the last component of the stem).  It is used to
+        narrow the set of stems that package patterns have to be matched
+        against.
+
+        The index is stored as <meta_root>/catalog.stems when the catalog is
+        saved.  The size and modification time of the base catalog part
+        the index was generated from are recorded with it; if they no longer
+        match the part on-disk, the stored index is considered stale and
+        ignored."""
+
+        NAME = "catalog.stems"
+
+        def __init__(self, stems, leaves=None):
+                self.stems = sorted(stems)
+                if leaves is None:
+                        leaves = {}
+                        for stem in self.stems:
+                                leaves.setdefault(stem.rsplit("/", 1)[-1],
+                                    []).append(stem)
+                self.leaves = leaves
+
+        @classmethod
+        def load(cls, meta_root, src_pathname):
+                """Returns the _StemIndex stored in 'meta_root' for the base
+                catalog part at 'src_pathname', or None if it does not exist,
+                is invalid, or is stale."""
+
+                try:
+                        src_stat = os.stat(src_pathname)
+                        with open(os.path.join(meta_root, cls.NAME),
+                            "rb") as fobj:
+                                data = json.load(fobj)
+                        size, mtime = data["source"]
+                        stems = data["stems"]
+                        leaves = data["leaves"]
+                except (EnvironmentError, ValueError, KeyError, TypeError):
+                        return None
+
+                if size != src_stat.st_size or mtime != src_stat.st_mtime_ns:
+                        return None
+                return cls(stems, leaves=leaves)
+
+        def save(self, meta_root, src_pathname, file_mode):
+                """Stores the index in 'meta_root' for the base catalog part
+                at 'src_pathname'.  The part must have already been written
+                so that its size and modification time can be recorded."""
+
+                src_stat = os.stat(src_pathname)
+                pathname = os.path.join(meta_root, self.NAME)
+                tmp_pathname = pathname + ".new"
+                try:
+                        with open(tmp_pathname, "w") as fobj:
+                                json.dump({
+                                    "leaves": self.leaves,
+                                    "source": [src_stat.st_size,
+                                        src_stat.st_mtime_ns],
+                                    "stems": self.stems,
+                                }, fobj)
+                        os.chmod(tmp_pathname, file_mode)
+                        portable.rename(tmp_pathname, pathname)
+                except EnvironmentError as e:
+                        if e.errno == errno.EACCES:
+                                raise api_errors.PermissionsException(
+                                    e.filename)
+                        if e.errno == errno.EROFS:
+                                raise api_errors.ReadOnlyFileSystemException(
+                                    e.filename)
+                        raise
+
+        def matching(self, pattern, matcher):
+                """A generator function that produces the stems matching
+                'pattern' using 'matcher', which must be one of the pkg.fmri
+                matching functions exact_name_match, fmri_match, or
+                glob_match.  Results are in stem order."""
+
+                stems = self.stems
+                if matcher == fmri.exact_name_match:
+                        i = bisect.bisect_left(stems, pattern)
+                        if i < len(stems) and stems[i] == pattern:
+                                yield pattern
+                        return
+
+                if matcher == fmri.fmri_match:
+                        # The leaf name of a matching stem must be the same
+                        # as that of the pattern.
+                        for stem in self.leaves.get(
+                            pattern.rsplit("/", 1)[-1], EmptyI):
+                                if matcher(stem, pattern):
+                                        yield stem
+                        return
+
+                # For glob patterns, the candidates can be narrowed to
+                # those stems sharing the pattern's literal prefix, or if
+                # the last component of the pattern is literal, to those
+                # stems with a matching leaf name.
+                head, sep, leaf = pattern.rpartition("/")
+                wild = "*?["
+                if sep and not any(c in leaf for c in wild):
+                        cands = self.leaves.get(leaf, EmptyI)
+                else:
+                        prefix = pattern
+                        for i, c in enumerate(pattern):
+                                if c in wild:
+                                        prefix = pattern[:i]
+                                        break
+                        start = bisect.bisect_left(stems, prefix)
+                        cands = itertools.takewhile(
+                            lambda stem: stem.startswith(prefix),
+                            itertools.islice(stems, start, None))
+
+                for stem in cands:
+                        if matcher(stem, pattern):
+                                yield stem
+
+
+class _TrustedState(object):
+        """Private helper class used to record the state of catalog files
+        that have been successfully validated.
+
+        For each file, the size, modification time, and inode number of the
+        file are recorded along with the signature data it was validated
+        against.  If all of these still match, the file does not need to be
+        validated again.  The state is stored in <meta_root>/catalog.trusted
+        and is discarded along with the rest of the catalog."""
+
+        NAME = "catalog.trusted"
+
+        def __init__(self, meta_root):
+                self.meta_root = meta_root
+                self.__changed = False
+                try:
+                        with open(os.path.join(meta_root, self.NAME),
+                            "rb") as fobj:
+                                self.__data = json.load(fobj)
+                        if type(self.__data) != dict:
+                                raise ValueError(self.__data)
+                except (EnvironmentError, ValueError):
+                        self.__data = {}
+
+        def __file_state(self, name):
+                try:
+                        st = os.stat(os.path.join(self.meta_root, name))
+                except EnvironmentError:
+                        return None
+                return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+        def add(self, name, signatures):
+                """Records the current state of the named file as having been
+                validated against 'signatures'."""
+
+                fstate = self.__file_state(name)
+                if fstate is None:
+                        return
+                self.__data[name] = { "signatures": signatures,
+                    "state": fstate }
+                self.__changed = True
+
+        def is_trusted(self, name, signatures):
+                """Returns a boolean indicating whether the named file was
+                validated against 'signatures' and is unchanged since."""
+
+                entry = self.__data.get(name)
+                if not entry or not signatures:
+                        return False
+                return entry.get("signatures") == signatures and \
+                    entry.get("state") == self.__file_state(name)
+
+        def save(self, file_mode):
+                """Stores the recorded state if it has changed.  Since the
+                state is only an optimization, failure to store it because
+                of permissions is ignored."""
+
+                if not self.__changed:
+                        return
+
+                pathname = os.path.join(self.meta_root, self.NAME)
+                tmp_pathname = pathname + ".new"
+                try:
+                        with open(tmp_pathname, "w") as fobj:
+                                json.dump(self.__data, fobj)
+                        os.chmod(tmp_pathname, file_mode)
+                        portable.rename(tmp_pathname, pathname)
+                except EnvironmentError as e:
+                        if e.errno not in (errno.EACCES, errno.EROFS):
+                                raise
+                        return
+                self.__changed = False
+
+
+# Version objects for catalog entries are shared using the Flyweight design
+# pattern (as is done for pkg.version.DotSequence), since the same versions
+# occur many times within and across catalogs and are relatively expensive to
+# create and store.  As a result, the versions of the FMRIs produced by catalog
+# interfaces must not be modified.
+_version_pool = weakref.WeakValueDictionary()
+
+def _intern_version(sver):
+        """Returns the canonical Version object for the version string
+        'sver'."""
+
+        ver = _version_pool.get(sver)
+        if ver is None:
+                _version_pool[sver] = ver = pkg.version.Version(sver)
+        return ver
+
+def _intern_fmri(pub, stem, sver):
+        """Returns a new PkgFmri object for the given FMRI components that
+        uses the canonical Version object for 'sver'."""
+
+        pfmri = fmri.PkgFmri(name=stem, publisher=pub)
+        pfmri.version = _intern_version(sver)
+        return pfmri
+
+
 class CatalogPartBase(object):
         """A CatalogPartBase object is an abstract class containing core
         functionality shared between CatalogPart and CatalogAttrs."""
 
         # The file mode to be used for all catalog files.
-        __file_mode = stat.S_IRUSR|stat.S_IWUSR|stat.S_IRGRP|stat.S_IROTH
+        _file_mode = stat.S_IRUSR|stat.S_IWUSR|stat.S_IRGRP|stat.S_IROTH
 
         __meta_root = None
         last_modified = None
@@ -238,6 +780,84 @@ class CatalogPartBase(object):
                 f.save()
                 return f.signatures()
 
+        def _file_signatures(self):
+                """Returns a tuple of the form (stored, computed) containing
+                the signature data stored in the file for the part and the
+                signature data for the text it was generated from, or None if
+                the file contains no signature data.
+
+                The signature data is computed directly from the text of the
+                file in fixed-size blocks, which avoids the cost of loading
+                and serializing the part's data again and allows the hashing
+                to proceed while other threads perform I/O."""
+
+                marker = b'"_SIGNATURE":'
+                try:
+                        fobj = open(self.pathname, "rb")
+                except EnvironmentError:
+                        return None
+
+                with fobj:
+                        size = os.fstat(fobj.fileno()).st_size
+                        # The signature data is always the last member of the
+                        # top-level object and is of a small, bounded size.
+                        tail_start = max(0, size - 1024)
+                        fobj.seek(tail_start)
+                        tail = fobj.read()
+                        idx = tail.rfind(marker)
+                        if idx < 1 or not tail.endswith(b"}\n"):
+                                return None
+
+                        try:
+                                stored = json.loads(misc.force_text(
+                                    tail[idx + len(marker):-2]))
+                        except ValueError:
+                                return None
+                        if type(stored) != dict:
+                                return None
+
+                        # Signatures are generated for the text written before
+                        # the signature data (and any separator) was added.
+                        end = tail_start + idx
+                        sep = tail[idx - 1:idx]
+                        if sep == b",":
+                                end -= 1
+                        elif sep != b"{":
+                                return None
+
+                        sha_1 = hashlib.sha1()
+                        fobj.seek(0)
+                        remaining = end
+                        while remaining > 0:
+                                data = fobj.read(min(remaining, 1024 * 1024))
+                                if not data:
+                                        return None
+                                sha_1.update(data)
+                                remaining -= len(data)
+                        sha_1.update(b"}\n")
+
+                return stored, { "sha-1": sha_1.hexdigest() }
+
+        def _validate_file(self, signatures=None):
+                """Attempts to validate the unloaded part directly using the
+                text of its file.  Returns False if that wasn't possible and
+                the part must be loaded instead; otherwise returns True or
+                raises BadCatalogSignatures on failure."""
+
+                if self.loaded or not self.exists:
+                        return False
+
+                result = self._file_signatures()
+                if result is None:
+                        return False
+
+                stored, new_signatures = result
+                if not signatures:
+                        signatures = stored
+                if new_signatures != signatures:
+                        raise api_errors.BadCatalogSignatures(self.pathname)
+                return True
+
         def __get_meta_root(self):
                 return self.__meta_root
 
@@ -356,7 +976,7 @@ class CatalogPartBase(object):
 
                 # Ensure the permissions on the new file are correct.
                 try:
-                        os.chmod(self.pathname, self.__file_mode)
+                        os.chmod(self.pathname, self._file_mode)
                 except EnvironmentError as e:
                         if e.errno == errno.EACCES:
                                 raise api_errors.PermissionsException(
@@ -379,20 +999,31 @@ class CatalogPart(CatalogPartBase):
         """A CatalogPart object is the representation of a subset of the package
         FMRIs available from a package repository."""
 
+        __binary_part = None
         __data = None
+        binary = False
         ordered = None
 
-        def __init__(self, name, meta_root=None, ordered=True, sign=True):
-                """Initializes a CatalogPart object."""
+        def __init__(self, name, meta_root=None, ordered=True, sign=True,
+            binary=False):
+                """Initializes a CatalogPart object.
+
+                'binary' is an optional boolean value indicating whether a
+                binary companion of the part should be written on save().
+                If a current companion exists on-disk, it is always used
+                to satisfy lookups for individual package stems until the
+                part is fully loaded, regardless of this value."""
 
                 self.__data = {}
+                self.binary = binary
                 self.ordered = ordered
                 if not name.startswith("catalog."):
                         raise UnrecognizedCatalogPart(name)
                 CatalogPartBase.__init__(self, name, meta_root=meta_root,
                     sign=sign)
 
-        def __iter_entries(self, last=False, ordered=False, pubs=EmptyI):
+        def __iter_entries(self, last=False, ordered=False, pubs=EmptyI,
+            names=None):
                 """Private generator function to iterate over catalog entries.
 
                 'last' is a boolean value that indicates only the last entry
@@ -408,36 +1039,117 @@ class CatalogPart(CatalogPartBase):
                 basis.
 
                 'pubs' is an optional list of publisher prefixes to restrict
-                the results to."""
+                the results to.
 
-                self.load()
-                if ordered:
-                        stems = self.pkg_names(pubs=pubs)
+                'names' is an optional collection of package stems to restrict
+                the results to.  If provided, the part will not be loaded if
+                the entries can be retrieved from its binary companion."""
+
+                if names is not None:
+                        ver_lists = self.__named_entries(names,
+                            ordered=ordered, pubs=pubs)
                 else:
-                        stems = (
-                            (pub, stem)
-                            for pub in self.publishers(pubs=pubs)
-                            for stem in self.__data[pub]
+                        self.load()
+                        if ordered:
+                                stems = self.pkg_names(pubs=pubs)
+                        else:
+                                stems = (
+                                    (pub, stem)
+                                    for pub in self.publishers(pubs=pubs)
+                                    for stem in self.__data[pub]
+                                )
+                        ver_lists = (
+                            (pub, stem, self.__data[pub][stem])
+                            for pub, stem in stems
                         )
 
                 if last:
                         return (
-                            (pub, stem, self.__data[pub][stem][-1])
-                            for pub, stem in stems
+                            (pub, stem, ver_list[-1])
+                            for pub, stem, ver_list in ver_lists
                         )
 
                 if ordered:
                         return (
                             (pub, stem, entry)
-                            for pub, stem in stems
-                            for entry in reversed(self.__data[pub][stem])
+                            for pub, stem, ver_list in ver_lists
+                            for entry in reversed(ver_list)
                         )
                 return (
                     (pub, stem, entry)
-                    for pub, stem in stems
-                    for entry in self.__data[pub][stem]
+                    for pub, stem, ver_list in ver_lists
+                    for entry in ver_list
                 )
 
+        def __named_entries(self, names, ordered=False, pubs=EmptyI):
+                """Private generator function that produces tuples of the form
+                (pub, stem, ver_list) for each of the package stems in 'names'
+                found in the part.  If 'ordered' is True, results are sorted
+                by stem and then by publisher (in the order given by 'pubs' if
+                specified); otherwise they are in no particular order."""
+
+                if not ordered:
+                        for stem in names:
+                                for pub, ver_list in self.__stem_entries(stem,
+                                    pubs=pubs):
+                                        yield pub, stem, ver_list
+                        return
+
+                if pubs:
+                        pos = dict((p, i) for (i, p) in enumerate(pubs))
+                        pub_key = lambda e: pos[e[0]]
+                else:
+                        pub_key = itemgetter(0)
+
+                for stem in sorted(names):
+                        for pub, ver_list in sorted(self.__stem_entries(stem,
+                            pubs=pubs), key=pub_key):
+                                yield pub, stem, ver_list
+
+        def __get_binary_part(self):
+                """Returns the _BinaryPart object for the part's companion if
+                the part has not been loaded yet and a current companion is
+                available on-disk; otherwise, returns None."""
+
+                if self.loaded:
+                        return None
+                if self.__binary_part is None:
+                        self.__binary_part = False
+                        if self.pathname:
+                                self.__binary_part = _BinaryPart.open(
+                                    self.pathname) or False
+                return self.__binary_part or None
+
+        def __close_binary_part(self):
+                if self.__binary_part:
+                        self.__binary_part.close()
+                self.__binary_part = None
+
+        def __stem_entries(self, name, pubs=EmptyI):
+                """Private generator function that produces tuples of the form
+                (pub, ver_list) for the package stem 'name', where ver_list
+                is the list of version entries for that publisher.  If the
+                part has not been loaded yet, the entries will be retrieved
+                from the part's binary companion when possible.
+
+                'pubs' is an optional list of publisher prefixes to restrict
+                the results to."""
+
+                bpart = self.__get_binary_part()
+                if bpart is not None:
+                        rec = bpart.get(name)
+                        if not rec:
+                                return
+                        for pub, ver_list in six.iteritems(rec):
+                                if not pubs or pub in pubs:
+                                        yield pub, ver_list
+                        return
+
+                for pub in self.publishers(pubs=pubs):
+                        ver_list = self.__data[pub].get(name, None)
+                        if ver_list:
+                                yield pub, ver_list
+
         def add(self, pfmri=None, metadata=None, op_time=None, pub=None,
             stem=None, ver=None):
                 """Add a catalog entry for a given FMRI or FMRI components.
@@ -494,9 +1206,24 @@ class CatalogPart(CatalogPartBase):
                 discards all content."""
 
                 self.__data = {}
+                self.__close_binary_part()
+                if self.pathname:
+                        bpath = self.pathname + _BinaryPart.SUFFIX
+                        if os.path.exists(bpath):
+                                try:
+                                        portable.remove(bpath)
+                                except EnvironmentError as e:
+                                        if e.errno == errno.EACCES:
+                                                raise api_errors.PermissionsException(
+                                                    e.filename)
+                                        if e.errno == errno.EROFS:
+                                                raise api_errors.ReadOnlyFileSystemException(
+                                                    e.filename)
+                                        raise
                 return CatalogPartBase.destroy(self)
 
-        def entries(self, cb=None, last=False, ordered=False, pubs=EmptyI):
+        def entries(self, cb=None, last=False, ordered=False, pubs=EmptyI,
+            names=None):
                 """A generator function that produces tuples of the form
                 (fmri, entry) as it iterates over the contents of the catalog
                 part (where entry is the related catalog entry for the fmri).
@@ -523,14 +1250,16 @@ class CatalogPart(CatalogPartBase):
                 'pubs' is an optional list of publisher prefixes to restrict
                 the results to.
 
+                'names' is an optional collection of package stems to restrict
+                the results to.
+
                 Results are always in catalog version order on a per-
                 publisher, per-stem basis.
                 """
 
                 for pub, stem, entry in self.__iter_entries(last=last,
-                    ordered=ordered, pubs=pubs):
-                        f = fmri.PkgFmri(name=stem, publisher=pub,
-                            version=entry["version"])
+                    ordered=ordered, pubs=pubs, names=names):
+                        f = _intern_fmri(pub, stem, entry["version"])
                         if cb is None or cb(f, entry):
                                 yield f, entry
 
@@ -543,16 +1272,12 @@ class CatalogPart(CatalogPartBase):
                 'pubs' is an optional list of publisher prefixes to restrict
                 the results to."""
 
-                self.load()
-
                 versions = {}
                 entries = {}
-                for pub in self.publishers(pubs=pubs):
-                        ver_list = self.__data[pub].get(name, ())
+                for pub, ver_list in self.__stem_entries(name, pubs=pubs):
                         for entry in ver_list:
                                 sver = entry["version"]
-                                pfmri = fmri.PkgFmri(name=name, publisher=pub,
-                                    version=sver)
+                                pfmri = _intern_fmri(pub, name, sver)
 
                                 versions[sver] = pfmri.version
                                 entries.setdefault(sver, [])
@@ -589,8 +1314,8 @@ class CatalogPart(CatalogPartBase):
                 if objects:
                         for pub, stem, entry in self.__iter_entries(last=last,
                             ordered=ordered, pubs=pubs):
-                                yield fmri.PkgFmri(name=stem, publisher=pub,
-                                    version=entry["version"])
+                                yield _intern_fmri(pub, stem,
+                                    entry["version"])
                         return
 
                 for pub, stem, entry in self.__iter_entries(last=last,
@@ -607,19 +1332,12 @@ class CatalogPart(CatalogPartBase):
                 'pubs' is an optional list of publisher prefixes to restrict
                 the results to."""
 
-                self.load()
-
                 versions = {}
                 entries = {}
-                for pub in self.publishers(pubs=pubs):
-                        ver_list = self.__data[pub].get(name, None)
-                        if not ver_list:
-                                continue
-
+                for pub, ver_list in self.__stem_entries(name, pubs=pubs):
                         for entry in ver_list:
                                 sver = entry["version"]
-                                pfmri = fmri.PkgFmri(name=name, publisher=pub,
-                                    version=sver)
+                                pfmri = _intern_fmri(pub, name, sver)
 
                                 versions[sver] = pfmri.version
                                 entries.setdefault(sver, [])
@@ -636,15 +1354,26 @@ class CatalogPart(CatalogPartBase):
                 if pfmri and not pfmri.publisher:
                         raise api_errors.AnarchicalCatalogFMRI(str(pfmri))
 
-                # Since this is a hot path, this function checks for loaded
-                # status before attempting to call the load function.
-                if not self.loaded:
-                        self.load()
-
                 if pfmri:
                         pub, stem, ver = pfmri.tuple()
                         ver = str(ver)
 
+                # Since this is a hot path, this function checks for loaded
+                # status before attempting to call the load function.  If
+                # the part hasn't been loaded yet, only the entries for the
+                # requested stem are decoded if a binary companion exists.
+                if not self.loaded:
+                        bpart = self.__get_binary_part()
+                        if bpart is not None:
+                                rec = bpart.get(stem)
+                                if not rec:
+                                        return
+                                for entry in rec.get(pub, ()):
+                                        if entry["version"] == ver:
+                                                return entry
+                                return
+                        self.load()
+
                 pkg_list = self.__data.get(pub, None)
                 if not pkg_list:
                         return
@@ -696,7 +1425,215 @@ class CatalogPart(CatalogPartBase):
                 if self.loaded:
                         # Already loaded, or only in-memory.
                         return
-                self.__data = CatalogPartBase.load(self)
+                data = CatalogPartBase.load(self)
+
+                # Publisher prefixes and package stems are interned so that
+                # a single copy of each is shared by all of the catalog parts
+                # (and the FMRIs generated from them).
+                intern = sys.intern
+                for pub in list(data):
+                        pkg_list = data.pop(pub)
+                        if pub[0] != "_":
+                                pkg_list = dict(
+                                    (intern(stem), ver_list)
+                                    for stem, ver_list in six.iteritems(pkg_list)
+                                )
+                        data[intern(pub)] = pkg_list
+                self.__data = data
+
+                # The companion is no longer needed once all of the part's
+                # data is available.
+                self.__close_binary_part()
+
+        def merge(self, updates, pathname, signatures=None):
+                """Applies a set of catalog updates to the stored content of
+                the catalog part and writes the result to 'pathname' in a
+                single sequential pass.  Only the entries for the package
+                stems being updated are decoded, so memory use is bounded by
+                the size of the updates rather than that of the part.  The
+                caller is responsible for moving the result into place.
+
+                'updates' is a dict of lists of tuples of the form (pfmri,
+                op_type, op_time, metadata) indexed by (pub, stem) tuple,
+                where each list is in the order the operations should be
+                applied.
+
+                'signatures' is an optional dict of signature data that the
+                new content must match; if it does not, BadCatalogSignatures
+                will be raised.
+
+                The part must have been stored with sorted keys (as is the
+                case for signed parts) and must not be loaded.  A set of the
+                names of the packages in the new content is returned."""
+
+                assert not self.loaded
+
+                def write(data):
+                        data = data.encode("utf-8")
+                        sha_1.update(data)
+                        out.write(data)
+
+                location = self.pathname
+                sha_1 = hashlib.sha1()
+                names = set()
+                last_modified = None
+                fobj = out = None
+                try:
+                        fobj = open(location, "r", encoding="utf-8")
+                        out = open(pathname, "wb")
+                except EnvironmentError as e:
+                        if fobj:
+                                fobj.close()
+                        if e.errno == errno.ENOENT:
+                                raise api_errors.RetrievalError(e,
+                                    location=location)
+                        if e.errno == errno.EACCES:
+                                raise api_errors.PermissionsException(
+                                    e.filename)
+                        if e.errno == errno.EROFS:
+                                raise api_errors.ReadOnlyFileSystemException(
+                                    e.filename)
+                        raise
+
+                try:
+                        # New package stems are merged into the existing ones
+                        # in key order so that the result is identical to
+                        # what would be written if the part were loaded,
+                        # updated, and saved.
+                        pending = sorted(updates)
+                        def gen_stems():
+                                i = 0
+                                for pub, stem, raw in _JSONReader(
+                                    fobj).entries():
+                                        key = (pub, stem)
+                                        while i < len(pending) and \
+                                            pending[i] < key:
+                                                yield pending[i] + (None,)
+                                                i += 1
+                                        if i < len(pending) and \
+                                            pending[i] == key:
+                                                i += 1
+                                        yield pub, stem, raw
+                                for key in pending[i:]:
+                                        yield key + (None,)
+
+                        write("{")
+                        cur_pub = None
+                        for pub, stem, raw in gen_stems():
+                                ops = updates.get((pub, stem))
+                                if ops:
+                                        ver_list = self.__merge_entries(
+                                            json.loads(raw) if raw else [],
+                                            ops)
+                                        if not ver_list:
+                                                # All versions of the package
+                                                # were removed.
+                                                continue
+                                        raw = json.dumps(ver_list,
+                                            sort_keys=True)
+                                        for op in ops:
+                                                if last_modified is None or \
+                                                    op[2] > last_modified:
+                                                        last_modified = op[2]
+
+                                if pub != cur_pub:
+                                        if cur_pub is not None:
+                                                write("},")
+                                        write(json.dumps(pub) + ":{")
+                                        cur_pub = pub
+                                else:
+                                        write(",")
+                                write(json.dumps(stem) + ":" + raw)
+                                names.add(stem)
+
+                        if cur_pub is not None:
+                                write("}")
+                        # Account for the trailing content written by
+                        # _JSONWriter before the signature data is added.
+                        sha_1.update(b"}\n")
+
+                        new_signatures = {}
+                        if self.sign:
+                                new_signatures["sha-1"] = sha_1.hexdigest()
+                                if cur_pub is not None:
+                                        out.write(b",")
+                                out.write(b'"_SIGNATURE":')
+                                out.write(misc.force_bytes(json.dumps(
+                                    new_signatures)))
+                        out.write(b"}\n")
+                        out.close()
+
+                        if signatures and new_signatures != signatures:
+                                raise api_errors.BadCatalogSignatures(
+                                    location)
+
+                        os.chmod(pathname, self._file_mode)
+                        if last_modified:
+                                mtime = calendar.timegm(
+                                    last_modified.utctimetuple())
+                                os.utime(pathname, (mtime, mtime))
+                except ValueError:
+                        # Not a valid catalog file.
+                        portable.remove(pathname)
+                        raise api_errors.InvalidCatalogFile(location)
+                except EnvironmentError as e:
+                        portable.remove(pathname)
+                        if e.errno == errno.EACCES:
+                                raise api_errors.PermissionsException(
+                                    e.filename)
+                        if e.errno == errno.EROFS:
+                                raise api_errors.ReadOnlyFileSystemException(
+                                    e.filename)
+                        raise
+                except:
+                        portable.remove(pathname)
+                        raise
+                finally:
+                        fobj.close()
+                        out.close()
+
+                self.signatures = new_signatures
+                if last_modified:
+                        self.last_modified = last_modified
+                return names
+
+        def __merge_entries(self, ver_list, ops):
+                """Applies the catalog operations in 'ops' to the list of
+                version entries for a package stem and returns it."""
+
+                added = False
+                for pfmri, op_type, op_time, metadata in ops:
+                        ver = str(pfmri.version)
+                        for i, entry in enumerate(ver_list):
+                                if entry["version"] == ver:
+                                        break
+                        else:
+                                i = None
+
+                        if op_type == CatalogUpdate.ADD:
+                                if i is not None:
+                                        raise api_errors.DuplicateCatalogEntry(
+                                            pfmri, operation="add",
+                                            catalog_name=self.pathname)
+                                if metadata is not None:
+                                        entry = metadata
+                                else:
+                                        entry = {}
+                                entry["version"] = ver
+                                ver_list.append(entry)
+                                added = True
+                        elif op_type == CatalogUpdate.REMOVE:
+                                if i is None:
+                                        raise api_errors.UnknownCatalogEntry(
+                                            pfmri.get_fmri())
+                                del ver_list[i]
+                        else:
+                                raise api_errors.UnknownUpdateType(op_type)
+
+                if added:
+                        ver_list.sort(key=lambda entry: pkg.version.Version(
+                            entry["version"]))
+                return ver_list
 
         def names(self, pubs=EmptyI):
                 """Returns a set containing the names of all the packages in
@@ -814,6 +1751,9 @@ class CatalogPart(CatalogPartBase):
                 self.load()
 
                 CatalogPartBase.save(self, self.__data, single_pass=single_pass)
+                if self.binary:
+                        _BinaryPart.write(self.pathname, self.__data,
+                            self._file_mode)
 
         def sort(self, pfmris=None, pubs=None):
                 """Re-sorts the contents of the CatalogPart such that version
@@ -884,7 +1824,8 @@ class CatalogPart(CatalogPartBase):
                         ordered=ordered, pubs=pubs)
                 )
 
-        def tuple_entries(self, cb=None, last=False, ordered=False, pubs=EmptyI):
+        def tuple_entries(self, cb=None, last=False, ordered=False, pubs=EmptyI,
+            names=None):
                 """A generator function that produces tuples of the form ((pub,
                 stem, version), entry) as it iterates over the contents of the
                 catalog part (where entry is the related catalog entry for the
@@ -912,11 +1853,14 @@ class CatalogPart(CatalogPartBase):
                 'pubs' is an optional list of publisher prefixes to restrict
                 the results to.
 
+                'names' is an optional collection of package stems to restrict
+                the results to.
+
                 Results are always in catalog version order on a per-publisher,
                 per-stem basis."""
 
                 for pub, stem, entry in self.__iter_entries(last=last,
-                    ordered=ordered, pubs=pubs):
+                    ordered=ordered, pubs=pubs, names=names):
                         t = (pub, stem, entry["version"])
                         if cb is None or cb(t, entry):
                                 yield t, entry
@@ -932,6 +1876,9 @@ class CatalogPart(CatalogPartBase):
                         # Nothing to validate, and we're not required to.
                         return
 
+                if self._validate_file(signatures=signatures):
+                        return
+
                 # Ensure content is loaded before attempting to retrieve
                 # or generate signature data.
                 self.load()
@@ -1090,6 +2037,9 @@ class CatalogUpdate(CatalogPartBase):
                         # Nothing to validate, and we're not required to.
                         return
 
+                if self._validate_file(signatures=signatures):
+                        return
+
                 # Ensure content is loaded before attempting to retrieve
                 # or generate signature data.
                 self.load()
@@ -1324,6 +2274,9 @@ class Catalog(object):
         __DEPS_PART = "catalog.dependency.C"
         __SUMM_PART_PFX = "catalog.summary"
 
+        # The maximum number of threads used to validate catalog files.
+        __MAX_VALIDATE_WORKERS = 8
+
         # The file mode to be used for all catalog files.
         __file_mode = stat.S_IRUSR|stat.S_IWUSR|stat.S_IRGRP|stat.S_IROTH
 
@@ -1332,10 +2285,12 @@ class Catalog(object):
         # found near the end of the class definition.
         _attrs = None
         __batch_mode = None
+        __binary_parts = None
         __lock = None
         __manifest_cb = None
         __meta_root = None
         __sign = None
+        __stem_index = None
 
         # These are used to cache or store CatalogPart and CatalogUpdate objects
         # as they are used.  It should not be confused with the CatalogPart
@@ -1347,7 +2302,7 @@ class Catalog(object):
         DEPENDENCY, SUMMARY = range(2)
 
         def __init__(self, batch_mode=False, meta_root=None, log_updates=False,
-            manifest_cb=None, read_only=False, sign=True):
+            manifest_cb=None, read_only=False, sign=True, binary_parts=False):
                 """Initializes a Catalog object.
 
                 'batch_mode' is an optional boolean value that indicates that
@@ -1382,9 +2337,20 @@ class Catalog(object):
                 the catalog data should have signature data generated and
                 embedded when serialized.  This option is primarily a matter
                 of convenience for callers that wish to trade integrity checks
-                for improved catalog serialization performance."""
+                for improved catalog serialization performance.
+
+                'binary_parts' is an optional boolean value that indicates
+                that a binary companion should be written for each catalog
+                part when the catalog is saved.  Companions allow lookups
+                of individual package stems (e.g. get_entry(),
+                entries_by_version(), and fmris_by_version()) to avoid
+                loading entire catalog parts.  They are not signed and are
+                only intended for use with catalogs that are local to the
+                system, such as image catalogs."""
 
                 self.__batch_mode = batch_mode
+                self.__binary_parts = binary_parts
+                self.__journal = None
                 self.__manifest_cb = manifest_cb
                 self.__parts = {}
                 self.__updates = {}
@@ -1426,6 +2392,19 @@ class Catalog(object):
                                 else:
                                         yield f, EmptyI
 
+        def __add_entries(self, pfmri, pentries, op_time):
+                """Private helper function that adds the entries for a package
+                to each of the named catalog parts in 'pentries' and logs the
+                update.  Caller is responsible for locking the catalog."""
+
+                entries = {}
+                for pname, entry in six.iteritems(pentries):
+                        part = self.get_part(pname)
+                        entries[part.name] = part.add(pfmri, metadata=entry,
+                            op_time=op_time)
+                self.__log_update(pfmri, CatalogUpdate.ADD, op_time,
+                    entries=entries)
+
         def __append(self, src, cb=None, pfmri=None, pubs=EmptyI):
                 """Private version; caller responsible for locking."""
 
@@ -1517,8 +2496,8 @@ class Catalog(object):
                                 npart.add(f, metadata=nentry, op_time=op_time)
 
         def __entries(self, cb=None, info_needed=EmptyI,
-            last_version=False, locales=None, ordered=False, pubs=EmptyI,
-            tuples=False):
+            last_version=False, locales=None, names=None, ordered=False,
+            pubs=EmptyI, tuples=False):
                 base = self.get_part(self.__BASE_PART, must_exist=True)
                 if base is None:
                         # Catalog contains nothing.
@@ -1556,7 +2535,8 @@ class Catalog(object):
 
                 if tuples:
                         for r, bentry in base.tuple_entries(cb=cb,
-                            last=last_version, ordered=ordered, pubs=pubs):
+                            last=last_version, ordered=ordered, pubs=pubs,
+                            names=names):
                                 pub, stem, ver = r
                                 mdata = {}
                                 merge_entry(bentry, mdata)
@@ -1577,7 +2557,7 @@ class Catalog(object):
                         return
 
                 for f, bentry in base.entries(cb=cb, last=last_version,
-                    ordered=ordered, pubs=pubs):
+                    names=names, ordered=ordered, pubs=pubs):
                         mdata = {}
                         merge_entry(bentry, mdata)
                         for part in parts:
@@ -1620,6 +2600,32 @@ class Catalog(object):
                 self._attrs.package_version_count = \
                     package_version_count
 
+        def __flush_journal(self):
+                """Adds the packages recorded in the journal of the active bulk
+                session (if any) to the catalog.  All of them are added using
+                the same operation time so that they are recorded as a single
+                change in the catalog's attributes and update logs.  Caller
+                is responsible for locking the catalog."""
+
+                if not self.__journal:
+                        return
+
+                journal = self.__journal
+                self.__journal = {}
+
+                old_batch_mode = self.batch_mode
+                self.batch_mode = True
+                try:
+                        op_time = datetime.datetime.utcnow()
+                        for pfmri, pentries in six.itervalues(journal):
+                                self.__add_entries(pfmri, pentries, op_time)
+                finally:
+                        self.batch_mode = old_batch_mode
+
+                # The affected entries were not sorted as they were added.
+                self.__finalize(pfmris=set(
+                    pfmri for pfmri, pentries in six.itervalues(journal)))
+
         @staticmethod
         def __gen_actions(pfmri, actions, excludes=EmptyI):
                 errors = None
@@ -1726,6 +2732,29 @@ class Catalog(object):
         def __get_sign(self):
                 return self.__sign
 
+        def __get_stem_index(self):
+                """Returns a _StemIndex object for the catalog's current
+                contents, loading it from meta_root if possible."""
+
+                base = self.get_part(self.__BASE_PART, must_exist=True)
+                if base is None:
+                        return _StemIndex(EmptyI)
+
+                # The cached index is only valid as long as the base part
+                # has not been changed since it was generated.
+                if self.__stem_index is not None:
+                        lm, sindex = self.__stem_index
+                        if lm == base.last_modified:
+                                return sindex
+
+                sindex = None
+                if not base.loaded and self.meta_root:
+                        sindex = _StemIndex.load(self.meta_root, base.pathname)
+                if sindex is None:
+                        sindex = _StemIndex(base.names())
+                self.__stem_index = (base.last_modified, sindex)
+                return sindex
+
         def __get_update(self, name, cache=True, must_exist=False):
                 # First, check if the update has already been cached,
                 # and if so, return it.
@@ -1911,6 +2940,15 @@ class Catalog(object):
                         for n, v in six.iteritems(part.signatures):
                                 entry["signature-{0}".format(n)] = v
 
+                        if name == self.__BASE_PART and self.meta_root:
+                                # Store the index of package stems alongside
+                                # the base part it was generated from.
+                                sindex = _StemIndex(part.names())
+                                sindex.save(self.meta_root, part.pathname,
+                                    self.__file_mode)
+                                self.__stem_index = (part.last_modified,
+                                    sindex)
+
                 # Finally, save the catalog attributes.
                 attrs.save()
 
@@ -2130,58 +3168,67 @@ class Catalog(object):
                             "summary": sum_acts,
                         }
 
+                # Determine the entries to add to each catalog part first;
+                # the manifest isn't needed after that.
+                pentries = {}
+                entry = {}
+                if metadata:
+                        entry["metadata"] = metadata
+                if manifest:
+                        for k, v in six.iteritems(manifest.signatures):
+                                entry["signature-{0}".format(k)] = v
+                # Always add packages to the base catalog.
+                pentries[self.__BASE_PART] = entry
+
+                if manifest:
+                        # Without a manifest, only the base catalog data
+                        # can be populated.
+
+                        # Only dependency and set actions are currently
+                        # used by the remaining catalog parts.
+                        actions = []
+                        for atype in "depend", "set":
+                                actions += manifest.gen_actions_by_type(atype)
+
+                        gacts = group_actions(actions)
+                        for ctype in gacts:
+                                for locale in gacts[ctype]:
+                                        acts = gacts[ctype][locale]
+                                        if not acts:
+                                                # Catalog entries only added
+                                                # if actions are present for
+                                                # this ctype.
+                                                continue
+
+                                        pentries["catalog.{0}.{1}".format(
+                                            ctype, locale)] = { "actions": acts }
+
                 self.__lock_catalog()
                 try:
-                        entries = {}
+                        if self.__journal is not None:
+                                # A bulk session is active; the package will
+                                # be added when the journal is flushed.
+                                sfmri = str(pfmri)
+                                if not pfmri.publisher:
+                                        raise api_errors.AnarchicalCatalogFMRI(
+                                            sfmri)
+                                base = self.get_part(self.__BASE_PART,
+                                    must_exist=True)
+                                if sfmri in self.__journal or \
+                                    (base is not None and
+                                    base.get_entry(pfmri=pfmri) is not None):
+                                        raise api_errors.DuplicateCatalogEntry(
+                                            pfmri, operation="add",
+                                            catalog_name=self.meta_root)
+                                self.__journal[sfmri] = (pfmri, pentries)
+                                return
+
                         # Use the same operation time and date for all
                         # operations so that the last modification times
                         # of all catalog parts and update logs will be
                         # synchronized.
-                        op_time = datetime.datetime.utcnow()
-
-                        # Always add packages to the base catalog.
-                        entry = {}
-                        if metadata:
-                                entry["metadata"] = metadata
-                        if manifest:
-                                for k, v in six.iteritems(manifest.signatures):
-                                        entry["signature-{0}".format(k)] = v
-                        part = self.get_part(self.__BASE_PART)
-                        entries[part.name] = part.add(pfmri, metadata=entry,
-                            op_time=op_time)
-
-                        if manifest:
-                                # Without a manifest, only the base catalog data
-                                # can be populated.
-
-                                # Only dependency and set actions are currently
-                                # used by the remaining catalog parts.
-                                actions = []
-                                for atype in "depend", "set":
-                                        actions += manifest.gen_actions_by_type(
-                                            atype)
-
-                                gacts = group_actions(actions)
-                                for ctype in gacts:
-                                        for locale in gacts[ctype]:
-                                                acts = gacts[ctype][locale]
-                                                if not acts:
-                                                        # Catalog entries only
-                                                        # added if actions are
-                                                        # present for this
-                                                        # ctype.
-                                                        continue
-
-                                                part = self.get_part("catalog"
-                                                    ".{0}.{1}".format(ctype,
-                                                    locale))
-                                                entry = { "actions": acts }
-                                                entries[part.name] = part.add(
-                                                    pfmri, metadata=entry,
-                                                    op_time=op_time)
-
-                        self.__log_update(pfmri, CatalogUpdate.ADD, op_time,
-                            entries=entries)
+                        self.__add_entries(pfmri, pentries,
+                            datetime.datetime.utcnow())
                 finally:
                         self.__unlock_catalog()
 
@@ -2241,17 +3288,29 @@ class Catalog(object):
                 # as a basis for determining whether to apply specific
                 # updates.
                 old_parts = self._attrs.parts
+
+                # Updates for parts that have not been loaded are gathered
+                # here, indexed by part name and then by (pub, stem), so
+                # that each part only needs to be read and written once
+                # after all of the update logs have been processed.
+                merges = {}
+
                 def apply_incremental(name):
                         # Load the CatalogUpdate from the path specified.
                         # (Which is why __get_update is not used.)
                         ulog = CatalogUpdate(name, meta_root=path)
                         for pfmri, op_type, op_time, metadata in ulog.updates():
                                 for pname, pdata in six.iteritems(metadata):
-                                        part = self.get_part(pname,
-                                            must_exist=True)
-                                        if part is None:
-                                                # Part doesn't exist; skip.
-                                                continue
+                                        part = self.__parts.get(pname, None)
+                                        if part is None or not part.loaded:
+                                                if pname not in old_parts or \
+                                                    not os.path.exists(
+                                                    os.path.join(
+                                                    self.meta_root, pname)):
+                                                        # Part doesn't exist;
+                                                        # skip.
+                                                        continue
+                                                part = None
 
                                         lm = old_parts[pname]["last-modified"]
                                         if op_time <= lm:
@@ -2261,22 +3320,36 @@ class Catalog(object):
                                                 # modified.
                                                 continue
 
-                                        if op_type == CatalogUpdate.ADD:
+                                        if op_type not in (CatalogUpdate.ADD,
+                                            CatalogUpdate.REMOVE):
+                                                raise api_errors.UnknownUpdateType(
+                                                    op_type)
+
+                                        if part is None:
+                                                merges.setdefault(pname,
+                                                    {}).setdefault(
+                                                    (pfmri.publisher,
+                                                    pfmri.pkg_name), []).append(
+                                                    (pfmri, op_type, op_time,
+                                                    pdata))
+                                        elif op_type == CatalogUpdate.ADD:
                                                 part.add(pfmri, metadata=pdata,
                                                     op_time=op_time)
-                                        elif op_type == CatalogUpdate.REMOVE:
+                                        else:
                                                 part.remove(pfmri,
                                                     op_time=op_time)
-                                        else:
-                                                raise api_errors.UnknownUpdateType(
-                                                    op_type)
 
                 def apply_full(name):
                         src = os.path.join(path, name)
                         dest = os.path.join(self.meta_root, name)
                         portable.copyfile(src, dest)
 
+                # Any cached index of package stems may no longer reflect
+                # the catalog's contents once updates have been applied.
+                self.__stem_index = None
+
                 self.__lock_catalog()
+                merged = []
                 try:
                         old_batch_mode = self.batch_mode
                         self.batch_mode = True
@@ -2306,14 +3379,50 @@ class Catalog(object):
                                         sig = key.split("signature-")[1]
                                         new_sigs[name][sig] = mdata[key]
 
+                        # Parts that haven't been loaded have their updates
+                        # merged into a new copy of the part, which is only
+                        # moved into place once every part has been verified.
+                        for name in sorted(merges):
+                                part = CatalogPart(name,
+                                    meta_root=self.meta_root,
+                                    sign=self.__sign)
+                                tmp_pathname = part.pathname + ".new"
+                                names = part.merge(merges[name], tmp_pathname,
+                                    signatures=new_sigs.get(name))
+                                merged.append((part, tmp_pathname, names))
+
+                                # Any cached copy of the part is now stale.
+                                self.__parts.pop(name, None)
+
                         # This must be done to ensure that the catalog
-                        # signature matches that of the source.
+                        # signature matches that of the source.  Only parts
+                        # that are in-memory need to be sorted; the package
+                        # counts will be replaced along with catalog.attrs.
                         self.batch_mode = old_batch_mode
-                        self.finalize()
+                        for part in self.__parts.values():
+                                part.sort()
 
                         for name, part in six.iteritems(self.__parts):
                                 part.validate(signatures=new_sigs[name])
 
+                        while merged:
+                                part, tmp_pathname, names = merged.pop()
+                                try:
+                                        portable.rename(tmp_pathname,
+                                            part.pathname)
+                                except EnvironmentError as e:
+                                        if e.errno == errno.EACCES:
+                                                raise api_errors.PermissionsException(
+                                                    e.filename)
+                                        if e.errno == errno.EROFS:
+                                                raise api_errors.ReadOnlyFileSystemException(
+                                                    e.filename)
+                                        raise
+
+                                if part.name == self.__BASE_PART:
+                                        _StemIndex(names).save(self.meta_root,
+                                            part.pathname, self.__file_mode)
+
                         # Finally, save the catalog, and then copy the new
                         # catalog attributes file into place and reload it.
                         self.__save()
@@ -2322,9 +3431,36 @@ class Catalog(object):
                         self._attrs = CatalogAttrs(meta_root=self.meta_root)
                         self.__set_perms()
                 finally:
+                        # Discard any merged parts that weren't moved into
+                        # place.
+                        for part, tmp_pathname, names in merged:
+                                if os.path.exists(tmp_pathname):
+                                        portable.remove(tmp_pathname)
                         self.batch_mode = old_batch_mode
                         self.__unlock_catalog()
 
+        def begin_bulk(self):
+                """Starts a bulk session for the catalog.  Until end_bulk() is
+                called, packages added using add_package() are recorded in an
+                in-memory journal instead of being added to the catalog parts
+                immediately.  The journal is flushed when save() is called (or
+                before any package is removed), adding all of the recorded
+                packages at once.  Each flush is logged as a single catalog
+                change with one operation time, and the catalog is only
+                written once, instead of once per package.
+
+                Packages in the journal are not visible to other catalog
+                operations until it has been flushed."""
+
+                assert not self.read_only
+
+                self.__lock_catalog()
+                try:
+                        if self.__journal is None:
+                                self.__journal = OrderedDict()
+                finally:
+                        self.__unlock_catalog()
+
         def categories(self, excludes=EmptyI, pubs=EmptyI):
                 """Returns a set of tuples of the form (scheme, category)
                 containing the names of all categories in use by the last
@@ -2368,6 +3504,7 @@ class Catalog(object):
                 self._attrs = CatalogAttrs(meta_root=self.meta_root,
                     sign=self.__sign)
                 self.__parts = {}
+                self.__stem_index = None
                 self.__updates = {}
                 self._attrs.destroy()
 
@@ -2397,6 +3534,19 @@ class Catalog(object):
                                             e.filename)
                                 raise
 
+        def end_bulk(self):
+                """Ends the active bulk session for the catalog, saving the
+                catalog if any packages remain in its journal."""
+
+                self.__lock_catalog()
+                try:
+                        if self.__journal:
+                                self.__flush_journal()
+                                self.__save()
+                        self.__journal = None
+                finally:
+                        self.__unlock_catalog()
+
         def entries(self, info_needed=EmptyI, last=False, locales=None,
             ordered=False, pubs=EmptyI):
                 """A generator function that produces tuples of the format
@@ -2541,7 +3691,7 @@ class Catalog(object):
                         yield ver, nentries
 
         def entry_actions(self, info_needed, excludes=EmptyI, cb=None,
-            last=False, locales=None, ordered=False, pubs=EmptyI):
+            last=False, locales=None, names=None, ordered=False, pubs=EmptyI):
                 """A generator function that produces tuples of the format
                 ((pub, stem, version), entry, actions) as it iterates over
                 the contents of the catalog (where 'actions' is a generator
@@ -2593,6 +3743,9 @@ class Catalog(object):
                 'locales' is an optional set of locale names for which Actions
                 should be returned.  The default is set(('C',)) if not provided.
 
+                'names' is an optional collection of package stems to restrict
+                the results to.
+
                 'ordered' is an optional boolean value that indicates that
                 results should sorted by stem and then by publisher and
                 be in descending version order.  If False, results will be
@@ -2605,8 +3758,8 @@ class Catalog(object):
                 the results to."""
 
                 for r, entry in self.__entries(cb=cb, info_needed=info_needed,
-                    locales=locales, last_version=last, ordered=ordered,
-                    pubs=pubs, tuples=True):
+                    locales=locales, last_version=last, names=names,
+                    ordered=ordered, pubs=pubs, tuples=True):
                         try:
                                 yield (r, entry,
                                     self.__gen_actions(r, entry["actions"],
@@ -2967,6 +4120,17 @@ class Catalog(object):
                 if illegals:
                         raise api_errors.PackageMatchErrors(illegal=illegals)
 
+                # If patterns were provided, only the stems that could match
+                # at least one of them need to be considered.
+                names = None
+                if patterns:
+                        sindex = self.__get_stem_index()
+                        names = set()
+                        for (pat_pub, pat_stem, pat_ver), matcher in \
+                            six.itervalues(pat_tuples):
+                                names.update(sindex.matching(pat_stem,
+                                    matcher))
+
                 # Keep track of listed stems for all other packages on a
                 # per-publisher basis.
                 nlist = collections.defaultdict(int)
@@ -2979,7 +4143,7 @@ class Catalog(object):
                 cat_info = frozenset([self.DEPENDENCY, self.SUMMARY])
 
                 for t, entry, actions in self.entry_actions(cat_info,
-                    ordered=True, pubs=pubs):
+                    names=names, ordered=True, pubs=pubs):
                         pub, stem, ver = t
 
                         omit_ver = False
@@ -3169,8 +4333,7 @@ class Catalog(object):
 
                         # Return the requested package data.
                         if return_fmris:
-                                pfmri = fmri.PkgFmri(name=stem, publisher=pub,
-                                    version=ver)
+                                pfmri = _intern_fmri(pub, stem, ver)
                                 yield (pfmri, states, attrs)
                         else:
                                 yield (t, states, attrs)
@@ -3270,12 +4433,11 @@ class Catalog(object):
                 # dictionary of pkg names & fmris that match that pattern.
                 ret = dict(zip(patterns, [dict() for i in patterns]))
 
-                for name in self.names():
-                        for pat, matcher, pfmri in pat_data:
-                                pub = pfmri.publisher
-                                version = pfmri.version
-                                if not matcher(name, pfmri.pkg_name):
-                                        continue # name doesn't match
+                sindex = self.__get_stem_index()
+                for pat, matcher, pfmri in pat_data:
+                        pub = pfmri.publisher
+                        version = pfmri.version
+                        for name in sindex.matching(pfmri.pkg_name, matcher):
                                 for ver, entries in \
                                     self.entries_by_version(name):
                                         if version and not ver.is_successor(
@@ -3407,7 +4569,8 @@ class Catalog(object):
                 # Next, since the part hasn't been cached, create an object
                 # for it and add it to catalog attributes.
                 part = CatalogPart(name, meta_root=self.meta_root,
-                    ordered=not self.__batch_mode, sign=self.__sign)
+                    ordered=not self.__batch_mode, sign=self.__sign,
+                    binary=self.__binary_parts)
                 if must_exist and self.meta_root and not part.exists:
                         # This is a double-check for the client case where
                         # there is a part that is known to the catalog but
@@ -3634,6 +4797,10 @@ class Catalog(object):
 
                 self.__lock_catalog()
                 try:
+                        # Any packages added during a bulk session must be
+                        # added first so that operations remain ordered.
+                        self.__flush_journal()
+
                         # The package has to be removed from every known part.
                         entries = {}
 
@@ -3669,10 +4836,13 @@ class Catalog(object):
                         self.__unlock_catalog()
 
         def save(self):
-                """Finalize current state and save to file if possible."""
+                """Finalize current state and save to file if possible.  If a
+                bulk session is active, any packages added during it are
+                added to the catalog first."""
 
                 self.__lock_catalog()
                 try:
+                        self.__flush_journal()
                         self.__save()
                 finally:
                         self.__unlock_catalog()
@@ -3822,7 +4992,10 @@ class Catalog(object):
                         raise api_errors.UnknownCatalogEntry(pfmri.get_fmri())
 
                 # get_entry returns the actual catalog entry, so updating it
-                # simply requires reassignment.
+                # simply requires reassignment.  The part must be fully
+                # loaded first though, as entries retrieved from a binary
+                # companion are not part of the in-memory catalog data.
+                base.load()
                 entry = base.get_entry(pfmri=pfmri, pub=pub, stem=stem, ver=ver)
                 if entry is None:
                         if not pfmri:
@@ -3846,7 +5019,11 @@ class Catalog(object):
         def validate(self, require_signatures=False):
                 """Verifies whether the signatures for the contents of the
                 catalog match the current signature data.  Raises the
-                exception named 'BadCatalogSignatures' on failure."""
+                exception named 'BadCatalogSignatures' on failure.
+
+                Files that are unchanged since they were last successfully
+                validated against the same signature data are not validated
+                again."""
 
                 self._attrs.validate(require_signatures=require_signatures)
 
@@ -3863,23 +5040,62 @@ class Catalog(object):
                                 return None
                         return sigs
 
+                trusted = None
+                if self.meta_root:
+                        trusted = _TrustedState(self.meta_root)
+
+                jobs = []
                 for name, mdata in six.iteritems(self._attrs.parts):
+                        sigs = get_sigs(mdata)
+                        if trusted and trusted.is_trusted(name, sigs):
+                                # Unchanged since it was last validated.
+                                continue
                         part = self.get_part(name, must_exist=True)
                         if part is None:
                                 # Part does not exist; no validation needed.
                                 continue
-                        part.validate(signatures=get_sigs(mdata),
-                            require_signatures=require_signatures)
+                        jobs.append((part, sigs))
 
                 for name, mdata in six.iteritems(self._attrs.updates):
+                        sigs = get_sigs(mdata)
+                        if trusted and trusted.is_trusted(name, sigs):
+                                continue
                         ulog = self.__get_update(name, cache=False,
                             must_exist=True)
                         if ulog is None:
                                 # Update does not exist; no validation needed.
                                 continue
-                        ulog.validate(signatures=get_sigs(mdata),
+                        jobs.append((ulog, sigs))
+
+                def validate_one(job):
+                        obj, sigs = job
+                        obj.validate(signatures=sigs,
                             require_signatures=require_signatures)
 
+                # Validation of each part is independent and largely consists
+                # of file I/O and hashing (both of which release the GIL), so
+                # it is performed using a pool of threads.
+                nworkers = min(len(jobs), os.cpu_count() or 1,
+                    self.__MAX_VALIDATE_WORKERS)
+                if nworkers > 1:
+                        with concurrent.futures.ThreadPoolExecutor(
+                            max_workers=nworkers) as executor:
+                                for res in executor.map(validate_one, jobs):
+                                        pass
+                else:
+                        for job in jobs:
+                                validate_one(job)
+
+                if not trusted or self.read_only:
+                        return
+
+                for obj, sigs in jobs:
+                        if sigs and not obj.loaded:
+                                # Only content that was validated using the
+                                # text of its file can be trusted later.
+                                trusted.add(obj.name, sigs)
+                trusted.save(self.__file_mode)
+
         batch_mode = property(__get_batch_mode, __set_batch_mode)
         last_modified = property(__get_last_modified, __set_last_modified,
             doc="A UTC datetime object indicating the last time the catalog "
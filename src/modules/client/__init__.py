@@ -114,6 +114,18 @@ class GlobalSettings(object):
                 # Maximum number of transient errors before we abort an
                 # endpoint.
                 self.pkg_client_max_consecutive_error_default = 4
+                # Default number of requests which may be multiplexed over
+                # each HTTP/2 connection.  A value of 1 disables HTTP/2.
+                self.pkg_client_http2_streams_default = 1
+                # Default maximum number of requests made to each repository
+                # at once, which the number may grow to from the transport
+                # engine's number of connections.
+                self.pkg_client_max_concurrency_default = 32
+
+                # Default percentile of a repository's request times after
+                # which a request is also made to the next best repository.
+                # A value of 0 disables these hedged requests.
+                self.pkg_client_hedge_percentile_default = 0
 
                 # The location within the image of the cache for pkg.sysrepo(1M)
                 self.sysrepo_pub_cache_path = \
@@ -163,6 +175,33 @@ class GlobalSettings(object):
                 except ValueError:
                         self.PKG_CLIENT_MAX_REDIRECT = \
                             self.pkg_client_max_redirect_default
+                try:
+                        # Number of requests multiplexed over each
+                        # connection to repositories which support HTTP/2.
+                        self.PKG_CLIENT_HTTP2_STREAMS = max(1, int(
+                            os.environ.get("PKG_CLIENT_HTTP2_STREAMS",
+                            self.pkg_client_http2_streams_default)))
+                except ValueError:
+                        self.PKG_CLIENT_HTTP2_STREAMS = \
+                            self.pkg_client_http2_streams_default
+                try:
+                        # Maximum number of requests made to each repository
+                        # at once.
+                        self.PKG_CLIENT_MAX_CONCURRENCY = max(1, int(
+                            os.environ.get("PKG_CLIENT_MAX_CONCURRENCY",
+                            self.pkg_client_max_concurrency_default)))
+                except ValueError:
+                        self.PKG_CLIENT_MAX_CONCURRENCY = \
+                            self.pkg_client_max_concurrency_default
+                try:
+                        # Percentile of a repository's request times after
+                        # which a request is hedged.
+                        self.PKG_CLIENT_HEDGE_PERCENTILE = max(0, min(100,
+                            int(os.environ.get("PKG_CLIENT_HEDGE_PERCENTILE",
+                            self.pkg_client_hedge_percentile_default))))
+                except ValueError:
+                        self.PKG_CLIENT_HEDGE_PERCENTILE = \
+                            self.pkg_client_hedge_percentile_default
                 self.reset_logging()
 
         def __get_error_log_handler(self):
@@ -140,6 +140,9 @@ class Image(object):
                 self.__alt_known_cat = None
                 self.__alt_pkg_sources_loaded = False
 
+                # Image-wide store of manifest cache data.
+                self.__packed_mcache = None
+
                 # Determine identity of client executable if appropriate.
                 if cmdpath == None:
                         cmdpath = misc.api_cmdpath()
@@ -909,6 +912,7 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                         self.__tmpdir = os.path.join(self.imgdir, "tmp")
                 self._statedir = os.path.join(self.imgdir, "state")
                 self.plandir = os.path.join(self.__tmpdir, "plan")
+                self.__packed_mcache = None
                 self.update_index_dir()
 
                 self.history.root_dir = self.imgdir
@@ -2493,6 +2497,35 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                 return os.path.join(self.get_manifest_dir(pfmri),
                     "manifest")
 
+        def __get_packed_manifests(self):
+                """Returns the PackedManifestCache object holding the manifest
+                cache data of the image's installed packages or None if the
+                image doesn't use one."""
+
+                if self.version < self.CURRENT_VERSION or \
+                    not self.cfg.get_policy(imageconfig.PACK_MANIFEST_CACHE):
+                        return None
+                if self.__packed_mcache is None:
+                        self.__packed_mcache = manifest.PackedManifestCache(
+                            os.path.join(self.imgdir, "cache",
+                            "manifest.packed"))
+                return self.__packed_mcache
+
+        def __update_packed_manifests(self, icat):
+                """Updates the image's PackedManifestCache object (if any) to
+                contain the manifest cache data for the packages in the
+                provided catalog of installed packages."""
+
+                packed = self.__get_packed_manifests()
+                if packed is None:
+                        return
+                try:
+                        packed.update(icat.fmris(), self.get_manifest_dir)
+                except (apx.PermissionsException,
+                    apx.ReadOnlyFileSystemException):
+                        # The store is only an optimization.
+                        pass
+
         def __get_manifest(self, fmri, excludes=EmptyI, intent=None,
             alt_pub=None):
                 """Find on-disk manifest and create in-memory Manifest
@@ -2504,7 +2537,8 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                         ret = manifest.FactoredManifest(fmri,
                             self.get_manifest_dir(fmri),
                             excludes=excludes,
-                            pathname=self.get_manifest_path(fmri))
+                            pathname=self.get_manifest_path(fmri),
+                            packed=self.__get_packed_manifests())
 
                         # if we have a intent string, let depot
                         # know for what we're using the cached manifest
@@ -2731,6 +2765,7 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                         except:
                                 pass
                         progtrack.job_add_progress(progtrack.JOB_PKG_CACHE)
+                self.__update_packed_manifests(icat)
                 progtrack.job_done(progtrack.JOB_PKG_CACHE)
 
                 progtrack.job_start(progtrack.JOB_IMAGE_STATE)
@@ -2877,7 +2912,8 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                 # image upgrade or metadata refresh.  In both cases, the catalog
                 # is resorted and finalized so this is always safe to use.
                 cat = pkg.catalog.Catalog(batch_mode=True,
-                    manifest_cb=self._manifest_cb, meta_root=croot, sign=False)
+                    manifest_cb=self._manifest_cb, meta_root=croot, sign=False,
+                    binary_parts=True)
                 return cat
 
         def __remove_catalogs(self):
@@ -3090,7 +3126,8 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
 
                 kcat = pkg.catalog.Catalog(batch_mode=True,
                     meta_root=os.path.join(tmp_state_root,
-                    self.IMG_CATALOG_KNOWN), sign=False)
+                    self.IMG_CATALOG_KNOWN), sign=False,
+                    binary_parts=True)
 
                 # XXX if any of the below fails for any reason, the old 'known'
                 # catalog needs to be re-loaded so the client is in a consistent
@@ -3146,7 +3183,8 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                 # Create the new installed catalog in a temporary location.
                 icat = pkg.catalog.Catalog(batch_mode=True,
                     meta_root=os.path.join(tmp_state_root,
-                    self.IMG_CATALOG_INSTALLED), sign=False)
+                    self.IMG_CATALOG_INSTALLED), sign=False,
+                    binary_parts=True)
 
                 excludes = self.list_excludes()
 
@@ -59,6 +59,7 @@ BE_POLICY = "be-policy"
 CONTENT_UPDATE_POLICY = "content-update-policy"
 FLUSH_CONTENT_CACHE = "flush-content-cache-on-success"
 MIRROR_DISCOVERY = "mirror-discovery"
+PACK_MANIFEST_CACHE = "pack-manifest-cache"
 SEND_UUID = "send-uuid"
 USE_SYSTEM_REPO = "use-system-repo"
 CHECK_CERTIFICATE_REVOCATION = "check-certificate-revocation"
@@ -74,6 +75,7 @@ default_policies = {
     CONTENT_UPDATE_POLICY: "default",
     FLUSH_CONTENT_CACHE: True,
     MIRROR_DISCOVERY: False,
+    PACK_MANIFEST_CACHE: False,
     SEND_UUID: True,
     SIGNATURE_POLICY: sigpolicy.DEFAULT_POLICY,
     USE_SYSTEM_REPO: False,
@@ -185,6 +187,8 @@ class ImageConfig(cfg.FileConfig):
                         default=default_policies[FLUSH_CONTENT_CACHE]),
                     cfg.PropBool(MIRROR_DISCOVERY,
                         default=default_policies[MIRROR_DISCOVERY]),
+                    cfg.PropBool(PACK_MANIFEST_CACHE,
+                        default=default_policies[PACK_MANIFEST_CACHE]),
                     cfg.PropBool(SEND_UUID,
                         default=default_policies[SEND_UUID]),
                     cfg.PropDefined(SIGNATURE_POLICY,
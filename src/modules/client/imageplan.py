@@ -3057,8 +3057,11 @@ class ImagePlan(object):
                                         if skip_dups and self.__act_dup_check(
                                             tgt, key, actstr, fmristr):
                                                 continue
+                                        # These actions are only used for
+                                        # conflict checking and there may be
+                                        # very many of them.
                                         tgt.setdefault(key, []).append(
-                                            (act, pfmri))
+                                            (act.compact(), pfmri))
 
         def __fast_check(self, new, old, ns):
                 """Check whether actions being added and removed are
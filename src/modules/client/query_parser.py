@@ -74,6 +74,12 @@ class EmptyQuery(object):
         def search(self, *args):
                 return []
 
+        def estimate_cost(self):
+                return 0
+
+        def restrict_packages(self, pfmris):
+                return
+
         def set_info(self, **kwargs):
                 return
 
@@ -332,6 +338,9 @@ class TermQuery(qp.TermQuery):
                         if not (self.pkg_name_wildcard or
                             self.pkg_name_match(fmri_str)):
                                 continue
+                        if self._pfmris is not None and \
+                            fmri_str not in self._pfmris:
+                                continue
                         f = fmri.PkgFmri(fmri_str)
                         path = manifest_func(f)
                         search_dict = manifest.Manifest.search_dict(path,
@@ -386,6 +395,9 @@ class TermQuery(qp.TermQuery):
                         if not (self.pkg_name_wildcard or
                             self.pkg_name_match(fmri_str)):
                                 continue
+                        if self._pfmris is not None and \
+                            fmri_str not in self._pfmris:
+                                continue
                         manf = manifest_func(pfmri)
                         fast_update_dict = {}
                         fast_update_res = []
@@ -56,6 +56,21 @@ from pkg.client.debugvalues import DebugValues
 pipelined_protocols = ()
 response_protocols = ("ftp", "http", "https")
 
+# Whether libcurl can multiplex requests over HTTP/2 connections.
+http2_supported = hasattr(pycurl, "PIPE_MULTIPLEX") and \
+    hasattr(pycurl, "INFO_HTTP_VERSION") and \
+    bool(pycurl.version_info()[4] & getattr(pycurl, "VERSION_HTTP2", 0))
+
+# HTTP responses which indicate that a repository is overloaded, and so fewer
+# requests should be made to it at once.
+overload_responses = frozenset([
+    http_client.REQUEST_TIMEOUT,
+    http_client.TOO_MANY_REQUESTS,
+    http_client.BAD_GATEWAY,
+    http_client.SERVICE_UNAVAILABLE,
+    http_client.GATEWAY_TIMEOUT,
+])
+
 class TransportEngine(object):
         """This is an abstract class.  It shouldn't implement any
         of the methods that it contains.  Leave that to transport-specific
@@ -65,7 +80,16 @@ class TransportEngine(object):
 class CurlTransportEngine(TransportEngine):
         """Concrete class of TransportEngine for libcurl transport."""
 
-        def __init__(self, transport, max_conn=20):
+        def __init__(self, transport, max_conn=20, http2_streams=None,
+            max_concurrency=None):
+                """'max_conn' is the number of requests which are made to
+                each repository at once until the number is adjusted based
+                upon the repository's statistics.  'max_concurrency' is the
+                most it may grow to, which is never less than max_conn; if
+                it's None, the value in global_settings is used.
+                'http2_streams' is the number of requests which may be
+                multiplexed over each connection to repositories which support
+                HTTP/2; if it's None, the value in global_settings is used."""
 
                 # Backpointer to transport object
                 self.__xport = transport
@@ -73,7 +97,19 @@ class CurlTransportEngine(TransportEngine):
                 self.__mhandle = pycurl.CurlMulti()
                 self.__chandles = []
                 self.__active_handles = 0
-                self.__max_handles = max_conn
+                self.__max_conn = max_conn
+                if max_concurrency is None:
+                        max_concurrency = \
+                            global_settings.PKG_CLIENT_MAX_CONCURRENCY
+                self.__max_concurrency = max(max_conn, max_concurrency)
+                if http2_streams is None:
+                        http2_streams = global_settings.PKG_CLIENT_HTTP2_STREAMS
+                if not http2_supported:
+                        http2_streams = 1
+                self.__streams = max(1, http2_streams)
+                # One handle is needed for each request that may be in
+                # progress at once.
+                self.__max_handles = self.__max_concurrency * self.__streams
                 # Request queue
                 self.__req_q = deque()
                 # List of failures
@@ -89,9 +125,20 @@ class CurlTransportEngine(TransportEngine):
                 self.__user_agent = None
                 self.__common_header = {}
                 self.__last_stall_check = 0
+                # The url and uuid of each request whose hedge has been
+                # started, mapped to those of the other request of the pair.
+                self.__hedges = {}
 
                 # Set options on multi-handle
-                self.__mhandle.setopt(pycurl.M_PIPELINING, 0)
+                if self.__streams > 1:
+                        self.__mhandle.setopt(pycurl.M_PIPELINING,
+                            pycurl.PIPE_MULTIPLEX)
+                        if hasattr(pycurl, "M_MAX_CONCURRENT_STREAMS"):
+                                self.__mhandle.setopt(
+                                    pycurl.M_MAX_CONCURRENT_STREAMS,
+                                    self.__streams)
+                else:
+                        self.__mhandle.setopt(pycurl.M_PIPELINING, 0)
 
                 # initialize easy handles
                 for i in range(self.__max_handles):
@@ -106,6 +153,10 @@ class CurlTransportEngine(TransportEngine):
                         eh.filetime = -1
                         eh.starttime = -1
                         eh.uuid = None
+                        eh.hedge = None
+                        eh.primary = None
+                        eh.resumable = False
+                        eh.resumed = False
                         self.__chandles.append(eh)
 
                 # copy handles into handle freelist
@@ -126,7 +177,7 @@ class CurlTransportEngine(TransportEngine):
         def add_url(self, url, filepath=None, writefunc=None, header=None,
             progclass=None, progtrack=None, sslcert=None, sslkey=None,
             repourl=None, compressible=False, failonerror=True, proxy=None,
-            runtime_proxy=None):
+            runtime_proxy=None, hedge=None, resumable=False):
                 """Add a URL to the transport engine.  Caller must supply
                 either a filepath where the file should be downloaded,
                 or a callback to a function that will peform the write.
@@ -139,14 +190,40 @@ class CurlTransportEngine(TransportEngine):
                 stored as part of the transport stats accounting.
 
                 'runtime_proxy' is the actual proxy value that is used by pycurl
-                to retrieve this resource."""
+                to retrieve this resource.
+
+                'hedge' is an optional dictionary of the url, repourl, sslcert,
+                sslkey, proxy and runtime_proxy with which the same content
+                may be retrieved from another repository.  If the request
+                takes longer than requests to its repository usually do, and
+                hedging is enabled, the content is also requested from there,
+                and whichever request completes first is used.  Only requests
+                which are downloaded to a filepath can be hedged.
+
+                If 'resumable' is true, the content downloaded before the
+                request fails is kept at filepath + ".part", and any request
+                for the same filepath, to whichever repository, resumes from
+                there."""
 
                 t = TransportRequest(url, filepath=filepath,
                     writefunc=writefunc, header=header, progclass=progclass,
                     progtrack=progtrack, sslcert=sslcert, sslkey=sslkey,
                     repourl=repourl, compressible=compressible,
                     failonerror=failonerror, proxy=proxy,
-                    runtime_proxy=runtime_proxy)
+                    runtime_proxy=runtime_proxy,
+                    resumable=resumable and bool(filepath))
+
+                if hedge and filepath:
+                        t.hedge = TransportRequest(hedge["url"],
+                            filepath=filepath + ".hedge", header=header,
+                            progclass=progclass, progtrack=progtrack,
+                            sslcert=hedge.get("sslcert"),
+                            sslkey=hedge.get("sslkey"),
+                            repourl=hedge["repourl"],
+                            compressible=compressible,
+                            failonerror=failonerror, proxy=hedge.get("proxy"),
+                            runtime_proxy=hedge.get("runtime_proxy"),
+                            primary=t)
 
                 self.__req_q.appendleft(t)
 
@@ -170,6 +247,12 @@ class CurlTransportEngine(TransportEngine):
                     if hdl not in self.__freehandles
                 ]
 
+                if not q_hdls:
+                        # The requests still counted as active were removed
+                        # since, such as hedges cancelled as the other
+                        # request of their pair succeeded.
+                        return
+
                 # time.time() is based upon system clock.  Check that
                 # our time hasn't been set backwards.  If time is set forward,
                 # we'll have to expire the handles.  There's no way to detect
@@ -193,6 +276,12 @@ class CurlTransportEngine(TransportEngine):
                                 url = h.url
                                 uuid = h.uuid
                                 urlstem = h.repourl
+                                # Only one failure is reported for each
+                                # hedged pair, under the url of the original
+                                # request.
+                                hedged = self.__unpair(h) is not None
+                                if h.primary:
+                                        url = h.primary.url
                                 ex = tx.TransportStallError(url,
                                     repourl=urlstem, uuid=uuid)
 
@@ -200,7 +289,8 @@ class CurlTransportEngine(TransportEngine):
                                 self.__teardown_handle(h)
                                 self.__freehandles.append(h)
 
-                                failures.append(ex)
+                                if not hedged:
+                                        failures.append(ex)
 
                 self.__failures.extend(failures)
 
@@ -217,6 +307,11 @@ class CurlTransportEngine(TransportEngine):
                 ex_to_raise = None
                 visited_repos = set()
                 errors_seen = 0
+                # Hedged requests which are to be cancelled, because the other
+                # request of their pair succeeded, and hedges whose content is
+                # to be moved to the file of the original request.
+                cancel = set()
+                renames = []
 
                 for h, en, em in bad:
                         # Get statistics for each handle.
@@ -239,6 +334,10 @@ class CurlTransportEngine(TransportEngine):
                         uuid = h.uuid
                         urlstem = h.repourl
                         proto = urlsplit(url)[0]
+                        if h.primary:
+                                # Report the result of a hedge as that of the
+                                # request it was made for.
+                                url = h.primary.url
 
                         # When using pipelined operations, libcurl tracks the
                         # amount of time taken for the entire pipelined request
@@ -305,6 +404,8 @@ class CurlTransportEngine(TransportEngine):
                                     url, reason=proto_reason, repourl=urlstem,
                                     uuid=uuid)
                                 repostats.record_error(decayable=ex.decayable)
+                                repostats.record_completion(nbytes, seconds,
+                                    overloaded=respcode in overload_responses)
                                 errors_seen += 1
                         else:
                                 timeout = en == pycurl.E_OPERATION_TIMEOUTED
@@ -312,8 +413,32 @@ class CurlTransportEngine(TransportEngine):
                                     repourl=urlstem, uuid=uuid)
                                 repostats.record_error(decayable=ex.decayable,
                                     timeout=timeout)
+                                # Timeouts and refused connections are taken
+                                # as a sign that too many requests are being
+                                # made.
+                                repostats.record_completion(nbytes, seconds,
+                                    overloaded=ex.decayable)
                                 errors_seen += 1
 
+                        if ex and h.resumed and (en == pycurl.E_RANGE_ERROR or
+                            respcode ==
+                            http_client.REQUESTED_RANGE_NOT_SATISFIABLE):
+                                # The repository can't resume the download,
+                                # so retry it from the start.
+                                h.resumable = False
+                                ex.retryable = True
+                        elif not isinstance(ex, tx.TransportFrameworkError) or \
+                            not ex.retryable:
+                                # Only content cut short by the network is
+                                # worth resuming.
+                                h.resumable = False
+
+                        if ex and ((h.url, uuid) in cancel or
+                            self.__unpair(h) is not None):
+                                # The other request of the pair succeeded,
+                                # or may yet.
+                                ex = None
+
                         if ex and ex.retryable:
                                 failures.append(ex)
                         elif ex and not ex_to_raise:
@@ -331,11 +456,22 @@ class CurlTransportEngine(TransportEngine):
                         conn_count = h.getinfo(pycurl.NUM_CONNECTS)
                         conn_time = h.getinfo(pycurl.CONNECT_TIME)
                         h.filetime = h.getinfo(pycurl.INFO_FILETIME)
+                        if self.__streams > 1:
+                                # Record whether the repository's connections
+                                # can carry several requests at once, so that
+                                # more of them are started.
+                                repostats.record_multiplexing(
+                                    h.getinfo(pycurl.INFO_HTTP_VERSION) >=
+                                    pycurl.CURL_HTTP_VERSION_2_0)
 
                         url = h.url
                         uuid = h.uuid
                         urlstem = h.repourl
                         proto = urlsplit(url)[0]
+                        if h.primary:
+                                # Report the result of a hedge as that of the
+                                # request it was made for.
+                                url = h.primary.url
 
                         # When using pipelined operations, libcurl tracks the
                         # amount of time taken for the entire pipelined request
@@ -382,10 +518,22 @@ class CurlTransportEngine(TransportEngine):
 
                         respcode = h.getinfo(pycurl.RESPONSE_CODE)
 
-                        if proto not in response_protocols or \
-                            respcode == http_client.OK:
+                        if (h.url, uuid) in cancel:
+                                # The other request of the pair has already
+                                # succeeded.
+                                repostats.record_completion(nbytes, seconds)
+                        elif proto not in response_protocols or \
+                            respcode == http_client.OK or (h.resumed and
+                            respcode == http_client.PARTIAL_CONTENT):
                                 h.success = True
                                 repostats.clear_consecutive_errors()
+                                repostats.record_completion(nbytes, seconds)
+                                partner = self.__unpair(h)
+                                if partner:
+                                        cancel.add(partner)
+                                if h.primary:
+                                        renames.append((h.filepath,
+                                            h.primary.filepath))
                                 success.append(url)
                         else:
                                 proto_reason = None
@@ -398,6 +546,14 @@ class CurlTransportEngine(TransportEngine):
                                 ex = tx.TransportProtoError(proto,
                                     respcode, url, reason=proto_reason,
                                     repourl=urlstem, uuid=uuid)
+                                if h.resumed and respcode == \
+                                    http_client.REQUESTED_RANGE_NOT_SATISFIABLE:
+                                        # libcurl doesn't fail resumed
+                                        # requests which get this response,
+                                        # but the repository can't resume
+                                        # the download, so retry it from the
+                                        # start.
+                                        ex.retryable = True
 
                                 # If code >= 400, record this as an error.
                                 # Handlers above the engine get to decide
@@ -418,11 +574,19 @@ class CurlTransportEngine(TransportEngine):
                                             url=url, reason=reason,
                                             repourl=urlstem, uuid=uuid)
                                         ex.retryable = True
+                                repostats.record_completion(nbytes, seconds,
+                                    overloaded=respcode == 0 or
+                                    respcode in overload_responses)
 
                                 # Stash retryable failures, arrange
                                 # to raise first fatal error after
                                 # cleanup.
-                                if ex.retryable:
+                                h.resumable = False
+                                if self.__unpair(h) is not None:
+                                        # The other request of the pair
+                                        # may yet succeed.
+                                        pass
+                                elif ex.retryable:
                                         failures.append(ex)
                                 elif not ex_to_raise:
                                         ex_to_raise = ex
@@ -435,6 +599,24 @@ class CurlTransportEngine(TransportEngine):
                         self.__teardown_handle(h)
                         self.__freehandles.append(h)
 
+                for url, uuid in cancel:
+                        self.remove_request(url, uuid)
+                for src, dest in renames:
+                        try:
+                                os.rename(src, dest)
+                        except EnvironmentError as e:
+                                raise tx.TransportOperationError(
+                                    "Unable to rename file: {0}".format(e))
+                        try:
+                                # The original request may have left a
+                                # partial download behind.
+                                os.remove(dest + ".part")
+                        except EnvironmentError as e:
+                                if e.errno != errno.ENOENT:
+                                        raise tx.TransportOperationError(
+                                            "Unable to remove file: "
+                                            "{0}".format(e))
+
                 self.__failures = failures
                 self.__success = success
 
@@ -631,11 +813,36 @@ class CurlTransportEngine(TransportEngine):
                         url, uuid = self.__orphans.pop()
                         self.remove_request(url, uuid)
 
+                if global_settings.PKG_CLIENT_HEDGE_PERCENTILE:
+                        self.__start_hedges()
+
+                # Count the requests in progress to each repository, so that
+                # no more than its concurrency limit are made at once.
+                active = {}
+                free = set(self.__freehandles)
+                for h in self.__chandles:
+                        if h not in free:
+                                key = (h.repourl, h.proxy)
+                                active[key] = active.get(key, 0) + 1
+                limits = {}
+                skipped = []
                 while self.__freehandles and self.__req_q:
                         t = self.__req_q.pop()
+                        key = self.__stats_key(t)
+                        if key not in limits:
+                                limits[key] = self.request_limit(key)
+                        if active.get(key, 0) >= limits[key]:
+                                # Requests to a repository at its limit wait
+                                # for one of those in progress to complete,
+                                # without holding up those to others.
+                                skipped.append(t)
+                                continue
                         eh = self.__freehandles.pop(-1)
                         self.__setup_handle(eh, t)
+                        active[key] = active.get(key, 0) + 1
                         self.__mhandle.add_handle(eh)
+                # Return the skipped requests to the queue in their order.
+                self.__req_q.extend(reversed(skipped))
 
                 self.__call_perform()
 
@@ -651,6 +858,71 @@ class CurlTransportEngine(TransportEngine):
                                 self.__last_stall_check = cur_clock
                                 self.__check_for_stalls()
 
+        def __start_hedges(self):
+                """Queue the hedge of each request which has taken longer
+                than requests to its repository usually do, so that its
+                content is also requested from another repository."""
+
+                percentile = global_settings.PKG_CLIENT_HEDGE_PERCENTILE
+                current_time = time.time()
+                deadlines = {}
+                free = set(self.__freehandles)
+                for h in self.__chandles:
+                        if h in free or not h.hedge:
+                                continue
+                        key = (h.repourl, h.proxy)
+                        if key not in deadlines:
+                                deadlines[key] = None
+                                if key in self.__xport.stats:
+                                        deadlines[key] = self.__xport.stats[
+                                            key].get_hedge_deadline(percentile)
+                        if deadlines[key] is None or \
+                            current_time - h.starttime < deadlines[key]:
+                                continue
+                        t = h.hedge
+                        h.hedge = None
+                        self.__hedges[(h.url, h.uuid)] = (t.url, t.uuid)
+                        self.__hedges[(t.url, t.uuid)] = (h.url, h.uuid)
+                        self.__req_q.append(t)
+
+        def __unpair(self, hdl):
+                """Called when the request of the handle, hdl, has finished.
+                If its hedge, or the request it's the hedge of, is still in
+                progress, forget that they're a pair and return the url and
+                uuid of the other request.  Otherwise return None."""
+
+                partner = self.__hedges.pop((hdl.url, hdl.uuid), None)
+                if partner:
+                        del self.__hedges[partner]
+                return partner
+
+        @staticmethod
+        def __stats_key(treq):
+                """Returns the key of the statistics of the repository that
+                the request, treq, is made to.  This must match the key used
+                to record statistics for the handle in __cleanup_requests."""
+
+                proxy = None
+                if (treq.system and treq.proxy) or \
+                    (not treq.system and treq.runtime_proxy):
+                        proxy = treq.proxy
+                return (treq.repourl, proxy)
+
+        def request_limit(self, key):
+                """Returns the number of requests which may be made at once
+                to the repository whose statistics are indexed by key."""
+
+                if key not in self.__xport.stats:
+                        return self.__max_conn
+                rs = self.__xport.stats[key]
+                limit = rs.get_concurrency(self.__max_conn,
+                    self.__max_concurrency)
+                if self.__streams > 1 and rs.multiplexing:
+                        # Connections to this repository carry several
+                        # requests at once.
+                        limit *= self.__streams
+                return limit
+
         def orphaned_request(self, url, uuid):
                 """Add the URL to the list of orphaned requests.  Any URL in
                 list will be removed from the transport next time run() is
@@ -668,9 +940,19 @@ class CurlTransportEngine(TransportEngine):
                 failures.  This is expensive, so only remove a request
                 if absolutely necessary."""
 
+                partner = self.__hedges.pop((url, uuid), None)
+                if partner:
+                        # Neither request of a hedged pair is wanted once the
+                        # other has been removed.
+                        del self.__hedges[partner]
+                        self.remove_request(*partner)
+
                 for h in self.__chandles:
                         if h.url == url and h.uuid == uuid and \
                             h not in self.__freehandles:
+                                # The request is no longer wanted, so neither
+                                # is anything it downloaded.
+                                h.resumable = False
                                 try:
                                         self.__mhandle.remove_handle(h)
                                 except pycurl.error:
@@ -717,6 +999,7 @@ class CurlTransportEngine(TransportEngine):
                 self.__failures = []
                 self.__success = []
                 self.__orphans = set()
+                self.__hedges = {}
 
         def send_data(self, url, data=None, header=None, sslcert=None,
             sslkey=None, repourl=None, ccancel=None,
@@ -783,6 +1066,23 @@ class CurlTransportEngine(TransportEngine):
 
                 self.__user_agent = ua_str
 
+        @staticmethod
+        def __resume_partial(filepath):
+                """If a previous request left a partial download of
+                filepath behind, move it back into place and return its size,
+                so that the download may be resumed from there.  Otherwise,
+                return 0."""
+
+                try:
+                        os.rename(filepath + ".part", filepath)
+                        return os.stat(filepath).st_size
+                except EnvironmentError as e:
+                        if e.errno != errno.ENOENT:
+                                raise tx.TransportOperationError(
+                                    "Unable to resume download: "
+                                    "{0}".format(e))
+                return 0
+
         def __setup_handle(self, hdl, treq):
                 """Setup the curl easy handle, hdl, with the parameters
                 specified in the TransportRequest treq.  If global
@@ -809,8 +1109,18 @@ class CurlTransportEngine(TransportEngine):
                 hdl.setopt(pycurl.MAXREDIRS,
                     global_settings.PKG_CLIENT_MAX_REDIRECT)
 
-                # Use HTTP/1.1
-                hdl.setopt(pycurl.HTTP_VERSION, pycurl.CURL_HTTP_VERSION_1_1)
+                if self.__streams > 1:
+                        # Use HTTP/2 for https:// repositories which support
+                        # it, and wait for connections already being opened
+                        # to the repository, rather than opening new ones, so
+                        # that requests may be multiplexed over them.
+                        hdl.setopt(pycurl.HTTP_VERSION,
+                            pycurl.CURL_HTTP_VERSION_2TLS)
+                        hdl.setopt(pycurl.PIPEWAIT, 1)
+                else:
+                        # Use HTTP/1.1
+                        hdl.setopt(pycurl.HTTP_VERSION,
+                            pycurl.CURL_HTTP_VERSION_1_1)
 
                 # Store the proxy in the handle so it can be used to retrieve
                 # transport statistics later.
@@ -867,14 +1177,21 @@ class CurlTransportEngine(TransportEngine):
                 hdl.setopt(pycurl.URL, treq.url.encode('ascii', 'ignore'))
                 hdl.url = treq.url
                 hdl.uuid = treq.uuid
+                hdl.hedge = treq.hedge
+                hdl.primary = treq.primary
                 hdl.starttime = time.time()
                 # The repourl is the url stem that identifies the
                 # repository. This is useful to have around for coalescing
                 # error output, and statistics reporting.
                 hdl.repourl = treq.repourl
+                hdl.resumable = treq.resumable
                 if treq.filepath:
+                        offset = 0
+                        if treq.resumable:
+                                offset = self.__resume_partial(treq.filepath)
                         try:
-                                hdl.fobj = open(treq.filepath, "wb+",
+                                hdl.fobj = open(treq.filepath,
+                                    offset and "ab+" or "wb+",
                                     self.__file_bufsz)
                         except EnvironmentError as e:
                                 if e.errno == errno.EACCES:
@@ -892,6 +1209,12 @@ class CurlTransportEngine(TransportEngine):
                         # Request filetime, if endpoint knows it.
                         hdl.setopt(pycurl.OPT_FILETIME, True)
                         hdl.filepath = treq.filepath
+                        if offset:
+                                # Only request the rest of the content.
+                                # libcurl fails the request if the server
+                                # doesn't honor the range.
+                                hdl.setopt(pycurl.RESUME_FROM_LARGE, offset)
+                                hdl.resumed = True
                 elif treq.writefunc:
                         hdl.setopt(pycurl.WRITEFUNCTION, treq.writefunc)
                         hdl.filepath = None
@@ -1026,7 +1349,14 @@ class CurlTransportEngine(TransportEngine):
                                 if hdl.fileprog:
                                         hdl.fileprog.abort()
                                 try:
-                                        os.remove(hdl.filepath)
+                                        if hdl.resumable and os.stat(
+                                            hdl.filepath).st_size > 0:
+                                                # Keep what was downloaded
+                                                # so that it can be resumed.
+                                                os.rename(hdl.filepath,
+                                                    hdl.filepath + ".part")
+                                        else:
+                                                os.remove(hdl.filepath)
                                 except EnvironmentError as e:
                                         if e.errno != errno.ENOENT:
                                                 raise \
@@ -1057,6 +1387,10 @@ class CurlTransportEngine(TransportEngine):
                 hdl.uuid = None
                 hdl.filetime = -1
                 hdl.starttime = -1
+                hdl.hedge = None
+                hdl.primary = None
+                hdl.resumable = False
+                hdl.resumed = False
 
 
 class TransportRequest(object):
@@ -1069,7 +1403,7 @@ class TransportRequest(object):
             progclass=None, progtrack=None, sslcert=None, sslkey=None,
             repourl=None, compressible=False, progfunc=None, uuid=None,
             read_fobj=None, read_filepath=None, failonerror=False, proxy=None,
-            runtime_proxy=None, system=False):
+            runtime_proxy=None, system=False, primary=None, resumable=False):
                 """Create a TransportRequest with the following parameters:
 
                 url - The url that the transport engine should retrieve
@@ -1151,6 +1485,13 @@ class TransportRequest(object):
                 resources served by the system-repository, we use this to
                 prevent $http_proxy environment variables from being used.
 
+                primary - If this request is the hedge of another, the
+                TransportRequest that it was made for.
+
+                resumable - If the request downloads to filepath, whether a
+                partial download should be kept if the request fails, and
+                whether one left by a previous request should be resumed.
+
                 A TransportRequest must contain enough information to uniquely
                 identify any pkg.client.publisher.TransportRepoURI - in
                 particular, it must contain all fields used by
@@ -1179,6 +1520,10 @@ class TransportRequest(object):
                 self.proxy = proxy
                 self.runtime_proxy = runtime_proxy
                 self.system = system
+                self.primary = primary
+                self.resumable = resumable
+                # The hedge of this request, if it has one.
+                self.hedge = None
 
 # Vim hints
 # vim:ts=8:sw=8:et:fdm=marker
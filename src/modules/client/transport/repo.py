@@ -90,11 +90,14 @@ class TransportRepo(object):
 
                 raise NotImplementedError
 
-        def get_files(self, filelist, dest, progtrack, version, header=None, pub=None):
+        def get_files(self, filelist, dest, progtrack, version, header=None,
+            pub=None, hedge=None):
                 """Get multiple files from the repo at once.
                 The files are named by hash and supplied in filelist.
                 If dest is specified, download to the destination
-                directory that is given. Progtrack is a ProgressTracker"""
+                directory that is given. Progtrack is a ProgressTracker.
+                If hedge is another TransportRepo, requests which take longer
+                than usual may also be made to it."""
 
                 raise NotImplementedError
 
@@ -105,11 +108,14 @@ class TransportRepo(object):
 
                 raise NotImplementedError
 
-        def get_manifests(self, mfstlist, dest, progtrack=None, pub=None):
+        def get_manifests(self, mfstlist, dest, progtrack=None, pub=None,
+            hedge=None):
                 """Get manifests named in list.  The mfstlist argument contains
                 tuples (fmri, header).  This is so that each manifest may have
                 unique header information.  The destination directory is spec-
-                ified in the dest argument."""
+                ified in the dest argument.  If hedge is another TransportRepo,
+                requests which take longer than usual may also be made to
+                it."""
 
                 raise NotImplementedError
 
@@ -164,6 +170,13 @@ class TransportRepo(object):
 
                 raise NotImplementedError
 
+        def publish_begin_bulk(self, header=None, pub=None):
+                """Starts a bulk publication session so that packages added
+                to the catalog of the repository by closing transactions are
+                only written when publish_end_bulk() is called."""
+
+                raise NotImplementedError
+
         def publish_close(self, header=None, trans_id=None,
             add_to_catalog=False):
                 """The close operation tells the Repository to commit
@@ -173,6 +186,12 @@ class TransportRepo(object):
 
                 raise NotImplementedError
 
+        def publish_end_bulk(self, header=None, pub=None):
+                """Ends the active bulk publication session, saving the
+                packages added to the catalog of the repository during it."""
+
+                raise NotImplementedError
+
         def publish_open(self, header=None, client_release=None, pkg_name=None):
                 """Begin a publication operation by calling 'open'.
                 The caller must specify the client's OS release in
@@ -398,12 +417,26 @@ class HTTPRepo(TransportRepo):
                     self._repouri)
 
         def _add_file_url(self, url, filepath=None, progclass=None,
-            progtrack=None, header=None, compress=False):
+            progtrack=None, header=None, compress=False, hedge=None,
+            resumable=False):
                 self._engine.add_url(url, filepath=filepath,
                     progclass=progclass, progtrack=progtrack, repourl=self._url,
                     header=header, compressible=compress,
                     runtime_proxy=self._repouri.runtime_proxy,
-                    proxy=self._repouri.proxy)
+                    proxy=self._repouri.proxy, hedge=hedge,
+                    resumable=resumable)
+
+        def _hedge_args(self, url):
+                """Returns the arguments with which the transport engine
+                may make a request to url as the hedge of a request to
+                another repository."""
+
+                return {
+                    "url": url,
+                    "repourl": self._url,
+                    "proxy": self._repouri.proxy,
+                    "runtime_proxy": self._repouri.runtime_proxy,
+                }
 
         def _fetch_url(self, url, header=None, compress=False, ccancel=None,
             failonerror=True, system=False):
@@ -655,13 +688,19 @@ class HTTPRepo(TransportRepo):
                 return self._fetch_url(requesturl, header, compress=True,
                     ccancel=ccancel)
 
-        def get_manifests(self, mfstlist, dest, progtrack=None, pub=None):
+        def get_manifests(self, mfstlist, dest, progtrack=None, pub=None,
+            hedge=None):
                 """Get manifests named in list.  The mfstlist argument contains
                 tuples (fmri, header).  This is so that each manifest may have
                 unique header information.  The destination directory is spec-
-                ified in the dest argument."""
+                ified in the dest argument.  If hedge is another HTTPRepo,
+                requests which take longer than usual are also made to it."""
 
                 baseurl = self.__get_request_url("manifest/0/", pub=pub)
+                hedgeurl = None
+                if hedge:
+                        hedgeurl = hedge.__get_request_url("manifest/0/",
+                            pub=pub)
                 urlmapping = {}
                 progclass = None
 
@@ -673,9 +712,12 @@ class HTTPRepo(TransportRepo):
                         url = urljoin(baseurl, f)
                         urlmapping[url] = fmri
                         fn = os.path.join(dest, f)
+                        hargs = None
+                        if hedgeurl:
+                                hargs = hedge._hedge_args(urljoin(hedgeurl, f))
                         self._add_file_url(url, filepath=fn, header=h,
                             compress=True, progtrack=progtrack,
-                            progclass=progclass)
+                            progclass=progclass, hedge=hargs)
 
                 # Compute urllist from keys in mapping
                 urllist = urlmapping.keys()
@@ -710,16 +752,22 @@ class HTTPRepo(TransportRepo):
 
                 return self._annotate_exceptions(errors, urlmapping)
 
-        def get_files(self, filelist, dest, progtrack, version, header=None, pub=None):
+        def get_files(self, filelist, dest, progtrack, version, header=None,
+            pub=None, hedge=None):
                 """Get multiple files from the repo at once.
                 The files are named by hash and supplied in filelist.
                 If dest is specified, download to the destination
                 directory that is given.  If progtrack is not None,
                 it contains a ProgressTracker object for the
-                downloads."""
+                downloads.  If hedge is another HTTPRepo, requests which
+                take longer than usual are also made to it."""
 
                 baseurl = self.__get_request_url("file/{0}/".format(version),
                     pub=pub)
+                hedgeurl = None
+                if hedge:
+                        hedgeurl = hedge.__get_request_url(
+                            "file/{0}/".format(version), pub=pub)
                 urllist = []
                 progclass = None
 
@@ -730,9 +778,14 @@ class HTTPRepo(TransportRepo):
                         url = urljoin(baseurl, f)
                         urllist.append(url)
                         fn = os.path.join(dest, f)
+                        hargs = None
+                        if hedgeurl:
+                                hargs = hedge._hedge_args(urljoin(hedgeurl, f))
+                        # Files are named by hash, so a partial download
+                        # may be resumed from any repository.
                         self._add_file_url(url, filepath=fn,
                             progclass=progclass, progtrack=progtrack,
-                            header=header)
+                            header=header, hedge=hargs, resumable=True)
 
                 try:
                         while self._engine.pending:
@@ -1213,14 +1266,22 @@ class HTTPSRepo(HTTPRepo):
 
         # override the download functions to use ssl cert/key
         def _add_file_url(self, url, filepath=None, progclass=None,
-            progtrack=None, header=None, compress=False):
+            progtrack=None, header=None, compress=False, hedge=None,
+            resumable=False):
                 self._engine.add_url(url, filepath=filepath,
                     progclass=progclass, progtrack=progtrack,
                     sslcert=self._repouri.ssl_cert,
                     sslkey=self._repouri.ssl_key, repourl=self._url,
                     header=header, compressible=compress,
                     runtime_proxy=self._repouri.runtime_proxy,
-                    proxy=self._repouri.proxy)
+                    proxy=self._repouri.proxy, hedge=hedge,
+                    resumable=resumable)
+
+        def _hedge_args(self, url):
+                args = HTTPRepo._hedge_args(self, url)
+                args["sslcert"] = self._repouri.ssl_cert
+                args["sslkey"] = self._repouri.ssl_key
+                return args
 
         def _fetch_url(self, url, header=None, compress=False, ccancel=None,
             failonerror=True):
@@ -1541,7 +1602,8 @@ class _FilesystemRepo(TransportRepo):
 
                 return self._fetch_url(requesturl, header, ccancel=ccancel)
 
-        def get_manifests(self, mfstlist, dest, progtrack=None, pub=None):
+        def get_manifests(self, mfstlist, dest, progtrack=None, pub=None,
+            hedge=None):
                 """Get manifests named in list.  The mfstlist argument contains
                 tuples (fmri, header).  This is so that each manifest may have
                 unique header information.  The destination directory is spec-
@@ -1609,7 +1671,8 @@ class _FilesystemRepo(TransportRepo):
 
                 return errors + pre_exec_errors
 
-        def get_files(self, filelist, dest, progtrack, version, header=None, pub=None):
+        def get_files(self, filelist, dest, progtrack, version, header=None,
+            pub=None, hedge=None):
                 """Get multiple files from the repo at once.
                 The files are named by hash and supplied in filelist.
                 If dest is specified, download to the destination
@@ -1805,6 +1868,20 @@ class _FilesystemRepo(TransportRepo):
 
                 return None, pkg_state
 
+        def publish_begin_bulk(self, header=None, pub=None):
+                """Starts a bulk publication session so that packages added
+                to the catalog of the repository by closing transactions are
+                only written when publish_end_bulk() is called."""
+
+                # Calling any publication operation sets read_only to False.
+                self._frepo.read_only = False
+
+                pub_prefix = getattr(pub, "prefix", None)
+                try:
+                        self._frepo.begin_bulk(pub=pub_prefix)
+                except svr_repo.RepositoryError as e:
+                        raise tx.TransportOperationError(str(e))
+
         def publish_close(self, header=None, trans_id=None,
             add_to_catalog=False):
                 """The close operation tells the Repository to commit
@@ -1823,6 +1900,19 @@ class _FilesystemRepo(TransportRepo):
 
                 return pkg_fmri, pkg_state
 
+        def publish_end_bulk(self, header=None, pub=None):
+                """Ends the active bulk publication session, saving the
+                packages added to the catalog of the repository during it."""
+
+                # Calling any publication operation sets read_only to False.
+                self._frepo.read_only = False
+
+                pub_prefix = getattr(pub, "prefix", None)
+                try:
+                        self._frepo.end_bulk(pub=pub_prefix)
+                except svr_repo.RepositoryError as e:
+                        raise tx.TransportOperationError(str(e))
+
         def publish_open(self, header=None, client_release=None, pkg_name=None):
                 """Begin a publication operation by calling 'open'.
                 The caller must specify the client's OS release in
@@ -2188,7 +2278,8 @@ class _ArchiveRepo(TransportRepo):
                         self.__record_proto_error(ex)
                         raise ex
 
-        def get_manifests(self, mfstlist, dest, progtrack=None, pub=None):
+        def get_manifests(self, mfstlist, dest, progtrack=None, pub=None,
+            hedge=None):
                 """Get manifests named in list.  The mfstlist argument contains
                 tuples (fmri, header).  This is so that each manifest may have
                 unique header information.  The destination directory is spec-
@@ -2220,7 +2311,8 @@ class _ArchiveRepo(TransportRepo):
                                 continue
                 return errors
 
-        def get_files(self, filelist, dest, progtrack, version, header=None, pub=None):
+        def get_files(self, filelist, dest, progtrack, version, header=None,
+            pub=None, hedge=None):
                 """Get multiple files from the repo at once.
                 The files are named by hash and supplied in filelist.
                 If dest is specified, download to the destination
@@ -29,9 +29,29 @@ from __future__ import division
 import os
 import datetime
 import random
+from collections import deque
 from six.moves.urllib.parse import urlsplit
 import pkg.misc as misc
 
+# The least number of requests which are made to a repository at once; the
+# transport engine sets where the number starts and the most it may grow to.
+# Within those bounds, the number is adjusted based upon the observed
+# throughput and errors: it grows by one each time a round of requests
+# completes without the throughput dropping, shrinks by CONCURRENCY_BACKOFF
+# when the throughput drops below CONCURRENCY_SLOWDOWN of that of the previous
+# round, and is cut by CONCURRENCY_DECREASE when a request fails because the
+# repository is overloaded.
+MIN_CONCURRENCY = 1
+CONCURRENCY_DECREASE = 0.5
+CONCURRENCY_BACKOFF = 0.75
+CONCURRENCY_SLOWDOWN = 0.8
+
+# The number of recent request times kept for each repository, and the number
+# needed before a deadline for hedging requests is derived from them.  Requests
+# are never hedged sooner than MIN_HEDGE_DEADLINE seconds after they start.
+HEDGE_SAMPLES = 200
+MIN_HEDGE_SAMPLES = 20
+MIN_HEDGE_DEADLINE = 1.0
 
 class RepoChooser(object):
         """An object that contains repo statistics.  It applies algorithms
@@ -236,6 +256,18 @@ class RepoStats(object):
 
                 self.__connections = 0
                 self.__connect_time = 0.0
+                self.__multiplexing = False
+
+                # The state of the control of the number of requests made to
+                # the repository at once.  It is kept for the lifetime of the
+                # transport.
+                self.__concurrency = None
+                self.__max_concurrency = MIN_CONCURRENCY
+                self.__round_bytes = 0
+                self.__round_seconds = 0
+                self.__round_done = 0
+                self.__round_speed = None
+                self.__request_times = deque(maxlen=HEDGE_SAMPLES)
 
                 self.__used = False
 
@@ -263,6 +295,92 @@ class RepoStats(object):
                 self.__connections += 1
                 self.__connect_time += time
 
+        def record_multiplexing(self, multiplexing):
+                """Record whether the last request completed by the
+                repository was made over a connection which can carry several
+                requests at once, such as an HTTP/2 connection."""
+
+                self.__multiplexing = multiplexing
+
+        def record_completion(self, nbytes, seconds, overloaded=False):
+                """Record that a request to the repository completed after
+                transferring nbytes in the given number of seconds, and
+                adjust the number of requests which should be made to the
+                repository at once.  Set overloaded to true if the request
+                failed in a way which indicates that the repository, or the
+                network path to it, is overloaded."""
+
+                if self.__concurrency is None:
+                        return
+
+                if overloaded:
+                        # The next round is expected to be slower, so it
+                        # isn't compared with the previous one.
+                        self.__concurrency = max(MIN_CONCURRENCY,
+                            self.__concurrency * CONCURRENCY_DECREASE)
+                        self.__round_bytes = self.__round_seconds = 0
+                        self.__round_done = 0
+                        self.__round_speed = None
+                        return
+
+                self.__request_times.append(max(seconds, 0))
+                self.__round_bytes += nbytes
+                self.__round_seconds += max(seconds, 0)
+                self.__round_done += 1
+                if self.__round_done < int(self.__concurrency) or \
+                    self.__round_seconds <= 0:
+                        return
+
+                # A round of requests has completed.  The throughput of the
+                # repository is estimated from the speed of each transfer,
+                # rather than the time taken by the round, so that time in
+                # which no requests were made doesn't count against it.
+                # old-division; pylint: disable=W1619
+                speed = self.__round_bytes / self.__round_seconds * \
+                    self.__concurrency
+                if self.__round_speed and \
+                    speed < self.__round_speed * CONCURRENCY_SLOWDOWN:
+                        self.__concurrency = max(MIN_CONCURRENCY,
+                            self.__concurrency * CONCURRENCY_BACKOFF)
+                        # As after a decrease, the next round is expected to
+                        # be slower, so it isn't compared with this one.
+                        speed = None
+                else:
+                        self.__concurrency = min(self.__max_concurrency,
+                            self.__concurrency + 1)
+                self.__round_speed = speed
+                self.__round_bytes = self.__round_seconds = 0
+                self.__round_done = 0
+
+        def get_concurrency(self, initial, maximum=None):
+                """Return the number of requests which should be made to
+                the repository at once.  'initial' is used as the number
+                until requests have completed, after which it may grow up to
+                'maximum', or 'initial' if that isn't given."""
+
+                if maximum is None:
+                        maximum = initial
+                self.__max_concurrency = max(MIN_CONCURRENCY, maximum)
+                if self.__concurrency is None:
+                        self.__concurrency = float(max(MIN_CONCURRENCY,
+                            min(initial, self.__max_concurrency)))
+                elif self.__concurrency > self.__max_concurrency:
+                        self.__concurrency = float(self.__max_concurrency)
+                return int(self.__concurrency)
+
+        def get_hedge_deadline(self, percentile):
+                """Return the number of seconds after which a request to the
+                repository should also be made to another one; that is, the
+                time within which the given percentile of recent requests
+                completed.  None is returned if too few requests have
+                completed to tell."""
+
+                if len(self.__request_times) < MIN_HEDGE_SAMPLES:
+                        return None
+                times = sorted(self.__request_times)
+                i = min(len(times) - 1, len(times) * percentile // 100)
+                return max(MIN_HEDGE_DEADLINE, times[i] + self.connect_time)
+
         def record_error(self, decayable=False, content=False, timeout=False):
                 """Record that an operation to the TransportRepoURI represented
                 by this RepoStats object failed with an error.
@@ -371,6 +489,13 @@ class RepoStats(object):
 
                 return self.__content_err
 
+        @property
+        def multiplexing(self):
+                """Return whether the repository has been seen to accept
+                several requests at once over the same connection."""
+
+                return self.__multiplexing
+
         @property
         def num_connect(self):
                 """Return the number of times that the host has had a
@@ -487,6 +612,17 @@ class RepoStats(object):
                     (Cerror * (self.__failed_tx + self._err_decay)**2)
                 return int(q)
 
+        @property
+        def request_time(self):
+                """Return the average time, in seconds, spent transferring
+                the response to each request made to this host."""
+
+                if self.__total_tx == 0:
+                        return 0.0
+
+                # old-division; pylint: disable=W1619
+                return self.__seconds_xfr / self.__total_tx
+
         @property
         def seconds_xfr(self):
                 """Return the total amount of time elapsed while performing
@@ -614,6 +614,7 @@ class Transport(object):
                 self._lock.acquire()
                 try:
                         self.__engine.reset()
+                        self.__remove_partial_downloads()
                         self.__repo_cache.clear_cache()
                         self.cfg.reset_caches()
                         if self.__dynamic_mirrors:
@@ -637,6 +638,7 @@ class Transport(object):
                 try:
                         self.__engine.shutdown()
                         self.__engine = None
+                        self.__remove_partial_downloads()
                         if self.__repo_cache:
                                 self.__repo_cache.clear_cache()
                         self.__repo_cache = None
@@ -644,6 +646,32 @@ class Transport(object):
                 finally:
                         self._lock.release()
 
+        def __remove_partial_downloads(self):
+                """Remove the partial downloads which the transport engine
+                keeps in the incoming directory so that interrupted
+                downloads may be resumed."""
+
+                download_dir = self.cfg.incoming_root
+                if not download_dir:
+                        return
+
+                try:
+                        names = os.listdir(download_dir)
+                except EnvironmentError as e:
+                        if e.errno == errno.ENOENT:
+                                return
+                        raise apx._convert_error(e)
+
+                for name in names:
+                        if not name.endswith(".part"):
+                                continue
+                        try:
+                                portable.remove(os.path.join(download_dir,
+                                    name))
+                        except EnvironmentError as e:
+                                if e.errno != errno.ENOENT:
+                                        raise apx._convert_error(e)
+
         @LockedTransport()
         def do_search(self, pub, data, ccancel=None, alt_repo=None):
                 """Perform a search request.  Returns a file-like object or an
@@ -1641,13 +1669,17 @@ class Transport(object):
                                 mfstlist = [(fmri, d.build_refetch_header(h))
                                     for fmri, h in mfstlist]
 
+                        hedge = self.__hedge_repo(pub, d, origin_only=True,
+                            alt_repo=mxfr.get_alt_repo())
+
                         # This returns a list of transient errors
                         # that occurred during the transport operation.
                         # An exception handler here isn't necessary
                         # unless we want to suppress a permanent failure.
                         try:
                                 errlist = d.get_manifests(mfstlist,
-                                    download_dir, progtrack=progtrack, pub=pub)
+                                    download_dir, progtrack=progtrack, pub=pub,
+                                    hedge=hedge)
                         except tx.ExcessiveTransientFailure as ex:
                                 # If an endpoint experienced so many failures
                                 # that we just gave up, record this for later
@@ -1915,6 +1947,9 @@ class Transport(object):
                             repostats, retries, d)
 
                         gave_up = False
+                        hedge = self.__hedge_repo(pub, d,
+                            alt_repo=mfile.get_alt_repo(), operation="file",
+                            version=v)
 
                         # This returns a list of transient errors
                         # that occurred during the transport operation.
@@ -1922,7 +1957,7 @@ class Transport(object):
                         # unless we want to supress a permanant failure.
                         try:
                                 errlist = d.get_files(filelist, download_dir,
-                                    progtrack, v, header, pub=pub)
+                                    progtrack, v, header, pub=pub, hedge=hedge)
                         except tx.ExcessiveTransientFailure as ex:
                                 # If an endpoint experienced so many failures
                                 # that we just gave up, record this for later
@@ -2503,15 +2538,74 @@ class Transport(object):
                                 raise apx.UnsupportedRepositoryOperation(pub,
                                     "{0}/{1:d}".format(operation, versions[-1]))
 
+        def __hedge_repo(self, pub, repo, origin_only=False, alt_repo=None,
+            operation=None, version=None):
+                """Returns the Repo object to which requests made to the
+                Repo object 'repo' should be hedged: the network repository,
+                other than 'repo', that __gen_repo would rank best.  None is
+                returned if hedging is disabled, or there's no such repository.
+
+                'pub', 'origin_only' and 'alt_repo' select the repositories
+                like they do for __gen_repo.  If 'operation' is given, only a
+                repository already known to support 'version' of it is
+                returned."""
+
+                if not global_settings.PKG_CLIENT_HEDGE_PERCENTILE:
+                        return None
+
+                network = ("http", "https")
+                key = repo.get_repouri_key()
+                if key not in self.stats or \
+                    self.stats[key].scheme not in network:
+                        return None
+
+                if alt_repo:
+                        repository = alt_repo
+                elif isinstance(pub, publisher.Publisher):
+                        repository = pub.repository
+                else:
+                        return None
+                if not repository:
+                        return None
+
+                repolist = repository.origins[:]
+                if not origin_only:
+                        repolist.extend(repository.mirrors)
+                        repolist.extend(self.__dynamic_mirrors)
+
+                best = None
+                for ruri in _convert_repouris(repolist):
+                        rkey = ruri.key()
+                        if rkey == key or rkey not in self.stats:
+                                continue
+                        rs = self.stats[rkey]
+                        if rs.scheme not in network:
+                                continue
+                        if best is None or rs.quality > best[0].quality:
+                                best = (rs, ruri)
+                if not best:
+                        return None
+
+                hedge = self.__repo_cache.new_repo(*best)
+                if operation and \
+                    hedge.supports_version(operation, [version]) < 0:
+                        return None
+                return hedge
+
         def __chunk_size(self, pub, alt_repo=None, origin_only=False):
-                """Determine the chunk size based upon how many of the known
-                mirrors have been visited.  If not all mirrors have been
-                visited, choose a small size so that if it ends up being
-                a poor choice, the client doesn't transfer too much data."""
+                """Determine the chunk size based upon the measured speed of
+                the known mirrors.  If not all mirrors have been visited,
+                choose a small size so that if it ends up being a poor
+                choice, the client doesn't transfer too much data.
+                Otherwise, size the chunk so that the repository which is
+                most likely to be picked for it can transfer it in about
+                CHUNK_SECONDS; this keeps fast repositories busy without
+                leaving a large chunk stuck at a slow one."""
 
                 CHUNK_SMALL = 10
                 CHUNK_LARGE = 100
                 CHUNK_HUGE = 1024
+                CHUNK_SECONDS = 10
 
                 # Call setup if the transport isn't configured or was shutdown.
                 if not self.__engine:
@@ -2540,7 +2634,20 @@ class Transport(object):
                         return CHUNK_HUGE
                 if m < n:
                         return CHUNK_SMALL
-                return CHUNK_LARGE
+
+                # The repository with the best quality is the one that
+                # __gen_repo will try first.
+                key = max((r.key() for r in repolist),
+                    key=lambda k: self.stats[k].quality)
+                request_time = self.stats[key].request_time
+                if request_time <= 0:
+                        return CHUNK_LARGE
+                # The number of requests which the repository can complete
+                # in CHUNK_SECONDS, given how many are made to it at once.
+                # old-division; pylint: disable=W1619
+                chunksz = int(CHUNK_SECONDS * self.__engine.request_limit(key) /
+                    request_time)
+                return max(CHUNK_SMALL, min(CHUNK_HUGE, chunksz))
 
         @LockedTransport()
         def valid_publisher_test(self, pub, ccancel=None):
@@ -3038,6 +3145,37 @@ class Transport(object):
 
                 raise failures
 
+        @LockedTransport()
+        def publish_begin_bulk(self, pub):
+                """Instructs the repository named by Publisher pub to
+                start a bulk publication session; packages added to its
+                catalog are only written once publish_end_bulk() is called.
+                Only supported by filesystem-based repositories."""
+
+                failures = tx.TransportFailures()
+                retry_count = global_settings.PKG_CLIENT_MAX_TIMEOUT
+                header = self.__build_header(uuid=self.__get_uuid(pub),
+                    variant=self.__get_variant(pub))
+
+                for d, retries, v in self.__gen_repo(pub, retry_count,
+                    origin_only=True, single_repository=True, operation="admin",
+                    versions=[0]):
+                        try:
+                                d.publish_begin_bulk(header=header, pub=pub)
+                                return
+                        except tx.ExcessiveTransientFailure as ex:
+                                # If an endpoint experienced so many failures
+                                # that we just gave up, grab the list of
+                                # failures that it contains
+                                failures.extend(ex.failures)
+                        except tx.TransportException as e:
+                                if e.retryable:
+                                        failures.append(e)
+                                else:
+                                        raise
+
+                raise failures
+
         @LockedTransport()
         def publish_close(self, pub, trans_id=None, refresh_index=False,
             add_to_catalog=False):
@@ -3074,6 +3212,36 @@ class Transport(object):
 
                 raise failures
 
+        @LockedTransport()
+        def publish_end_bulk(self, pub):
+                """Instructs the repository named by Publisher pub to
+                end its bulk publication session, saving the packages added
+                to its catalog during it."""
+
+                failures = tx.TransportFailures()
+                retry_count = global_settings.PKG_CLIENT_MAX_TIMEOUT
+                header = self.__build_header(uuid=self.__get_uuid(pub),
+                    variant=self.__get_variant(pub))
+
+                for d, retries, v in self.__gen_repo(pub, retry_count,
+                    origin_only=True, single_repository=True, operation="admin",
+                    versions=[0]):
+                        try:
+                                d.publish_end_bulk(header=header, pub=pub)
+                                return
+                        except tx.ExcessiveTransientFailure as ex:
+                                # If an endpoint experienced so many failures
+                                # that we just gave up, grab the list of
+                                # failures that it contains
+                                failures.extend(ex.failures)
+                        except tx.TransportException as e:
+                                if e.retryable:
+                                        failures.append(e)
+                                else:
+                                        raise
+
+                raise failures
+
         @LockedTransport()
         def publish_open(self, pub, client_release=None, pkg_name=None):
                 """Perform an 'open' transaction to start a publication
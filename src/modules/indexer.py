@@ -25,9 +25,15 @@
 #
 
 import errno
+import heapq
+import itertools
+import multiprocessing
+import operator
 import os
 import platform
 import shutil
+import six
+import threading
 from six.moves.urllib.parse import unquote
 
 import pkg.fmri as fmri
@@ -56,6 +62,62 @@ SORT_FILE_PREFIX = "sort."
 
 SORT_FILE_MAX_SIZE = 128 * 1024 * 1024
 
+# The maximum number of processes used to tokenize manifests, and the minimum
+# number of manifests which must be indexed before more than one is used.
+MAX_INDEX_WORKERS = 8
+PARALLEL_INDEX_MIN_PKGS = 128
+
+# The name of the directory inside a server's index directory which holds the
+# delta segments, the number of segments at which they should be merged into
+# the base index, and the size of the main dictionary below which packages are
+# added to it directly instead of to a segment.
+SEGMENTS_DIR = "segments"
+MAX_INDEX_SEGMENTS = 8
+MIN_SEGMENTED_INDEX_SIZE = 32 * 1024 * 1024
+
+# The state shared with the processes which tokenize manifests.  It's set
+# before the processes are forked so that it doesn't need to be pickled.
+_worker_state = None
+
+
+def _index_worker(args):
+        """Tokenizes a batch of manifests in a child process.  The lines for
+        the main dictionary are sorted and written to temporary files whose
+        names are returned along with any messages which should be logged.
+
+        The "args" parameter is a tuple of the number of the batch and a list
+        of package ids and the paths to their manifests."""
+
+        batch_num, batch = args
+        excludes, tmp_dir, max_size = _worker_state
+        msgs = []
+        names = []
+        lines = []
+        nbytes = 0
+
+        def write_run():
+                name = "{0}{1}.{2}".format(SORT_FILE_PREFIX, batch_num,
+                    len(names))
+                lines.sort()
+                with open(os.path.join(tmp_dir, name), "w",
+                    buffering=PKG_FILE_BUFSIZ) as fh:
+                        fh.writelines(line for tok, line in lines)
+                names.append(name)
+                del lines[:]
+
+        for p_id, path in batch:
+                new_dict = manifest.Manifest.search_dict(path, excludes,
+                    log=msgs.append)
+                for tok, line in Indexer._gen_sort_lines(p_id, new_dict):
+                        if lines and len(line) + nbytes >= max_size:
+                                write_run()
+                                nbytes = 0
+                        lines.append((tok, line))
+                        nbytes += len(line)
+        if lines:
+                write_run()
+        return names, msgs, len(batch)
+
 
 def makedirs(pathname):
         """Create a directory at the specified location if it does not
@@ -84,7 +146,7 @@ class Indexer(object):
 
         def __init__(self, index_dir, get_manifest_func, get_manifest_path_func,
             progtrack=None, excludes=EmptyI, log=None,
-            sort_file_max_size=SORT_FILE_MAX_SIZE):
+            sort_file_max_size=SORT_FILE_MAX_SIZE, max_workers=None):
                 self._num_keys = 0
                 self._num_manifests = 0
                 self._num_entries = 0
@@ -96,6 +158,10 @@ class Indexer(object):
                 if self.sort_file_max_size <= 0:
                         raise search_errors.IndexingException(
                             _("sort_file_max_size must be greater than 0"))
+                if max_workers is None:
+                        max_workers = min(os.cpu_count() or 1,
+                            MAX_INDEX_WORKERS)
+                self.max_workers = max_workers
 
                 # This structure was used to gather all index files into one
                 # location. If a new index structure is needed, the files can
@@ -115,7 +181,11 @@ class Indexer(object):
                         "full_fmri": ss.IndexStoreSet(ss.FULL_FMRI_FILE),
                         "main_dict": ss.IndexStoreMainDict(ss.MAIN_FILE),
                         "token_byte_offset":
-                            ss.IndexStoreDictMutable(ss.BYTE_OFFSET_FILE)
+                            ss.IndexStoreDictMutable(ss.BYTE_OFFSET_FILE),
+                        "token_index":
+                            ss.IndexStoreTokenIndex(ss.TOKEN_INDEX_FILE),
+                        "token_trigrams":
+                            ss.IndexStoreTokenTrigrams(ss.TOKEN_TRIGRAMS_FILE)
                         }
 
                 self._data_fast_add = self._data_dict["fast_add"]
@@ -124,12 +194,12 @@ class Indexer(object):
                 self._data_full_fmri = self._data_dict["full_fmri"]
                 self._data_main_dict = self._data_dict["main_dict"]
                 self._data_token_offset = self._data_dict["token_byte_offset"]
+                self._data_token_index = self._data_dict["token_index"]
+                self._data_token_trigrams = self._data_dict["token_trigrams"]
 
                 # This is added to the dictionary after the others because it
                 # needs one of the other mappings as an input.
-                self._data_dict["fmri_offsets"] = \
-                    ss.InvertedDict(ss.FMRI_OFFSETS_FILE, self._data_manf)
-                self._data_fmri_offsets = self._data_dict["fmri_offsets"]
+                self._use_fmri_offsets(index_dir)
 
                 self._index_dir = index_dir
                 self._tmp_dir = os.path.join(self._index_dir, "TMP")
@@ -184,11 +254,31 @@ class Indexer(object):
 
                 return pkg.version.Version(unquote(vers), None)
 
+        def _use_fmri_offsets(self, directory):
+                """Uses the fmri offsets file found in the index in
+                'directory'.  Indexes built before the packed fmri_offsets.v2
+                file was introduced have an fmri_offsets.v1 file instead; it is
+                replaced by the packed file the next time all of the offsets
+                are written."""
+
+                if not os.path.exists(os.path.join(directory,
+                    ss.PACKED_FMRI_OFFSETS_FILE)) and \
+                    os.path.exists(os.path.join(directory,
+                    ss.FMRI_OFFSETS_FILE)):
+                        fo = ss.InvertedDict(ss.FMRI_OFFSETS_FILE,
+                            self._data_manf)
+                else:
+                        fo = ss.InvertedDictPacked(ss.PACKED_FMRI_OFFSETS_FILE,
+                            self._data_manf)
+                self._data_dict["fmri_offsets"] = fo
+                self._data_fmri_offsets = fo
+
         def _read_input_indexes(self, directory):
                 """ Opens all index files using consistent_open and reads all
                 of them into memory except the main dictionary file to avoid
                 inefficient memory usage."""
 
+                self._use_fmri_offsets(directory)
                 res = ss.consistent_open(self._data_dict.values(), directory,
                     self._file_timeout_secs)
                 pt = self._progtrack
@@ -203,7 +293,9 @@ class Indexer(object):
                         try:
                                 for d in self._data_dict.values():
                                         if (d == self._data_main_dict or
-                                                d == self._data_token_offset):
+                                                d == self._data_token_offset or
+                                                d == self._data_token_index or
+                                                d == self._data_token_trigrams):
                                                 pt.job_add_progress(
                                                     pt.JOB_READ_SEARCH)
                                                 continue
@@ -250,14 +342,8 @@ class Indexer(object):
                 the action."""
 
                 p_id = self._data_manf.get_id_and_add(pfmri)
-                pfmri = p_id
 
-                for tok_tup in new_dict.keys():
-                        tok, action_type, subtype, fv = tok_tup
-                        lst = [(action_type, [(subtype, [(fv, [(pfmri,
-                            list(new_dict[tok_tup]))])])])]
-                        s = ss.IndexStoreMainDict.transform_main_dict_line(tok,
-                            lst)
+                for tok, s in self._gen_sort_lines(p_id, new_dict):
                         if len(s) + self._sort_file_bytes >= \
                             self.sort_file_max_size:
                                 self.__close_sort_fh()
@@ -270,6 +356,20 @@ class Indexer(object):
                         self._sort_file_bytes += len(s)
                 return
 
+        @staticmethod
+        def _gen_sort_lines(p_id, new_dict):
+                """Yields each token in "new_dict", the search dictionary of
+                the package with id "p_id", along with the line for that token
+                to be written to a temporary sort file."""
+
+                for tok_tup, offsets in six.iteritems(new_dict):
+                        tok, action_type, subtype, fv = tok_tup
+                        lst = [(action_type, [(subtype, [(fv, [(p_id,
+                            list(offsets))])])])]
+                        yield tok, \
+                            ss.IndexStoreMainDict.transform_main_dict_line(tok,
+                            lst)
+
         def _fast_update(self, filters_pkgplan_list):
                 """Updates the log of packages which have been installed or
                 removed since the last time the index has been rebuilt.
@@ -370,6 +470,17 @@ class Indexer(object):
 
                 removed_paths = []
 
+                # Forking a process with other threads running can leave
+                # the children holding locks which will never be released,
+                # so a multithreaded caller such as the depot tokenizes the
+                # manifests itself.
+                if self.max_workers > 1 and \
+                    len(fmris) >= PARALLEL_INDEX_MIN_PKGS and \
+                    "fork" in multiprocessing.get_all_start_methods() and \
+                    threading.active_count() == 1:
+                        self.__process_fmris_parallel(fmris)
+                        return removed_paths
+
                 for added_fmri in fmris:
                         self._data_full_fmri.add_entity(
                             added_fmri.get_fmri(anarchy=True))
@@ -382,22 +493,73 @@ class Indexer(object):
                             self._progtrack.JOB_REBUILD_SEARCH)
                 return removed_paths
 
+        def __process_fmris_parallel(self, fmris):
+                """Tokenizes the manifests for the fmris using a pool of
+                processes.  Each process writes sorted temporary files which
+                are merged with the others by _gen_new_toks_from_files."""
+
+                global _worker_state
+
+                batch = []
+                for added_fmri in fmris:
+                        self._data_full_fmri.add_entity(
+                            added_fmri.get_fmri(anarchy=True))
+                        batch.append((
+                            self._data_manf.get_id_and_add(added_fmri),
+                            self.get_manifest_path_func(added_fmri)))
+
+                # Use several batches per process so that the work stays
+                # balanced when the sizes of manifests vary.
+                nworkers = min(self.max_workers, len(batch))
+                nbatches = nworkers * 4
+                bsize = (len(batch) + nbatches - 1) // nbatches
+                batches = list(enumerate(
+                    batch[i:i + bsize]
+                    for i in range(0, len(batch), bsize)
+                ))
+
+                _worker_state = (self.excludes, self._tmp_dir,
+                    max(1, self.sort_file_max_size // nworkers))
+                try:
+                        pool = multiprocessing.get_context("fork").Pool(
+                            nworkers)
+                        with pool:
+                                for names, msgs, n in pool.imap(
+                                    _index_worker, batches):
+                                        for msg in msgs:
+                                                if self.__log:
+                                                        self.__log(msg)
+                                        for name in names:
+                                                portable.rename(
+                                                    os.path.join(self._tmp_dir,
+                                                    name),
+                                                    os.path.join(self._tmp_dir,
+                                                    SORT_FILE_PREFIX +
+                                                    str(self._sort_file_num)))
+                                                self._sort_file_num += 1
+                                        self._progtrack.job_add_progress(
+                                            self._progtrack.JOB_REBUILD_SEARCH,
+                                            nitems=n)
+                finally:
+                        _worker_state = None
+
         def _write_main_dict_line(self, file_handle, token,
             fv_fmri_pos_list_list, out_dir):
                 """Writes out the new main dictionary file and also adds the
-                token offsets to _data_token_offset. file_handle is the file
-                handle for the output main dictionary file. token is the token
-                to add to the file. fv_fmri_pos_list_list is a structure of
-                lists inside of lists several layers deep. The top layer is a
-                list of action types. The second layer contains the keys for
-                the action type it's a sublist for. The third layer contains
-                the values which matched the token for the action and key it's
-                contained in. The fourth layer is the fmris which contain those
-                matches. The fifth layer is the offset into the manifest of
-                each fmri for each matching value. out_dir points to the
-                base directory to use to write a file for each package which
-                contains the offsets into the main dictionary for the tokens
-                this package matches."""
+                token offsets to _data_token_offset, the token offsets and
+                result counts to _data_token_index, and the token to
+                _data_token_trigrams. file_handle is the file handle for the
+                output main dictionary file. token is the token to add to the
+                file. fv_fmri_pos_list_list is a structure of lists inside of
+                lists several layers deep. The top layer is a list of action
+                types. The second layer contains the keys for the action type
+                it's a sublist for. The third layer contains the values which
+                matched the token for the action and key it's contained in. The
+                fourth layer is the fmris which contain those matches. The fifth
+                layer is the offset into the manifest of each fmri for each
+                matching value. out_dir points to the base directory to use to
+                write a file for each package which contains the offsets into
+                the main dictionary for the tokens this package matches."""
 
                 if self.old_out_token is not None and \
                     self.old_out_token >= token:
@@ -409,6 +571,8 @@ class Indexer(object):
                 cur_location_int = file_handle.tell()
                 cur_location = str(cur_location_int)
                 self._data_token_offset.write_entity(token, cur_location)
+                count = 0
+                self._data_token_trigrams.add_entity(token)
 
                 for at, st_list in fv_fmri_pos_list_list:
                         self._progtrack.job_add_progress(
@@ -428,6 +592,9 @@ class Indexer(object):
                                                 p_id = int(p_id)
                                                 self._data_fmri_offsets.add_pair(
                                                     p_id, cur_location_int)
+                                                count += len(m_off_set)
+                self._data_token_index.add_entity(token, cur_location_int,
+                    count)
                 file_handle.write(self._data_main_dict.transform_main_dict_line(
                     token, fv_fmri_pos_list_list))
 
@@ -458,87 +625,40 @@ class Indexer(object):
         def _gen_new_toks_from_files(self):
                 """Produces a stream of ordered tokens and the associated
                 information for those tokens from the sorted temporary files
-                produced by _add_terms. In short, this is the merge part of the
-                merge sort being done on the tokens to be indexed."""
-
-                def get_line(fh):
-                        """Helper function to make the initialization of the
-                        fh_dict easier to understand."""
-
-                        try:
-                                return \
-                                        ss.IndexStoreMainDict.parse_main_dict_line(
-                                        next(fh))
-                        except StopIteration:
-                                return None
-
-                # Build a mapping from numbers to the file handle for the
-                # temporary sort file with that number.
-                fh_dict = dict([
-                    (i, open(os.path.join(self._tmp_dir,
-                    SORT_FILE_PREFIX + str(i)), "r",
-                    buffering=PKG_FILE_BUFSIZ))
+                produced by _add_terms or _index_worker. In short, this is the
+                merge part of the merge sort being done on the tokens to be
+                indexed."""
+
+                def gen_lines(i):
+                        """Yields the token and information for each line
+                        of the temporary sort file numbered i."""
+
+                        with open(os.path.join(self._tmp_dir,
+                            SORT_FILE_PREFIX + str(i)), "r",
+                            buffering=PKG_FILE_BUFSIZ) as fh:
+                                parse = ss.IndexStoreMainDict. \
+                                    parse_main_dict_line
+                                for line in fh:
+                                        yield parse(line)
+
+                # The files are merged using a heap so that finding the next
+                # token doesn't require checking every file.  For a given
+                # token, the information from lower numbered files comes
+                # first.
+                merged = heapq.merge(*[
+                    gen_lines(i)
                     for i in range(self._sort_file_num)
-                ])
-
-                cur_toks = {}
-                # Seed cur_toks with the first token from each temporary file.
-                # The line may not exist since, for a empty repo, an empty file
-                # is created.
-                for i in list(fh_dict.keys()):
-                        line = get_line(fh_dict[i])
-                        if line is None:
-                                del fh_dict[i]
-                        else:
-                                cur_toks[i] = line
+                ], key=operator.itemgetter(0))
 
                 old_min_token = None
-                # cur_toks will have items deleted from it as files no longer
-                # have tokens to provide. When no files have tokens, the merge
-                # is done.
-                while cur_toks:
-                        min_token = None
-                        matches = []
-                        # Find smallest available token and the temporary files
-                        # which contain that token.
-                        for i in fh_dict.keys():
-                                cur_tok, info = cur_toks[i]
-                                if cur_tok is None:
-                                        continue
-                                if min_token is None or cur_tok < min_token:
-                                        min_token = cur_tok
-                                        matches = [i]
-                                elif cur_tok == min_token:
-                                        matches.append(i)
-                        assert min_token is not None
-                        assert len(matches) > 0
+                for min_token, matches in itertools.groupby(merged,
+                    key=operator.itemgetter(0)):
                         res = None
-                        for i in matches:
-                                new_tok, new_info = cur_toks[i]
-                                assert new_tok == min_token
-                                try:
-                                        # Continue pulling the next tokens from
-                                        # and adding them to the result list as
-                                        # long as the token matches min_token.
-                                        while new_tok == min_token:
-                                                if res is None:
-                                                        res = new_info
-                                                else:
-                                                        self.__splice(res,
-                                                            new_info)
-                                                new_tok, new_info = \
-                                                    ss.IndexStoreMainDict.parse_main_dict_line(next(fh_dict[i]))
-                                        cur_toks[i] = new_tok, new_info
-                                except StopIteration:
-                                        # When a StopIteration happens, the
-                                        # last line in the file has been read
-                                        # and processed. Delete all the
-                                        # information associated with that file
-                                        # so that we no longer check that file.
-                                        fh_dict[i].close()
-                                        del fh_dict[i]
-                                        del cur_toks[i]
-                        assert res is not None
+                        for new_tok, new_info in matches:
+                                if res is None:
+                                        res = new_info
+                                else:
+                                        self.__splice(res, new_info)
                         if old_min_token is not None and \
                             old_min_token >= min_token:
                                 raise RuntimeError("Got min token:{0} greater "
@@ -670,6 +790,11 @@ class Indexer(object):
                                             next(new_toks_it)
                                 except StopIteration:
                                         new_toks_available = False
+
+                        self._data_token_index.write_dict_file(out_dir,
+                            self.file_version_number)
+                        self._data_token_trigrams.write_dict_file(out_dir,
+                            self.file_version_number)
                 finally:
                         if not self.empty_index:
                                 file_handle.close()
@@ -694,7 +819,9 @@ class Indexer(object):
 
                 for d in self._data_dict.values():
                         if d == self._data_main_dict or \
-                            d == self._data_token_offset:
+                            d == self._data_token_offset or \
+                            d == self._data_token_index or \
+                            d == self._data_token_trigrams:
                                 continue
                         d.write_dict_file(out_dir, self.file_version_number)
 
@@ -773,6 +900,9 @@ class Indexer(object):
                                     str(self._sort_file_num)), "w")
                                 self._sort_file_num += 1
 
+                                # All of the offsets are written again, so
+                                # they're written to the packed file.
+                                self._use_fmri_offsets(tmp_index_dir)
                                 self._progtrack.job_start(
                                     self._progtrack.JOB_REBUILD_SEARCH,
                                     goal=len(inputs))
@@ -829,11 +959,131 @@ class Indexer(object):
                 self._generic_update_index(fmris, IDX_INPUT_TYPE_FMRI,
                     tmp_index_dir)
 
+        @staticmethod
+        def get_segment_dirs(index_root):
+                """Returns the directories of the delta segments of the
+                server index at 'index_root' in the order they were added."""
+
+                seg_root = os.path.join(index_root, SEGMENTS_DIR)
+                try:
+                        names = os.listdir(seg_root)
+                except EnvironmentError as e:
+                        if e.errno != errno.ENOENT:
+                                raise
+                        return []
+                return [
+                    os.path.join(seg_root, str(n))
+                    for n in sorted(int(n) for n in names if n.isdigit())
+                ]
+
+        @staticmethod
+        def get_generation(index_root):
+                """Returns a value which changes whenever the index at
+                'index_root', or any of its delta segments, is updated."""
+
+                gen = []
+                for d in [index_root] + Indexer.get_segment_dirs(index_root):
+                        try:
+                                st = os.stat(os.path.join(d, ss.MAIN_FILE))
+                        except EnvironmentError as e:
+                                if e.errno != errno.ENOENT:
+                                        raise
+                                gen.append((d, None))
+                                continue
+                        gen.append((d, st.st_ino, st.st_mtime, st.st_size))
+                return tuple(gen)
+
+        def server_update_index_segmented(self, fmris):
+                """Adds the fmris to the index.  If the main dictionary is
+                large enough that rewriting it would be costly, the fmris are
+                indexed in a new delta segment instead.  Returns whether the
+                segments should now be merged using server_merge_segments."""
+
+                try:
+                        size = os.path.getsize(os.path.join(self._index_dir,
+                            ss.MAIN_FILE))
+                except EnvironmentError as e:
+                        if e.errno != errno.ENOENT:
+                                raise
+                        size = 0
+                if size < MIN_SEGMENTED_INDEX_SIZE:
+                        self.server_update_index(fmris)
+                        return False
+                self.server_add_segment(fmris)
+                return len(self.get_segment_dirs(self._index_dir)) >= \
+                    MAX_INDEX_SEGMENTS
+
+        def server_add_segment(self, fmris):
+                """Indexes the fmris in a new delta segment instead of
+                rewriting the main dictionary of the index.  The segments are
+                searched along with the index, so the cost of adding packages
+                is proportional to the number of packages added rather than
+                the size of the repository.  Segments are folded back into
+                the index by server_merge_segments."""
+
+                self.lock()
+                try:
+                        seg_root = os.path.join(self._index_dir, SEGMENTS_DIR)
+                        seg_dirs = self.get_segment_dirs(self._index_dir)
+                        if seg_dirs:
+                                num = int(os.path.basename(seg_dirs[-1])) + 1
+                        else:
+                                num = 0
+
+                        # The segment is built in a temporary directory and
+                        # renamed into place so that searches never see a
+                        # partially written segment.
+                        tmp_dir = os.path.join(seg_root, "TMP")
+                        if os.path.exists(tmp_dir):
+                                shutil.rmtree(tmp_dir)
+                        makedirs(tmp_dir)
+                        ind = Indexer(tmp_dir, self.get_manifest_func,
+                            self.get_manifest_path_func,
+                            progtrack=self._progtrack, excludes=self.excludes,
+                            log=self.__log,
+                            sort_file_max_size=self.sort_file_max_size,
+                            max_workers=self.max_workers)
+                        ind.server_update_index(fmris)
+                        portable.rename(tmp_dir,
+                            os.path.join(seg_root, str(num)))
+                finally:
+                        self.unlock()
+
+        def server_merge_segments(self):
+                """Adds the packages in the delta segments to the index and
+                removes the segments.  Until the segments are removed, the
+                packages they contain are present in both."""
+
+                seg_dirs = self.get_segment_dirs(self._index_dir)
+                if not seg_dirs:
+                        return
+
+                fmris = set()
+                for seg_dir in seg_dirs:
+                        data = ss.IndexStoreSet(ss.FULL_FMRI_FILE)
+                        data.open(seg_dir)
+                        try:
+                                data.read_dict_file()
+                        finally:
+                                data.close_file_handle()
+                        fmris.update(data.get_set())
+                self.server_update_index(
+                    [fmri.PkgFmri(f) for f in sorted(fmris)])
+
+                self.lock(blocking=True)
+                try:
+                        for seg_dir in seg_dirs:
+                                portable.rename(seg_dir, seg_dir + ".old")
+                                shutil.rmtree(seg_dir + ".old")
+                finally:
+                        self.unlock()
+
         def check_index_existence(self):
                 """ Returns a boolean value indicating whether a consistent
                 index exists. If an index exists but is inconsistent, an
                 exception is raised."""
 
+                self._use_fmri_offsets(self._index_dir)
                 try:
                         try:
                                 res = \
@@ -892,12 +1142,13 @@ class Indexer(object):
                 present = False
 
                 makedirs(self._index_dir)
+                self._use_fmri_offsets(self._index_dir)
                 for d in self._data_dict.values():
                         file_path = os.path.join(self._index_dir,
                             d.get_file_name())
                         if os.path.exists(file_path):
                                 present = True
-                        else:
+                        elif not d.optional:
                                 absent = True
                         if absent and present:
                                 raise search_errors.InconsistentIndexException(
@@ -936,6 +1187,17 @@ class Indexer(object):
                         data.read_and_discard_matching_from_argument(fmri_set)
                 finally:
                         data.close_file_handle()
+
+                # Packages in the delta segments of a server index have
+                # already been indexed as well.
+                for seg_dir in Indexer.get_segment_dirs(index_root):
+                        data = ss.IndexStoreSet(ss.FULL_FMRI_FILE)
+                        data.open(seg_dir)
+                        try:
+                                data.read_and_discard_matching_from_argument(
+                                    fmri_set)
+                        finally:
+                                data.close_file_handle()
                 return fmri_set
 
         def _migrate(self, source_dir=None, dest_dir=None, fast_update=False):
@@ -949,7 +1211,8 @@ class Indexer(object):
                 old information.
 
                 The "fast_update" parameter determines whether the main
-                dictionary and the token byte offset files are moved.  This is
+                dictionary and the token byte offset and token index files are
+                moved.  This is
                 used so that when only the update logs are touched, the large
                 files don't need to be moved."""
 
@@ -962,6 +1225,8 @@ class Indexer(object):
                 for d in self._data_dict.values():
                         if fast_update and (d == self._data_main_dict or
                             d == self._data_token_offset or
+                            d == self._data_token_index or
+                            d == self._data_token_trigrams or
                             d == self._data_fmri_offsets):
                                 continue
                         else:
@@ -977,6 +1242,14 @@ class Indexer(object):
                                 raise
                         except Exception:
                                 pass
+                        # Remove the legacy fmri_offsets.v1 file which is
+                        # obsoleted by the packed fmri_offsets.v2 file.
+                        try:
+                                portable.remove(os.path.join(dest_dir,
+                                    ss.FMRI_OFFSETS_FILE))
+                        except EnvironmentError as e:
+                                if e.errno != errno.ENOENT:
+                                        raise
 
                         for at, fh in self.at_fh.items():
                                 shutil.move(
@@ -31,6 +31,7 @@ from functools import reduce
 import errno
 import fnmatch
 import hashlib
+import mmap
 import os
 import re
 import six
@@ -122,6 +123,59 @@ class ManifestDifference(
 
                 return ManifestDifference(*state)
 
+def _action_key(action):
+        """Returns the key used to pair the given action with its counterpart
+        in another manifest; this is the action name and the value of its key
+        attribute (along with the mediator for mediated links), or its id if it
+        has no key attribute."""
+
+        attrs = action.attrs
+        if (action.name == "link" or action.name == "hardlink") and \
+            attrs.get("mediator"):
+                return (action.name, tuple([
+                    attrs[action.key_attr],
+                    attrs.get("mediator-version"),
+                    attrs.get("mediator-implementation")
+                ]))
+
+        v = attrs.get(action.key_attr, id(action))
+        if type(v) is list:
+                # Key values may be lists.
+                v = tuple(v)
+        return (action.name, v)
+
+def _action_digest(action):
+        """Returns the hex digest of the canonical string form of the given
+        action."""
+
+        return hashlib.sha1(misc.force_bytes(str(action))).hexdigest()
+
+class _LazyContent(object):
+        """Private helper class that tracks the actions of a Manifest whose
+        content was loaded lazily."""
+
+        __slots__ = ["excludes", "loaded", "pending"]
+
+        def __init__(self, excludes):
+                # The excludes to apply to actions as they're created.
+                self.excludes = excludes
+                # A list of (index, action) tuples for the actions created so
+                # far; 'index' is the position of the action in the content.
+                self.loaded = []
+                # A dictionary mapping action names to a list of (index, lineno,
+                # line) tuples for the actions not yet created.
+                self.pending = {}
+
+        def add(self, idx, action):
+                self.loaded.append((idx, action))
+
+        def ordered(self):
+                """Returns the list of created actions in content order."""
+
+                self.loaded.sort(key=itemgetter(0))
+                return [a for idx, a in self.loaded]
+
+
 class Manifest(object):
         """A Manifest is the representation of the actions composing a specific
         package version on both the client and the repository.  Both purposes
@@ -164,6 +218,7 @@ class Manifest(object):
 
                 self._cache = {}
                 self._absent_cache = []
+                self.__lazy = None
                 self.actions = []
                 self.actions_bytype = {}
                 self.attributes = {} # package-wide attributes
@@ -176,6 +231,35 @@ class Manifest(object):
                 else:
                         self.publisher = None
 
+        @property
+        def actions(self):
+                """The list of the manifest's actions, in the order they were
+                found in the manifest's content."""
+
+                if self.__lazy is not None:
+                        self.__load_lazy()
+                return self._actions
+
+        @actions.setter
+        def actions(self, value):
+                self.__lazy = None
+                self._actions = value
+
+        @property
+        def actions_bytype(self):
+                """A dictionary mapping action names to the list of the
+                manifest's actions of that type."""
+
+                if self.__lazy is not None:
+                        for atype in list(self.__lazy.pending):
+                                self.__load_lazy_type(atype)
+                return self._actions_bytype
+
+        @actions_bytype.setter
+        def actions_bytype(self, value):
+                self.__lazy = None
+                self._actions_bytype = value
+
         def __str__(self):
                 r = ""
                 if "pkg.fmri" not in self.attributes and self.fmri != None:
@@ -218,29 +302,12 @@ class Manifest(object):
                             [(None, a) for a in self.gen_actions(
                             excludes=self_exclude)], [], [])
 
-                def hashify(v):
-                        """handle key values that may be lists"""
-                        if type(v) is not list:
-                                return v
-                        return tuple(v)
-
                 def dictify(mf, excludes):
                         # Transform list of actions into a dictionary keyed by
                         # action key attribute, key attribute and mediator, or
                         # id if there is no key attribute.
                         for a in mf.gen_actions(excludes=excludes):
-                                if (a.name == "link" or
-                                    a.name == "hardlink") and \
-                                    a.attrs.get("mediator"):
-                                        akey = (a.name, tuple([
-                                            a.attrs[a.key_attr],
-                                            a.attrs.get("mediator-version"),
-                                            a.attrs.get("mediator-implementation")
-                                        ]))
-                                else:
-                                        akey = (a.name, hashify(a.attrs.get(
-                                            a.key_attr, id(a))))
-                                yield (akey, a)
+                                yield (_action_key(a), a)
 
                 sdict = dict(dictify(self, self_exclude))
                 odict = dict(dictify(origin, origin_exclude))
@@ -250,9 +317,23 @@ class Manifest(object):
 
                 added = [(None, sdict[i]) for i in sset - oset]
                 removed = [(odict[i], None) for i in oset - sset]
+
+                common = oset & sset
+                sdigests = self._get_action_digests()
+                odigests = origin._get_action_digests()
+                if sdigests and odigests:
+                        # Actions with the same canonical string form can't be
+                        # different, so only those pairs with differing (or
+                        # unknown) digests need a full comparison.
+                        common = [
+                            i for i in common
+                            if sdigests.get(i) is None or
+                                sdigests[i] != odigests.get(i)
+                        ]
+
                 changed = [
                     (odict[i], sdict[i])
-                    for i in oset & sset
+                    for i in common
                     if odict[i].different(sdict[i], pkgplan=pkgplan,
                         cmp_policy=cmp_policy)
                 ]
@@ -431,6 +512,40 @@ class Manifest(object):
                                 )
                                 yield a
 
+        def _gen_digests_to_str(self):
+                """Generate contents of digest cache containing the digest of
+                the canonical string form of each action in self.actions that
+                is uniquely identified by the value of its key attribute.  Each
+                line is of the form '<digest> <action name> <key value>'."""
+
+                digests = {}
+                for a in self.gen_actions():
+                        akey = _action_key(a)
+                        if akey in digests:
+                                # Key is shared by more than one action (e.g.
+                                # variant-tagged ones), so the actions must be
+                                # compared instead.
+                                digests[akey] = None
+                        else:
+                                digests[akey] = _action_digest(a)
+
+                for (name, kv), d in six.iteritems(digests):
+                        # Actions without a key attribute, with a key composed
+                        # of multiple values, or with a key value that would
+                        # span lines are never cached.
+                        if d is not None and \
+                            isinstance(kv, six.string_types) and \
+                            "\n" not in kv:
+                                yield "{0} {1} {2}\n".format(d, name, kv)
+
+        def _get_action_digests(self):
+                """Returns a dictionary of the digests of the canonical string
+                form of actions keyed by action key, or None if there is no
+                digest data available.  Used by difference() to avoid action
+                comparisons; only subclasses with cached data provide it."""
+
+                return None
+
         def _gen_attrs_to_str(self):
                 """Generate set action supplemental data containing all facets
                 and variants from self.actions and size information.  Each
@@ -933,8 +1048,12 @@ class Manifest(object):
                 if attr_match:
                         attr_match = _compile_fnpats(attr_match)
 
+                if self.__lazy is not None:
+                        # Only actions of the requested type are needed.
+                        self.__load_lazy_type(atype)
+
                 pub = self.publisher
-                for a in self.actions_bytype.get(atype, []):
+                for a in self._actions_bytype.get(atype, []):
                         for c in excludes:
                                 if not c(a, publisher=pub):
                                         break
@@ -958,6 +1077,18 @@ class Manifest(object):
                 """Generate the value of the key attribute for each action
                 of type "type" in the manifest."""
 
+                if self.excludes == excludes:
+                        excludes = EmptyI
+                if self.__lazy is not None and not excludes and \
+                    not self.__lazy.excludes and atype in self.__lazy.pending:
+                        keys = [
+                            self.__lazy_key(atype, l)
+                            for idx, lineno, l in self.__lazy.pending[atype]
+                        ]
+                        if None not in keys:
+                                # No action needs to be parsed.
+                                return iter(keys)
+
                 return (
                     a.attrs.get(a.key_attr)
                     for a in self.gen_actions_by_type(atype, excludes=excludes)
@@ -973,7 +1104,12 @@ class Manifest(object):
                         return a.name, a.attrs.get(a.key_attr, id(a))
 
                 alldups = []
-                acts = [a for a in self.gen_actions(excludes=excludes)]
+                if self.excludes == excludes:
+                        excludes = EmptyI
+                if self.__lazy is not None and not excludes:
+                        acts = self.__lazy_duplicate_candidates()
+                else:
+                        acts = [a for a in self.gen_actions(excludes=excludes)]
 
                 for k, g in groupby(sorted(acts, key=fun), fun):
                         glist = list(g)
@@ -986,7 +1122,50 @@ class Manifest(object):
                                 alldups.append((k, dups))
                 return alldups
 
-        def __content_to_actions(self, content):
+        @staticmethod
+        def __gen_content_lines(content):
+                """Generate the (lineno, line) tuples of the actions found in
+                the manifest content, stripping line-continuation characters
+                from the input as it is read and skipping blank lines and
+                comments.  'lineno' is the line number at which each action
+                ends."""
+
+                accumulate = ""
+                lineno = 0
+
+                if isinstance(content, six.string_types):
+                        # Get an iterable for the string.
+                        content = content.splitlines()
+
+                for l in content:
+                        lineno += 1
+                        l = l.lstrip()
+                        if l.endswith("\\"):          # allow continuation chars
+                                accumulate += l[0:-1] # elide backslash
+                                continue
+                        elif accumulate:
+                                l = accumulate + l
+                                accumulate = ""
+
+                        if not l or l[0] == "#": # ignore blank lines & comments
+                                continue
+                        yield lineno, l
+
+        def __parse_line(self, lineno, l, errors):
+                """Returns the action for the given line of manifest content or
+                None if it couldn't be parsed, in which case the error is
+                appended to the 'errors' list."""
+
+                try:
+                        return actions.fromstr(l)
+                except actions.ActionError as e:
+                        # Accumulate errors and continue so that as much of the
+                        # action data as possible can be parsed.
+                        e.fmri = self.fmri
+                        e.lineno = lineno
+                        errors.append(e)
+
+        def __content_to_actions(self, content, excludes=EmptyI):
                 """Parse manifest content, stripping line-continuation
                 characters from the input as it is read; this results in actions
                 with values across multiple lines being passed to the
@@ -1003,44 +1182,147 @@ class Manifest(object):
 
                 set name=pkg.summary value="foo"
                 set name=pkg.description value="foo " "bar baz"
+
+                The content is parsed in a single call to the action parsing
+                code; actions not allowed by 'excludes' are omitted from the
+                returned list as it is parsed.
                 """
 
-                accumulate = ""
-                lineno = 0
-                errors = []
+                alist, errors = actions.fromcontent(content, excludes=excludes,
+                    publisher=self.publisher)
+                if errors:
+                        for e in errors:
+                                e.fmri = self.fmri
+                        raise apx.InvalidPackageErrors(errors)
+                return alist
 
-                if isinstance(content, six.string_types):
-                        # Get an iterable for the string.
-                        content = content.splitlines()
+        def __set_lazy_content(self, content, excludes):
+                """Populate the manifest with the manifest content without
+                parsing the actions it contains (other than set actions, which
+                provide the package attributes).  The content of each action is
+                kept along with its type and actions are only created the first
+                time that actions of their type are needed."""
 
-                for l in content:
-                        lineno += 1
-                        l = l.lstrip()
-                        if l.endswith("\\"):          # allow continuation chars
-                                accumulate += l[0:-1] # elide backslash
+                lazy = _LazyContent(excludes)
+                errors = []
+                for idx, (lineno, l) in enumerate(
+                    self.__gen_content_lines(content)):
+                        atype = l.split(None, 1)[0]
+                        if atype != "set" and atype in actions.types:
+                                lazy.pending.setdefault(atype, []).append(
+                                    (idx, lineno, l))
                                 continue
-                        elif accumulate:
-                                l = accumulate + l
-                                accumulate = ""
 
-                        if not l or l[0] == "#": # ignore blank lines & comments
+                        # Parse set actions (and any actions of unknown type
+                        # so that errors are reported) immediately.
+                        action = self.__parse_line(lineno, l, errors)
+                        if action is not None and \
+                            self.__prep_action(action, excludes):
+                                lazy.add(idx, action)
+                                self.__add_loaded_action(action)
+
+                if errors:
+                        raise apx.InvalidPackageErrors(errors)
+                if lazy.pending:
+                        self.__lazy = lazy
+                else:
+                        self._actions = lazy.ordered()
+
+        def __load_lazy_type(self, atype):
+                """Create the actions of the given type for a manifest whose
+                content was loaded lazily."""
+
+                lines = self.__lazy.pending.pop(atype, None)
+                if lines is None:
+                        return
+
+                errors = []
+                excludes = self.__lazy.excludes
+                for idx, lineno, l in lines:
+                        action = self.__parse_line(lineno, l, errors)
+                        if action is not None and \
+                            self.__prep_action(action, excludes):
+                                self.__lazy.add(idx, action)
+                                self.__add_loaded_action(action)
+
+                if errors:
+                        raise apx.InvalidPackageErrors(errors)
+
+        def __load_lazy(self):
+                """Create all remaining actions for a manifest whose content
+                was loaded lazily."""
+
+                lazy = self.__lazy
+                for atype in list(lazy.pending):
+                        self.__load_lazy_type(atype)
+
+                # Restore the original order of the actions.
+                self._actions = lazy.ordered()
+                self.__lazy = None
+
+        @staticmethod
+        def __lazy_key(atype, l):
+                """Returns the value of the key attribute in the given action
+                content or None if it can't be determined without parsing the
+                action."""
+
+                key_attr = actions.types[atype].key_attr
+                if key_attr is None or "\"" in l or "'" in l:
+                        return None
+                vals = [
+                    v for k, sep, v in (
+                        t.partition("=") for t in l.split()
+                    )
+                    if k == key_attr and sep
+                ]
+                if len(vals) != 1:
+                        return None
+                if key_attr == "path":
+                        # Leading slashes are removed from paths when the
+                        # action is created.
+                        return vals[0].lstrip("/") or None
+                return vals[0]
+
+        def __lazy_duplicate_candidates(self):
+                """Returns the list of actions that must be compared to find
+                duplicates in a manifest whose content was loaded lazily.
+                Actions that haven't been created yet are only created (without
+                being added to the manifest) if their key attribute value is
+                shared with another action of the same type."""
+
+                acts = []
+                for atype, alist in six.iteritems(self._actions_bytype):
+                        if atype not in self.__lazy.pending:
+                                acts.extend(alist)
+
+                errors = []
+                excludes = self.__lazy.excludes
+                for atype, lines in six.iteritems(self.__lazy.pending):
+                        if actions.types[atype].key_attr is None:
+                                # All attributes are distinguishing, so no
+                                # action of this type can be a duplicate.
                                 continue
 
-                        try:
-                                yield actions.fromstr(l)
-                        except actions.ActionError as e:
-                                # Accumulate errors and continue so that as
-                                # much of the action data as possible can be
-                                # parsed.
-                                e.fmri = self.fmri
-                                e.lineno = lineno
-                                errors.append(e)
+                        bykey = {}
+                        for idx, lineno, l in lines:
+                                bykey.setdefault(self.__lazy_key(atype, l),
+                                    []).append((lineno, l))
+                        candidates = bykey.pop(None, [])
+                        for klines in six.itervalues(bykey):
+                                if len(klines) > 1:
+                                        candidates.extend(klines)
+                        for lineno, l in candidates:
+                                a = self.__parse_line(lineno, l, errors)
+                                if a is not None and \
+                                    self.__prep_action(a, excludes):
+                                        acts.append(a)
 
                 if errors:
                         raise apx.InvalidPackageErrors(errors)
+                return acts
 
         def set_content(self, content=None, excludes=EmptyI, pathname=None,
-            signatures=False):
+            signatures=False, lazy=False):
                 """Populate the manifest with actions.
 
                 'content' is an optional value containing either the text
@@ -1057,6 +1339,12 @@ class Manifest(object):
                 'signatures' is an optional boolean value that indicates whether
                 a manifest signature should be generated.  This is only possible
                 when 'content' is a string or 'pathname' is provided.
+
+                'lazy' is an optional boolean value that indicates whether the
+                creation of the manifest's actions (other than set actions)
+                should be deferred until actions of their type are first
+                needed.  This is only possible when 'content' is a string or
+                'pathname' is provided.
                 """
 
                 assert content is not None or pathname is not None
@@ -1077,15 +1365,21 @@ class Manifest(object):
                 # together has to be solved somewhere else, though.)
                 if pathname:
                         try:
-                                with open(pathname, "r", encoding='UTF-8') as mfile:
-                                        content = mfile.read()
+                                if signatures or lazy:
+                                        with open(pathname, "r",
+                                            encoding='UTF-8') as mfile:
+                                                content = mfile.read()
+                                else:
+                                        # The action parsing code can use the
+                                        # raw content; avoid decoding it.
+                                        with open(pathname, "rb") as mfile:
+                                                content = mfile.read()
                         except EnvironmentError as e:
                                 raise apx._convert_error(e)
-
-                if six.PY3 and isinstance(content, bytes):
+                elif six.PY3 and isinstance(content, bytes):
                         raise TypeError("content must be str, not bytes")
 
-                if isinstance(content, six.string_types):
+                if isinstance(content, (six.string_types, bytes)):
                         if signatures:
                                 # Generate manifest signature based upon
                                 # input content, but only if signatures
@@ -1094,7 +1388,19 @@ class Manifest(object):
                                 self.signatures = {
                                     "sha-1": self.hash_create(content)
                                 }
-                        content = self.__content_to_actions(content)
+                        if lazy:
+                                self.__set_lazy_content(content, excludes)
+                                content = EmptyI
+                        else:
+                                for action in self.__content_to_actions(
+                                    content, excludes):
+                                        # Excluded actions were omitted during
+                                        # parsing, except for legacy ones that
+                                        # may need to be transformed first.
+                                        self.add_action(action, excludes
+                                            if "opensolaris.zone" in
+                                            action.attrs else EmptyI)
+                                content = EmptyI
 
                 for action in content:
                         self.add_action(action, excludes)
@@ -1120,8 +1426,17 @@ class Manifest(object):
                 The "excludes" parameter is the variants to exclude from the
                 manifest."""
 
+                if not self.__prep_action(action, excludes):
+                        return
+                self.actions.append(action)
+                self.__add_loaded_action(action)
+
+        def __prep_action(self, action, excludes):
+                """Performs any needed transformations on the action and
+                returns a boolean indicating whether it should be added to the
+                manifest based on the provided excludes."""
+
                 attrs = action.attrs
-                aname = action.name
 
                 # XXX handle legacy transition issues; not needed once support
                 # for upgrading images from older releases (< build 151) has
@@ -1131,18 +1446,25 @@ class Manifest(object):
                         attrs["variant.opensolaris.zone"] = \
                             attrs["opensolaris.zone"]
 
-                if aname == "set" and attrs["name"] == "authority":
+                if action.name == "set" and attrs["name"] == "authority":
                         # Translate old action to new.
                         attrs["name"] = "publisher"
 
                 if excludes and not action.include_this(excludes,
                     publisher=self.publisher):
-                        return
-                self.actions.append(action)
+                        return False
+                return True
+
+        def __add_loaded_action(self, action):
+                """Adds the action to the manifest's per-type action lists and
+                package attributes."""
+
+                aname = action.name
                 try:
-                        self.actions_bytype[aname].append(action)
+                        self._actions_bytype[aname].append(action)
                 except KeyError:
-                        self.actions_bytype.setdefault(aname, []).append(action)
+                        self._actions_bytype.setdefault(aname, []).append(
+                            action)
 
                 # add any set actions to attributes
                 if aname == "set":
@@ -1535,16 +1857,248 @@ class Manifest(object):
 
 null = Manifest()
 
+def _parse_index(buf, magic, offset=0, length=None):
+        """Private helper function that parses the index at the start of the
+        data in 'buf' beginning at 'offset' and spanning 'length' bytes.  The
+        index consists of the 'magic' line, one line per entry of the form
+        '<name> <offset> <length>' and an empty line; entry offsets are
+        relative to the end of the index.  Returns a dictionary mapping each
+        name to the (start, end) positions of its data in 'buf'.  Raises
+        ValueError if the data is malformed."""
+
+        if length is None:
+                length = len(buf) - offset
+        end = offset + length
+        if buf[offset:offset + len(magic)] != magic:
+                raise ValueError(magic)
+
+        istart = offset + len(magic)
+        iend = buf.find(b"\n\n", istart - 1, end)
+        if iend < 0:
+                raise ValueError(magic)
+        dstart = iend + 2
+
+        index = {}
+        for l in buf[istart:iend + 1].splitlines():
+                name, doff, dlen = l.split(b" ")
+                dbegin = dstart + int(doff)
+                dend = dbegin + int(dlen)
+                if dend > end:
+                        raise ValueError(magic)
+                index[name.decode("utf-8")] = (dbegin, dend)
+        return index
+
+
+def _dump_index(magic, entries):
+        """Private helper function that returns the bytes for the given
+        iterable of (name, data) tuples prefixed with an index in the format
+        read by _parse_index."""
+
+        index = [magic]
+        data = []
+        offset = 0
+        for name, d in entries:
+                index.append("{0} {1:d} {2:d}\n".format(name, offset,
+                    len(d)).encode("utf-8"))
+                data.append(d)
+                offset += len(d)
+        index.append(b"\n")
+        return b"".join(chain(index, data))
+
+
+def _map_file(pathname):
+        """Private helper function that returns a read-only memory map of the
+        file at 'pathname' or None if it does not exist or is empty."""
+
+        try:
+                with open(pathname, "rb") as f:
+                        return mmap.mmap(f.fileno(), 0,
+                            access=mmap.ACCESS_READ)
+        except EnvironmentError as e:
+                if e.errno == errno.ENOENT:
+                        return None
+                raise apx._convert_error(e)
+        except ValueError:
+                # Empty files can't be mapped.
+                return None
+
+
+def _write_file(pathname, data):
+        """Private helper function that atomically replaces the file at
+        'pathname' with the provided bytes."""
+
+        t_dir = os.path.dirname(pathname)
+        misc.makedirs(t_dir)
+        try:
+                fd, fn = tempfile.mkstemp(dir=t_dir,
+                    prefix=os.path.basename(pathname) + ".")
+                with os.fdopen(fd, "wb") as f:
+                        f.write(data)
+                os.chmod(fn, PKG_FILE_MODE)
+                portable.rename(fn, pathname)
+        except EnvironmentError as e:
+                raise apx._convert_error(e)
+
+
+class _ManifestCache(object):
+        """Provides access to the data cached for a manifest.  The cached data
+        is divided into sections; one for the actions of each type found in
+        the manifest (the 'set' section also includes the supplemental
+        attribute data) and the 'dircache' and 'mediatorcache' sections.  The
+        data starts with an index of the sections so that only those needed
+        are read."""
+
+        MAGIC = b"pkg5-manifest-cache 1\n"
+
+        def __init__(self, buf, offset=0, length=None):
+                """'buf' is a bytes-like object (usually a memory map)
+                containing the cache data at 'offset' and spanning 'length'
+                bytes.  Raises ValueError if the data is malformed."""
+
+                self.__buf = buf
+                self.__index = _parse_index(buf, self.MAGIC, offset=offset,
+                    length=length)
+
+        def __contains__(self, name):
+                return name in self.__index
+
+        def lines(self, name):
+                """Returns a list of the lines in the named section."""
+
+                begin, end = self.__index[name]
+                # Only newlines separate actions; values may contain other
+                # line-breaking characters.
+                return self.__buf[begin:end].decode("utf-8").split("\n")
+
+        @classmethod
+        def dump(cls, sections):
+                """Returns the cache data as bytes for the given iterable of
+                (name, lines) tuples."""
+
+                return _dump_index(cls.MAGIC, (
+                    (name, "".join(lines).encode("utf-8"))
+                    for name, lines in sections
+                ))
+
+        @classmethod
+        def load(cls, pathname):
+                """Returns a _ManifestCache object for the cache file at
+                'pathname' or None if it does not exist or is malformed."""
+
+                buf = _map_file(pathname)
+                if buf is None:
+                        return None
+                try:
+                        return cls(buf)
+                except ValueError:
+                        return None
+
+
+class PackedManifestCache(object):
+        """An image-wide store of the cached data of many manifests kept in a
+        single file, so that the data for all of an image's packages can be
+        read using one memory map instead of opening a cache file for each
+        package.  The file starts with an index mapping package FMRIs to the
+        location of their cache data.  FactoredManifest objects use the data
+        found in the store in preference to their own cache file."""
+
+        MAGIC = b"pkg5-manifest-pack 1\n"
+
+        def __init__(self, pathname):
+                """'pathname' is the location of the store's file; it need not
+                exist."""
+
+                self.__buf = None
+                self.__index = None
+                self.__pathname = pathname
+
+        def __load(self):
+                if self.__index is not None:
+                        return
+                self.__index = {}
+                buf = _map_file(self.__pathname)
+                if buf is None:
+                        return
+                try:
+                        self.__index = _parse_index(buf, self.MAGIC)
+                except ValueError:
+                        # Ignore a damaged store; it will be replaced by the
+                        # next update.
+                        return
+                self.__buf = buf
+
+        def __contains__(self, pfmri):
+                self.__load()
+                return str(pfmri) in self.__index
+
+        def __len__(self):
+                self.__load()
+                return len(self.__index)
+
+        def get(self, pfmri):
+                """Returns a _ManifestCache object for the data stored for the
+                given package or None if there is none."""
+
+                self.__load()
+                try:
+                        begin, end = self.__index[str(pfmri)]
+                        return _ManifestCache(self.__buf, offset=begin,
+                            length=end - begin)
+                except (KeyError, ValueError):
+                        return None
+
+        def get_data(self, pfmri):
+                """Returns the data stored for the given package as bytes or
+                None if there is none."""
+
+                self.__load()
+                try:
+                        begin, end = self.__index[str(pfmri)]
+                except KeyError:
+                        return None
+                return self.__buf[begin:end]
+
+        def update(self, pfmris, get_cache_root):
+                """Replaces the contents of the store with the cached data of
+                the packages in 'pfmris'.  Data already in the store is reused;
+                that of other packages is read from the cache file found in the
+                directory returned by 'get_cache_root' for each FMRI.  Packages
+                that have no cache data are omitted."""
+
+                def gen_entries():
+                        for pfmri in sorted(pfmris, key=str):
+                                data = self.get_data(pfmri)
+                                if data is None:
+                                        data = _map_file(os.path.join(
+                                            get_cache_root(pfmri),
+                                            FactoredManifest.CACHE_NAME))
+                                        if data is None:
+                                                continue
+                                        try:
+                                                _ManifestCache(data)
+                                        except ValueError:
+                                                continue
+                                        data = data[:]
+                                yield str(pfmri), data
+
+                _write_file(self.__pathname, _dump_index(self.MAGIC,
+                    gen_entries()))
+                self.__buf = self.__index = None
+
+
 class FactoredManifest(Manifest):
         """This class serves as a wrapper for the Manifest class for callers
         that need efficient access to package data on a per-action type basis.
-        It achieves this by partitioning the manifest into multiple files (one
-        per action type) and then storing an on-disk cache of the directories
-        explictly and implicitly referenced by the manifest each tagged with
-        the appropriate variants/facets."""
+        It achieves this by partitioning the manifest into sections (one per
+        action type) along with the directories explictly and implicitly
+        referenced by the manifest each tagged with the appropriate
+        variants/facets, and storing them in a single, indexed cache file."""
+
+        # The name of the cache file stored in the cache_root.
+        CACHE_NAME = "manifest.cache"
 
         def __init__(self, fmri, cache_root, contents=None, excludes=EmptyI,
-            pathname=None):
+            pathname=None, packed=None):
                 """Raises KeyError exception if factored manifest is not present
                 and contents are None; delays reading of manifest until required
                 if cache file is present.
@@ -1568,16 +2122,24 @@ class FactoredManifest(Manifest):
                 'cache_root'.  If provided, and contents is also provided, then
                 'contents' will be stored in 'pathname' if it does not already
                 exist.
+
+                'packed' is an optional PackedManifestCache object; if it
+                contains data for the package, that is used instead of the
+                package's cache file.
                 """
 
                 Manifest.__init__(self, fmri)
                 self.__cache_root = cache_root
+                self.__mcache = None
                 self.__pathname = pathname
                 # Make sure that either no excludes were provided or 2+ excludes
                 # were.
                 assert len(self.excludes) != 1
                 self.loaded = False
 
+                if packed is not None:
+                        self.__mcache = packed.get(fmri)
+
                 # Do we have a cached copy?
                 if not os.path.exists(self.pathname):
                         if contents is None:
@@ -1594,10 +2156,11 @@ class FactoredManifest(Manifest):
                         return
 
                 # we have a cached copy of the manifest
-                mdpath = self.__cache_path("manifest.dircache")
+                mcpath = self.__cache_path(self.CACHE_NAME)
 
-                # have we computed the dircache?
-                if not os.path.exists(mdpath): # we're adding cache
+                # have we computed the cache?
+                if self.__mcache is None and \
+                    not os.path.exists(mcpath): # we're adding cache
                         self.excludes = EmptyI # to existing manifest
                         self.__load()
                         if self.__storeback():
@@ -1612,8 +2175,10 @@ class FactoredManifest(Manifest):
                 return os.path.join(self.__cache_root, name)
 
         def __load(self):
-                """Load all manifest contents from on-disk copy of manifest"""
-                self.set_content(excludes=self.excludes, pathname=self.pathname)
+                """Load all manifest contents from on-disk copy of manifest;
+                actions are only created once their type is needed."""
+                self.set_content(excludes=self.excludes, pathname=self.pathname,
+                    lazy=True)
                 self.__finiload()
 
         def __unload(self):
@@ -1643,68 +2208,48 @@ class FactoredManifest(Manifest):
                         return False
 
         def __storebytype(self):
-                """ create manifest.<typename> files to accelerate partial
+                """ create the manifest cache file to accelerate partial
                 parsing of manifests.  Separate from __storeback code to
                 allow upgrade to reuse existing on disk manifests"""
 
                 assert self.loaded
 
-                t_dir = self.__cache_root
-
-                # Ensure target cache directory and intermediates exist.
-                misc.makedirs(t_dir)
-
-                # create per-action type cache; use rename to avoid corrupt
-                # files if ^C'd in the middle.  All action types are considered
-                # so that empty cache files are created if no action of that
-                # type exists for the package (avoids full manifest loads
-                # later).
-                for n, acts in six.iteritems(self.actions_bytype):
-                        t_prefix = "manifest.{0}.".format(n)
-
-                        try:
-                                fd, fn = tempfile.mkstemp(dir=t_dir,
-                                    prefix=t_prefix)
-                        except EnvironmentError as e:
-                                raise apx._convert_error(e)
-
-                        f = os.fdopen(fd, "w")
-                        try:
-                                for a in acts:
-                                        f.write("{0}\n".format(a))
+                def gen_sections():
+                        # All action types are considered so that the sections
+                        # are present even if no action of that type exists
+                        # for the package (avoids full manifest loads later).
+                        for n, acts in six.iteritems(self.actions_bytype):
+                                lines = ["{0}\n".format(a) for a in acts]
                                 if n == "set":
                                         # Add supplemental action data; yes this
                                         # does mean the cache is not the same as
                                         # retrieved manifest, but that's ok.
                                         # Signature verification is done using
                                         # the raw manifest.
-                                        f.writelines(self._gen_attrs_to_str())
-                        except EnvironmentError as e:
-                                raise apx._convert_error(e)
-                        finally:
-                                f.close()
-
-                        try:
-                                os.chmod(fn, PKG_FILE_MODE)
-                                portable.rename(fn,
-                                    self.__cache_path("manifest.{0}".format(n)))
-                        except EnvironmentError as e:
-                                raise apx._convert_error(e)
-
-                def create_cache(name, refs):
+                                        lines.extend(self._gen_attrs_to_str())
+                                yield n, lines
+                        yield "dircache", self._gen_dirs_to_str()
+                        yield "mediatorcache", self._gen_mediators_to_str()
+                        yield "digests", self._gen_digests_to_str()
+
+                # Use rename to avoid a corrupt file if ^C'd in the middle.
+                _write_file(self.__cache_path(self.CACHE_NAME),
+                    _ManifestCache.dump(gen_sections()))
+                self.__mcache = None
+
+                # Remove the per-action type cache files written by older
+                # versions of this class.
+                if os.path.exists(self.__cache_path("manifest.dircache")):
                         try:
-                                fd, fn = tempfile.mkstemp(dir=t_dir,
-                                    prefix=name + ".")
-                                with os.fdopen(fd, "w") as f:
-                                        f.writelines(refs())
-                                os.chmod(fn, PKG_FILE_MODE)
-                                portable.rename(fn, self.__cache_path(name))
+                                for cname in os.listdir(self.__cache_root):
+                                        if not cname.startswith("manifest.") or \
+                                            cname.startswith(self.CACHE_NAME):
+                                                continue
+                                        portable.remove(
+                                            self.__cache_path(cname))
                         except EnvironmentError as e:
-                                raise apx._convert_error(e)
-
-                create_cache("manifest.dircache", self._gen_dirs_to_str)
-                create_cache("manifest.mediatorcache",
-                    self._gen_mediators_to_str)
+                                if e.errno != errno.ENOENT:
+                                        raise apx._convert_error(e)
 
         @staticmethod
         def clear_cache(cache_root):
@@ -1736,34 +2281,52 @@ class FactoredManifest(Manifest):
                                 # cache directory not existing.
                                 raise apx._convert_error(e)
 
+        def __get_cache(self):
+                """Returns the _ManifestCache object for the manifest's cached
+                data or None if there is none."""
+
+                if self.__mcache is None:
+                        self.__mcache = _ManifestCache.load(
+                            self.__cache_path(self.CACHE_NAME))
+                return self.__mcache
+
+        @staticmethod
+        def __gen_cached_lines(mcache, section):
+                """Private helper function that generates the lines of the
+                given section of the cached data."""
+
+                for l in mcache.lines(section):
+                        if l:
+                                yield l
+
         def __load_cached_data(self, name):
                 """Private helper function for loading arbitrary cached manifest
                 data.
                 """
 
-                mpath = self.__cache_path(name)
-                if os.path.exists(mpath):
+                mcache = self.__get_cache()
+                section = name.split(".", 1)[-1]
+                if mcache is not None and section in mcache:
                         # we have cached copy on disk; use it
                         try:
-                                with open(mpath, "r") as f:
-                                        self._cache[name] = [
-                                            a for a in
-                                            (
-                                                actions.fromstr(s.rstrip())
-                                                for s in f
-                                            )
-                                            if not self.excludes or
-                                                a.include_this(self.excludes,
-                                                    publisher=self.publisher)
-                                        ]
+                                self._cache[name] = [
+                                    a for a in
+                                    (
+                                        actions.fromstr(s)
+                                        for s in self.__gen_cached_lines(
+                                            mcache, section)
+                                    )
+                                    if not self.excludes or
+                                        a.include_this(self.excludes,
+                                            publisher=self.publisher)
+                                ]
                                 return
-                        except EnvironmentError as e:
-                                raise apx._convert_error(e)
                         except actions.ActionError as e:
                                 # Cache file is malformed; hopefully due to bugs
                                 # that have been resolved (as opposed to actual
                                 # corruption).  Assume we should just ignore the
                                 # cache and load action data.
+                                self.__mcache = None
                                 try:
                                         self.clear_cache(self.__cache_root)
                                 except Exception as e:
@@ -1797,11 +2360,11 @@ class FactoredManifest(Manifest):
                         return
 
                 # This checks if we've already written out the factored
-                # manifest files.  If so, we'll use it, and if not, then
+                # manifest cache.  If so, we'll use it, and if not, then
                 # we'll load the full manifest.
-                mpath = self.__cache_path("manifest.dircache")
+                mcache = self.__get_cache()
 
-                if not os.path.exists(mpath):
+                if mcache is None:
                         # no cached copy :-(
                         if not self.loaded:
                                 # get manifest from disk
@@ -1816,39 +2379,26 @@ class FactoredManifest(Manifest):
                         excludes = self.excludes
                 assert excludes == self.excludes or self.excludes == EmptyI
 
-                if atype in self._absent_cache:
+                if atype not in mcache:
                         # No such action in the manifest; must be done *after*
                         # asserting excludes are correct to avoid hiding
                         # failures.
                         return
 
-                # Assume a cached copy exists; if not, tag the action type to
-                # avoid pointless I/O later.
-                mpath = self.__cache_path("manifest.{0}".format(atype))
-
                 if attr_match:
                         attr_match = _compile_fnpats(attr_match)
 
-                try:
-                        with open(mpath, "r") as f:
-                                for l in f:
-                                        a = actions.fromstr(l.rstrip())
-                                        if (excludes and
-                                            not a.include_this(excludes,
-                                                publisher=self.publisher)):
-                                                continue
-                                        # These conditions are split by
-                                        # performance.
-                                        if not attr_match:
-                                                yield a
-                                        elif _attr_matches(a, attr_match):
-                                                yield a
-
-                except EnvironmentError as e:
-                        if e.errno == errno.ENOENT:
-                                self._absent_cache.append(atype)
-                                return # no such action in this manifest
-                        raise apx._convert_error(e)
+                for l in self.__gen_cached_lines(mcache, atype):
+                        a = actions.fromstr(l)
+                        if (excludes and
+                            not a.include_this(excludes,
+                                publisher=self.publisher)):
+                                continue
+                        # These conditions are split by performance.
+                        if not attr_match:
+                                yield a
+                        elif _attr_matches(a, attr_match):
+                                yield a
 
         def gen_facets(self, excludes=EmptyI, patterns=EmptyI):
                 """A generator function that returns the supported facet
@@ -1886,19 +2436,43 @@ class FactoredManifest(Manifest):
                 """Load attributes dictionary from cached set actions;
                 this speeds up pkg info a lot"""
 
-                mpath = self.__cache_path("manifest.set")
-                if not os.path.exists(mpath):
+                mcache = self.__get_cache()
+                if mcache is None or "set" not in mcache:
                         return False
-                with open(mpath, "r") as f:
-                        for l in f:
-                                a = actions.fromstr(l.rstrip())
-                                if not self.excludes or \
-                                    a.include_this(self.excludes,
-                                        publisher=self.publisher):
-                                        self.fill_attributes(a)
+                for l in self.__gen_cached_lines(mcache, "set"):
+                        a = actions.fromstr(l)
+                        if not self.excludes or \
+                            a.include_this(self.excludes,
+                                publisher=self.publisher):
+                                self.fill_attributes(a)
 
                 return True
 
+        def _get_action_digests(self):
+                """Returns a dictionary of the digests of the canonical string
+                form of actions keyed by action key, or None if the cached data
+                has none."""
+
+                digests = self._cache.get("manifest.digests")
+                if digests is not None:
+                        return digests
+
+                mcache = self.__get_cache()
+                if mcache is None or "digests" not in mcache:
+                        return None
+
+                digests = {}
+                for l in self.__gen_cached_lines(mcache, "digests"):
+                        try:
+                                d, name, kv = l.split(" ", 2)
+                        except ValueError:
+                                # Part of a key value which spans lines; such
+                                # keys are never cached.
+                                continue
+                        digests[(name, kv)] = d
+                self._cache["manifest.digests"] = digests
+                return digests
+
         def get_size(self, excludes=EmptyI):
                 """Returns an integer tuple of the form (size, csize), where
                 'size' represents the total uncompressed size, in bytes, of the
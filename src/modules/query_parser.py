@@ -467,6 +467,12 @@ class Query(object):
                 self.return_type = return_type
                 assert self.return_type == Query.RETURN_PACKAGES or \
                     self.return_type == Query.RETURN_ACTIONS
+                if num_to_return is not None and num_to_return < 0:
+                        raise DetailedValueError("num_to_return",
+                            num_to_return, text)
+                if start_point is not None and start_point < 0:
+                        raise DetailedValueError("start_point", start_point,
+                            text)
                 self.num_to_return = num_to_return
                 self.start_point = start_point
 
@@ -563,6 +569,7 @@ class BooleanQuery(object):
                 self.lc = left_query
                 self.rc = right_query
                 self.return_type = self.lc.return_type
+                self._pfmris = None
                 self.__check_return_types()
 
         def __check_return_types(self):
@@ -576,6 +583,16 @@ class BooleanQuery(object):
                 self.lc.add_field_restrictions(*params)
                 self.rc.add_field_restrictions(*params)
 
+        def restrict_packages(self, pfmris):
+                """Limits the packages whose actions are searched for in the
+                index to those in the set 'pfmris', or removes the limit if
+                it's None.  For a boolean query, it only needs to pass the
+                limit onto its children."""
+
+                self._pfmris = pfmris
+                self.lc.restrict_packages(pfmris)
+                self.rc.restrict_packages(pfmris)
+
         def set_info(self, **kwargs):
                 """This function passes information to the terms prior to
                 search being executed.  For a boolean query, it only needs to
@@ -591,6 +608,12 @@ class BooleanQuery(object):
                 return set(self.lc.search(None, *args)), \
                     set(self.rc.search(None, *args))
 
+        def estimate_cost(self):
+                """Returns an estimate of the number of results the query
+                will produce, or None if that isn't known."""
+
+                return None
+
         def sorted(self, res):
                 """Sort the results.  If the results are actions, sort by the
                 fmris of the packages from which they came."""
@@ -625,6 +648,46 @@ class BooleanQuery(object):
 class AndQuery(BooleanQuery):
         """Class representing AND queries in the AST."""
 
+        def estimate_cost(self):
+                """Returns an estimate of the number of results the query
+                will produce, or None if that isn't known.  No more results
+                can be produced than by the more selective child."""
+
+                costs = [
+                    c
+                    for c in (self.lc.estimate_cost(), self.rc.estimate_cost())
+                    if c is not None
+                ]
+                if not costs:
+                        return None
+                return min(costs)
+
+        def _plan(self):
+                """Returns the children ordered so that the child expected to
+                produce fewer results is searched first.  A child whose cost
+                isn't known is assumed to match everything."""
+
+                lc_cost = self.lc.estimate_cost()
+                rc_cost = self.rc.estimate_cost()
+                if rc_cost is not None and \
+                    (lc_cost is None or rc_cost < lc_cost):
+                        return self.rc, self.lc
+                return self.lc, self.rc
+
+        def __search_packages(self, pfmris, *args):
+                """Searches the left child for the actions of the packages in
+                the set 'pfmris' only, and filters them with the right child.
+                The left child is limited to those packages for as long as
+                its results are being produced."""
+
+                self.lc.restrict_packages(pfmris)
+                try:
+                        for r in self.rc.search(self.lc.search(None, *args),
+                            *args):
+                                yield r
+                finally:
+                        self.lc.restrict_packages(self._pfmris)
+
         def search(self, restriction, *args):
                 """Performs a search over the two children and combines
                 the results.
@@ -641,16 +704,41 @@ class AndQuery(BooleanQuery):
                         # previous terms must be used as the domain of search.
                         # To do this, restriction is passed to the left
                         # child and the result from that child is passed to
-                        # the right child as its domain.
+                        # the right child as its domain.  The right child
+                        # passes the fields of the left child's results
+                        # through, so the order of the children can't be
+                        # changed.  Instead, if the right child is the more
+                        # selective, the packages it matches are found first
+                        # and the left child only searches their actions.
+                        if restriction is None and \
+                            self._plan()[0] is self.rc:
+                                pfmris = set(
+                                    pfmri
+                                    for at, st, pfmri, fv, l
+                                    in self.rc.search(None, *args)
+                                )
+                                if not pfmris:
+                                        return []
+                                return self.__search_packages(pfmris, *args)
                         lc_it = self.lc.search(restriction, *args)
                         return self.rc.search(lc_it, *args)
                 else:
                         # If packages are being returned, holding the names
                         # of all known packages in memory is feasible. By
                         # using sets, and their intersection, duplicates are
-                        # also removed from the results.
-                        lc_set, rc_set = BooleanQuery.search(self, *args)
-                        return self.sorted(lc_set & rc_set)
+                        # also removed from the results.  The more selective
+                        # child is searched first, and the other child only
+                        # searches the packages it found.
+                        first, second = self._plan()
+                        first_set = set(first.search(None, *args))
+                        if not first_set:
+                                return []
+                        second.restrict_packages(first_set)
+                        try:
+                                return self.sorted(first_set &
+                                    set(second.search(None, *args)))
+                        finally:
+                                second.restrict_packages(self._pfmris)
 
 
         def __str__(self):
@@ -662,6 +750,16 @@ class AndQuery(BooleanQuery):
 class OrQuery(BooleanQuery):
         """Class representing OR queries in the AST."""
 
+        def estimate_cost(self):
+                """Returns an estimate of the number of results the query
+                will produce, or None if that isn't known."""
+
+                lc_cost = self.lc.estimate_cost()
+                rc_cost = self.rc.estimate_cost()
+                if lc_cost is None or rc_cost is None:
+                        return None
+                return lc_cost + rc_cost
+
         def search(self, restriction, *args):
                 """Performs a search over the two children and combines
                 the results.
@@ -731,6 +829,13 @@ class PkgConversion(object):
 
                 self.query.set_info(**kwargs)
 
+        def restrict_packages(self, pfmris):
+                """Limits the packages whose actions are searched for in the
+                index to those in the set 'pfmris', or removes the limit if
+                it's None.  It only needs to pass the limit to its child."""
+
+                self.query.restrict_packages(pfmris)
+
         @staticmethod
         def optional_action_to_package(it, return_type, current_type):
                 """Based on the return_type and current type, it converts the
@@ -760,6 +865,12 @@ class PkgConversion(object):
                     self.query.search(restriction, *args),
                     Query.RETURN_PACKAGES, self.query.return_type)
 
+        def estimate_cost(self):
+                """Returns an estimate of the number of results the query
+                will produce, or None if that isn't known."""
+
+                return self.query.estimate_cost()
+
         def allow_version(self, v):
                 """Returns whether the query supports a query of version v."""
 
@@ -811,6 +922,13 @@ class PhraseQuery(object):
         def add_field_restrictions(self, *params):
                 self.query.add_field_restrictions(*params)
 
+        def restrict_packages(self, pfmris):
+                """Limits the packages whose actions are searched for in the
+                index to those in the set 'pfmris', or removes the limit if
+                it's None.  It only needs to pass the limit to its child."""
+
+                self.query.restrict_packages(pfmris)
+
         def set_info(self, case_sensitive, **kwargs):
                 """This function passes information to the terms prior to
                 search being executed.  It only needs to pass whatever
@@ -857,6 +975,12 @@ class PhraseQuery(object):
                 )
                 return it
 
+        def estimate_cost(self):
+                """Returns an estimate of the number of results the query
+                will produce, or None if that isn't known."""
+
+                return self.query.estimate_cost()
+
         def allow_version(self, v):
                 """Returns whether the query supports a query of version v."""
 
@@ -905,6 +1029,13 @@ class FieldQuery(object):
 
                 self.query.set_info(**kwargs)
 
+        def restrict_packages(self, pfmris):
+                """Limits the packages whose actions are searched for in the
+                index to those in the set 'pfmris', or removes the limit if
+                it's None.  It only needs to pass the limit to its child."""
+
+                self.query.restrict_packages(pfmris)
+
         def search(self, restriction, *args):
                 """Perform a search for the structured query.  The child has
                 been modified so that it is able to do the structured query
@@ -913,6 +1044,12 @@ class FieldQuery(object):
                 assert self.query.return_type == Query.RETURN_ACTIONS
                 return self.query.search(restriction, *args)
 
+        def estimate_cost(self):
+                """Returns an estimate of the number of results the query
+                will produce, or None if that isn't known."""
+
+                return self.query.estimate_cost()
+
         def allow_version(self, v):
                 """Returns whether the query supports a query of version v."""
 
@@ -943,36 +1080,38 @@ class TopQuery(object):
         def __str__(self):
                 return str(self.query)
 
-        def __keep(self, x):
-                """Determines whether the x'th result should be returned."""
-
-                return x >= self.start_point and \
-                    (self.num_to_return is None or
-                    x < self.num_to_return + self.start_point)
-
         def finalize_results(self, it):
                 """Converts the internal result representation to the format
                 which is expected by the callers of search.  It also handles
-                returning only those results requested by the user."""
+                returning only those results requested by the user.
+
+                Results are produced as the child finds them, and the child's
+                search is stopped once the last requested result has been
+                returned, so that the remaining matches are never evaluated."""
 
                 # Need to replace "1" with current search version, or something
                 # similar
 
-                if self.query.return_type == Query.RETURN_ACTIONS:
-                        return (
-                            (1, Query.RETURN_ACTIONS,
-                            (fmri.PkgFmri(pfmri), fv, force_str(l)))
-                            for x, (at, st, pfmri, fv, l)
-                            in enumerate(it)
-                            if self.__keep(x)
-                        )
-                else:
-                        return (
-                            (1, Query.RETURN_PACKAGES, fmri.PkgFmri(pfmri))
-                            for x, pfmri
-                            in enumerate(it)
-                            if self.__keep(x)
-                        )
+                stop = None
+                if self.num_to_return is not None:
+                        stop = self.start_point + self.num_to_return
+                try:
+                        for r in itertools.islice(it, self.start_point, stop):
+                                if self.query.return_type == \
+                                    Query.RETURN_ACTIONS:
+                                        at, st, pfmri, fv, l = r
+                                        yield (1, Query.RETURN_ACTIONS,
+                                            (fmri.PkgFmri(pfmri), fv,
+                                            force_str(l)))
+                                else:
+                                        yield (1, Query.RETURN_PACKAGES,
+                                            fmri.PkgFmri(r))
+                finally:
+                        # Stop the child's search, which closes the index
+                        # files it has open, if it hasn't finished.
+                        close = getattr(it, "close", None)
+                        if close:
+                                close()
 
         def set_info(self, num_to_return, start_point, **kwargs):
                 """This function passes information to the terms prior to
@@ -1026,6 +1165,9 @@ class TermQuery(object):
 
         has_non_wildcard_character = re.compile(r'.*[^\*\?].*')
 
+        glob_prefix = re.compile(r'[^\*\?\[]*')
+        glob_special = re.compile(r'\[!?\]?[^\]]*\]|[\*\?\[]')
+
         fmris = None
 
         def __init__(self, term):
@@ -1058,7 +1200,12 @@ class TermQuery(object):
                 self._manifest_path_func = None
                 self._data_manf = None
                 self._data_token_offset = None
+                self._data_token_index = None
+                self._data_token_trigrams = None
                 self._data_main_dict = None
+                self.__lines = None
+                # The set of packages searched for in the index, if limited.
+                self._pfmris = None
 
         def __init_gdd(self, path):
                 gdd = self._global_data_dict
@@ -1132,6 +1279,14 @@ class TermQuery(object):
                 finally:
                         cls.__unlock_gdd(index_dir)
 
+        def restrict_packages(self, pfmris):
+                """Limits the packages whose actions are searched for in the
+                index to those in the set 'pfmris', or removes the limit if
+                it's None.  The limit only reduces the work done by the
+                search; it doesn't apply to restricted searches."""
+
+                self._pfmris = pfmris
+
         def add_field_restrictions(self, pkg_name, action_type, key):
                 """Add the information needed to restrict the search domain
                 to the specified fields."""
@@ -1185,6 +1340,7 @@ class TermQuery(object):
 
                 self._manifest_path_func = get_manifest_path
                 self._case_sensitive = case_sensitive
+                self.__lines = None
                 self.__init_gdd(self._dir_path)
 
                 # Take the static class lock because it's possible we'll
@@ -1195,9 +1351,46 @@ class TermQuery(object):
                 try:
                         self._data_main_dict = \
                             ss.IndexStoreMainDict(ss.MAIN_FILE)
-                        if "fmri_offsets" not in tq_gdd:
-                                tq_gdd["fmri_offsets"] = ss.InvertedDict(
-                                    ss.FMRI_OFFSETS_FILE, None)
+                        # Indexes built before the packed fmri offsets file
+                        # was introduced have the text version.
+                        if os.path.exists(os.path.join(self._dir_path,
+                            ss.PACKED_FMRI_OFFSETS_FILE)):
+                                fo = ss.InvertedDictPacked(
+                                    ss.PACKED_FMRI_OFFSETS_FILE, None)
+                        else:
+                                fo = ss.InvertedDict(ss.FMRI_OFFSETS_FILE,
+                                    None)
+                        if "fmri_offsets" not in tq_gdd or \
+                            tq_gdd["fmri_offsets"].get_file_name() != \
+                            fo.get_file_name():
+                                tq_gdd["fmri_offsets"] = fo
+                        # Use the token index if the index has one, since it
+                        # doesn't need to be read into memory.  Indexes built
+                        # before it was introduced only have the token byte
+                        # offset file.
+                        if os.path.exists(os.path.join(self._dir_path,
+                            ss.TOKEN_INDEX_FILE)):
+                                tq_gdd.pop("token_byte_offset", None)
+                                if "token_index" not in tq_gdd:
+                                        tq_gdd["token_index"] = \
+                                            ss.IndexStoreTokenIndex(
+                                                ss.TOKEN_INDEX_FILE)
+                                # The token trigram index is optional; globs
+                                # are matched against every token without it.
+                                if not os.path.exists(os.path.join(
+                                    self._dir_path, ss.TOKEN_TRIGRAMS_FILE)):
+                                        tq_gdd.pop("token_trigrams", None)
+                                elif "token_trigrams" not in tq_gdd:
+                                        tq_gdd["token_trigrams"] = \
+                                            ss.IndexStoreTokenTrigrams(
+                                                ss.TOKEN_TRIGRAMS_FILE)
+                        else:
+                                tq_gdd.pop("token_index", None)
+                                tq_gdd.pop("token_trigrams", None)
+                                if "token_byte_offset" not in tq_gdd:
+                                        tq_gdd["token_byte_offset"] = \
+                                            ss.IndexStoreDictMutable(
+                                                ss.BYTE_OFFSET_FILE)
                         # Create a temporary list of dictionaries we need to
                         # open consistently.
                         tmp = list(tq_gdd.values())
@@ -1270,7 +1463,12 @@ class TermQuery(object):
                                         d.close_file_handle()
                         self._data_manf = tq_gdd["manf"]
 
-                        self._data_token_offset = tq_gdd["token_byte_offset"]
+                        self._data_token_offset = tq_gdd.get(
+                            "token_byte_offset", None)
+                        self._data_token_index = tq_gdd.get("token_index",
+                            None)
+                        self._data_token_trigrams = tq_gdd.get(
+                            "token_trigrams", None)
                         self._data_fmri_offsets = tq_gdd.get("fmri_offsets",
                             None)
                 finally:
@@ -1377,6 +1575,93 @@ class TermQuery(object):
                                 pkg_offsets.add(int(l))
                 return pkg_offsets
 
+        def __token_lines(self, term):
+                """Returns a dictionary mapping the offset into the main
+                dictionary of the line for the token 'term' to the number of
+                results on that line, or to None if the index doesn't record
+                it.  The dictionary is empty if the token isn't in the
+                index."""
+
+                if self._data_token_index is not None:
+                        ent = self._data_token_index.get_entry(term)
+                        if ent is None:
+                                return {}
+                        return dict([ent])
+                if self._data_token_offset.has_entity(term):
+                        return {self._data_token_offset.get_id(term): None}
+                return {}
+
+        def __glob_lines(self, term, case_sensitive):
+                """Returns a dictionary mapping the offsets into the main
+                dictionary of the lines for the tokens which match the glob
+                'term' to the number of results on each line, or to None if
+                the index doesn't record it."""
+
+                if self._data_token_index is None:
+                        keys = self._data_token_offset.get_keys()
+                        return dict(
+                            (self._data_token_offset.get_id(match), None)
+                            for match in choose(keys, term, case_sensitive)
+                        )
+
+                # Only the tokens starting with the literal characters which
+                # precede the first wildcard need to be matched against the
+                # glob.
+                prefix = TermQuery.glob_prefix.match(term).group()
+                toks = None
+                if len(prefix) < 3 and self._data_token_trigrams is not None:
+                        # The prefix doesn't narrow the tokens much, so use
+                        # the trigrams of the literal characters elsewhere in
+                        # the glob instead.
+                        ids = self._data_token_trigrams.get_ids(
+                            TermQuery.glob_special.split(term))
+                        if ids is not None:
+                                toks = self._data_token_index. \
+                                    gen_trigram_candidates(ids)
+                if toks is None:
+                        toks = self._data_token_index.gen_candidates(prefix)
+                toks = dict((t, (offset, count)) for t, offset, count in toks)
+                return dict(
+                    toks[match]
+                    for match in choose(toks, term, case_sensitive)
+                )
+
+        def __term_lines(self):
+                """Returns a dictionary mapping the offsets into the main
+                dictionary of the lines for the tokens matching the term to
+                the number of results on each line, or None if the term
+                matches every token.  The result is kept so that planning and
+                performing the search only look up the term once."""
+
+                if self.__lines is not None:
+                        return self.__lines[0]
+
+                term = self._term
+                case_sensitive = self._case_sensitive
+                lines = None
+                if self._glob or not case_sensitive:
+                        # If the term has at least one non-wildcard character
+                        # in it, do the glob search.
+                        if TermQuery.has_non_wildcard_character.match(term):
+                                lines = self.__glob_lines(term,
+                                    case_sensitive)
+                else:
+                        lines = self.__token_lines(term)
+                self.__lines = (lines,)
+                return lines
+
+        def estimate_cost(self):
+                """Returns the number of results the index holds for the
+                tokens matching the term, which is the most the term can
+                produce, or None if that isn't known."""
+
+                if self._data_token_index is None:
+                        return None
+                lines = self.__term_lines()
+                if lines is None:
+                        return None
+                return sum(lines.values())
+
         def _search_internal(self, fmris):
                 """Searches the indexes in dir_path for any matches of query
                 and the results in self.res.  The method assumes the
@@ -1397,24 +1682,14 @@ class TermQuery(object):
                 # match with no results is represented by an empty set.
                 offsets = None
 
-                if glob:
-                        # If the term has at least one non-wildcard character
-                        # in it, do the glob search.
-                        if TermQuery.has_non_wildcard_character.match(term):
-                                keys = self._data_token_offset.get_keys()
-                                matches = choose(keys, term, case_sensitive)
-                                offsets = set([
-                                    self._data_token_offset.get_id(match)
-                                    for match in matches
-                                ])
-                elif self._data_token_offset.has_entity(term):
-                        offsets = set([
-                            self._data_token_offset.get_id(term)])
-                else:
-                        # Close the dictionaries since there are
-                        # no more results to yield.
-                        self._close_dicts()
-                        return
+                lines = self.__term_lines()
+                if lines is not None:
+                        offsets = set(lines)
+                        if not glob and not offsets:
+                                # Close the dictionaries since there are
+                                # no more results to yield.
+                                self._close_dicts()
+                                return
 
                 # Restrict results by package name.
                 if not self.pkg_name_wildcard:
@@ -1464,6 +1739,15 @@ class TermQuery(object):
                                 # If the file doesn't exist, then no actions
                                 # with that key were indexed.
                                 offsets = set()
+                # Restrict results to the packages the search is limited to.
+                if self._pfmris is not None and \
+                    self._data_fmri_offsets is not None:
+                        pkg_offsets = self._data_fmri_offsets.get_offsets(
+                            self._pfmris.__contains__)
+                        if offsets is None:
+                                offsets = pkg_offsets
+                        else:
+                                offsets &= pkg_offsets
                 line_iter = EmptyI
                 # If offsets isn't None, then the set of results has been
                 # restricted so iterate through those offsets.
@@ -1475,6 +1759,26 @@ class TermQuery(object):
                     not TermQuery.has_non_wildcard_character.match(term):
                         line_iter = self._data_main_dict.get_file_handle()
 
+                try:
+                        for res in self.__gen_line_results(line_iter):
+                                yield res
+                finally:
+                        # Close the dictionaries since there are no more
+                        # results to yield, or the caller has stopped
+                        # asking for them.
+                        self._close_dicts()
+
+        def __gen_line_results(self, line_iter):
+                """Yields the results for each of the main dictionary lines
+                in line_iter which match the restrictions of the query."""
+
+                glob = self._glob
+                term = self._term
+                case_sensitive = self._case_sensitive
+                pfmris = self._pfmris
+
+                if not case_sensitive:
+                        glob = True
                 for line in line_iter:
                         assert not line == '\n'
                         tok, at_lst = \
@@ -1513,6 +1817,9 @@ class TermQuery(object):
                                                         # exist.
                                                         if not self.pkg_name_wildcard and not self.pkg_name_match(p_str):
                                                                 continue
+                                                        if pfmris is not None and \
+                                                            p_str not in pfmris:
+                                                                continue
                                                         int_os = [
                                                             int(o)
                                                             for o
@@ -1520,10 +1827,6 @@ class TermQuery(object):
                                                         ]
                                                         yield (p_str, int_os,
                                                             at, st, fv)
-                # Close the dictionaries since there are no more results to
-                # yield.
-                self._close_dicts()
-                return
 
         def _get_results(self, res):
                 """Takes the results from search_internal ("res") and reads the
@@ -26,8 +26,13 @@
 
 import os
 import errno
+import itertools
+import mmap
+import struct
+import sys
 import time
 import hashlib
+from array import array
 from six.moves.urllib.parse import quote, unquote
 
 import pkg.fmri as fmri
@@ -43,6 +48,9 @@ MAIN_FILE = 'main_dict.ascii.v2'
 BYTE_OFFSET_FILE = 'token_byte_offset.v1'
 FULL_FMRI_HASH_FILE = 'full_fmri_list.hash'
 FMRI_OFFSETS_FILE = 'fmri_offsets.v1'
+PACKED_FMRI_OFFSETS_FILE = 'fmri_offsets.v2'
+TOKEN_INDEX_FILE = 'token_index.v2'
+TOKEN_TRIGRAMS_FILE = 'token_trigrams.v1'
 
 def consistent_open(data_list, directory, timeout = 1):
         """Opens all data holders in data_list and ensures that the
@@ -72,10 +80,15 @@ def consistent_open(data_list, directory, timeout = 1):
                         # either be present or absent for a successful return.
                         # If one of these conditions is not met, the function
                         # tries again until it succeeds or the time spent in
-                        # in the function is greater than timeout.
+                        # in the function is greater than timeout.  Optional
+                        # indexes which are absent are ignored so that indexes
+                        # written before they were introduced remain usable.
                         try:
                                 f = os.path.join(directory, d.get_file_name())
-                                fh = open(f, 'r', encoding='UTF-8')
+                                if d.binary:
+                                        fh = open(f, 'rb')
+                                else:
+                                        fh = open(f, 'r', encoding='UTF-8')
                                 # If we get here, then the current index file
                                 # is present.
                                 if missing == None:
@@ -88,8 +101,7 @@ def consistent_open(data_list, directory, timeout = 1):
                                         break
                                 d.set_file_handle(fh, f)
                                 version_tmp = fh.readline()
-                                version_num = \
-                                    int(version_tmp.split(' ')[1].rstrip('\n'))
+                                version_num = int(version_tmp.split()[1])
                                 # Read the version. If this is the first file,
                                 # set the expected version otherwise check that
                                 # the version matches the expected version.
@@ -104,6 +116,8 @@ def consistent_open(data_list, directory, timeout = 1):
                                         cur_version = None
                                         break
                         except IOError as e:
+                                if e.errno == errno.ENOENT and d.optional:
+                                        continue
                                 if e.errno == errno.ENOENT:
                                         # If the index file is missing, ensure
                                         # that previous files were missing as
@@ -135,6 +149,12 @@ class IndexStoreBase(object):
         calls.
         """
 
+        # Whether the file is opened in binary mode by consistent_open.
+        binary = False
+
+        # Whether the file may be absent from an otherwise complete index.
+        optional = False
+
         def __init__(self, file_name):
                 self._name = file_name
                 self._file_handle = None
@@ -371,6 +391,339 @@ class IndexStoreMainDict(IndexStoreBase):
                 self._old_suffix = self._name + suffix
 
 
+def ascii_token_key(token):
+        """Returns the key by which tokens which consist only of ASCII
+        characters are sorted in the token index and the token trigram
+        index."""
+
+        return token.lower(), token
+
+
+class IndexStoreMapped(IndexStoreBase):
+        """Base class for binary index files which are memory mapped instead
+        of being read into memory.  Each has a header, described by _header,
+        following the version line."""
+
+        binary = True
+        optional = True
+
+        _header = None
+
+        def __init__(self, file_name):
+                IndexStoreBase.__init__(self, file_name)
+                self._map = None
+                self._data_start = 0
+
+        def read_dict_file(self):
+                """Maps the file into memory and returns the values in its
+                header.  The mapping stays valid after the file handle is
+                closed."""
+
+                if not self._file_handle:
+                        # The file was expected but couldn't be opened, so
+                        # the index has changed since it was checked.
+                        raise search_errors.InconsistentIndexException(
+                            self._file_path or self._name)
+                start = self._file_handle.tell()
+                self._map = mmap.mmap(self._file_handle.fileno(), 0,
+                    access=mmap.ACCESS_READ)
+                self._data_start = start + self._header.size
+                IndexStoreBase.read_dict_file(self)
+                return self._header.unpack_from(self._map, start)
+
+        def should_reread(self):
+                """Returns whether the file has changed since it was last
+                read.  A file which couldn't be opened must be reread so that
+                read_dict_file reports it."""
+
+                if not self._file_handle:
+                        return True
+                return IndexStoreBase.should_reread(self)
+
+        def _write_file(self, path, version_num, header, chunks):
+                """Writes the version line, the values in header, and the
+                byte strings in chunks to the file."""
+
+                with open(os.path.join(path, self._name), "wb") as fh:
+                        fh.write(force_bytes(
+                            "VERSION: {0}\n".format(version_num)))
+                        fh.write(self._header.pack(*header))
+                        for c in chunks:
+                                fh.writelines(c)
+
+        def count_entries_removed_during_partial_indexing(self):
+                """Returns the number of entries removed during a second phase
+                of indexing."""
+                return 0
+
+
+class IndexStoreTokenIndex(IndexStoreMapped):
+        """Class for the sorted binary token dictionary.  It maps each token
+        in the main dictionary to the byte offset of that token's line and is
+        memory mapped and binary searched instead of being read into memory.
+        The token byte offset file holds the same information as text and is
+        still written for use by older clients and tools.
+        """
+        # After the version line, the file contains a header with the number
+        # of tokens in each of the two sections described below, a table of
+        # fixed-width entries, and a blob of UTF-8 encoded tokens.  Each table
+        # entry holds the offset and length of its token in the blob, the
+        # byte offset of the token's line in the main dictionary, and the
+        # number of results on that line, which is used to plan searches.
+        #
+        # The first section holds the tokens which consist only of ASCII
+        # characters and is sorted by the lowercased token, then the token.
+        # This allows all case-insensitive matches of an ASCII prefix to be
+        # found using a single range of entries.  The second section holds all
+        # other tokens sorted by token.  Since the characters of those tokens
+        # may match ASCII characters when case is ignored, they are always
+        # candidates for a prefix search.
+
+        _header = struct.Struct(">QQ")
+        _entry = struct.Struct(">QIQQ")
+
+        def __init__(self, file_name):
+                IndexStoreMapped.__init__(self, file_name)
+                self._entries = []
+                self._num_ascii = 0
+                self._num_tokens = 0
+                self._table_start = 0
+                self._blob_start = 0
+
+        def add_entity(self, token, offset, count):
+                """Records that the line for token starts at byte offset
+                'offset' in the main dictionary and holds 'count' results."""
+
+                self._entries.append((token, offset, count))
+
+        def write_dict_file(self, path, version_num):
+                """Sorts the recorded tokens and writes them out to the
+                file."""
+
+                ascii_ents = sorted(
+                    (e for e in self._entries if e[0].isascii()),
+                    key=lambda e: ascii_token_key(e[0]))
+                other_ents = sorted(
+                    e for e in self._entries if not e[0].isascii())
+                self._entries = []
+
+                table = []
+                blob = []
+                blob_len = 0
+                for token, offset, count in ascii_ents + other_ents:
+                        token = force_bytes(token)
+                        table.append(self._entry.pack(blob_len, len(token),
+                            offset, count))
+                        blob.append(token)
+                        blob_len += len(token)
+
+                self._write_file(path, version_num,
+                    (len(ascii_ents), len(other_ents)), (table, blob))
+
+        def read_dict_file(self):
+                """Maps the file into memory."""
+
+                self._num_ascii, num_other = \
+                    IndexStoreMapped.read_dict_file(self)
+                self._num_tokens = self._num_ascii + num_other
+                self._table_start = self._data_start
+                self._blob_start = self._table_start + \
+                    self._num_tokens * self._entry.size
+
+        def __get_entry(self, i):
+                """Returns the token, main dictionary offset, and number of
+                results stored in the i'th entry of the table."""
+
+                t_off, t_len, offset, count = self._entry.unpack_from(
+                    self._map, self._table_start + i * self._entry.size)
+                t_off += self._blob_start
+                return self._map[t_off:t_off + t_len].decode("utf-8"), \
+                    offset, count
+
+        def __bisect(self, key, keyfunc, lo, hi):
+                """Returns the first entry between lo and hi whose token,
+                transformed by keyfunc, is not less than key."""
+
+                while lo < hi:
+                        mid = (lo + hi) // 2
+                        if keyfunc(self.__get_entry(mid)[0]) < key:
+                                lo = mid + 1
+                        else:
+                                hi = mid
+                return lo
+
+        def get_entry(self, token):
+                """Returns the main dictionary offset for token and the
+                number of results on its line, or None if the token is not in
+                the index."""
+
+                if token.isascii():
+                        i = self.__bisect((token.lower(), token),
+                            ascii_token_key, 0, self._num_ascii)
+                        hi = self._num_ascii
+                else:
+                        i = self.__bisect(token, lambda t: t,
+                            self._num_ascii, self._num_tokens)
+                        hi = self._num_tokens
+                if i < hi:
+                        t, offset, count = self.__get_entry(i)
+                        if t == token:
+                                return offset, count
+                return None
+
+        def gen_candidates(self, prefix):
+                """Yields the token, main dictionary offset, and number of
+                results of every token which could begin with prefix when case
+                is ignored.  Callers must check each token themselves."""
+
+                if prefix and prefix.isascii():
+                        prefix = prefix.lower()
+                        i = self.__bisect(prefix, lambda t: t.lower(), 0,
+                            self._num_ascii)
+                        for i in range(i, self._num_ascii):
+                                ent = self.__get_entry(i)
+                                if not ent[0].lower().startswith(prefix):
+                                        break
+                                yield ent
+                        start = self._num_ascii
+                else:
+                        start = 0
+                for i in range(start, self._num_tokens):
+                        yield self.__get_entry(i)
+
+        def gen_trigram_candidates(self, ids):
+                """Yields the token, main dictionary offset, and number of
+                results of the tokens in the first section with the given
+                positions, as found using the token trigram index, and of
+                every token in the second section."""
+
+                for i in ids:
+                        yield self.__get_entry(i)
+                for i in range(self._num_ascii, self._num_tokens):
+                        yield self.__get_entry(i)
+
+
+class IndexStoreTokenTrigrams(IndexStoreMapped):
+        """Class for the trigram index of the tokens in the token index.  It
+        maps each sequence of three characters to the positions in the token
+        index of the tokens containing it, so that glob patterns which don't
+        begin with literal characters need not be matched against every
+        token.
+        """
+        # After the version line, the file contains a header with the number
+        # of trigrams, a table of fixed-width entries sorted by trigram, and
+        # the lists of positions.  Each table entry holds a trigram and the
+        # index and length of its list of positions.
+        #
+        # Only the tokens in the first section of the token index, which
+        # consist only of ASCII characters, are included.  Trigrams are taken
+        # from the lowercased tokens so that they can be used for searches
+        # which ignore case.
+
+        _header = struct.Struct(">Q")
+        _entry = struct.Struct(">3sQI")
+        _position = struct.Struct(">I")
+
+        def __init__(self, file_name):
+                IndexStoreMapped.__init__(self, file_name)
+                self._tokens = []
+                self._num_trigrams = 0
+                self._positions_start = 0
+
+        def add_entity(self, token):
+                """Records that token is in the token index."""
+
+                self._tokens.append(token)
+
+        def write_dict_file(self, path, version_num):
+                """Builds the trigram index for the recorded tokens and
+                writes it out to the file."""
+
+                grams = {}
+                tokens = sorted((t for t in self._tokens if t.isascii()),
+                    key=ascii_token_key)
+                self._tokens = []
+                for i, tok in enumerate(tokens):
+                        tok = tok.lower()
+                        for g in set(tok[j:j + 3]
+                            for j in range(len(tok) - 2)):
+                                grams.setdefault(g, []).append(i)
+
+                table = []
+                positions = []
+                npos = 0
+                for g in sorted(grams):
+                        ids = grams[g]
+                        table.append(self._entry.pack(g.encode("ascii"), npos,
+                            len(ids)))
+                        positions.append(struct.pack(
+                            ">{0:d}I".format(len(ids)), *ids))
+                        npos += len(ids)
+                self._write_file(path, version_num, (len(table),),
+                    (table, positions))
+
+        def read_dict_file(self):
+                """Maps the file into memory."""
+
+                self._num_trigrams, = IndexStoreMapped.read_dict_file(self)
+                self._positions_start = self._data_start + \
+                    self._num_trigrams * self._entry.size
+
+        def __find(self, gram):
+                """Returns the index and length of the list of positions for
+                gram, or None if no token contains it."""
+
+                lo = 0
+                hi = self._num_trigrams
+                while lo < hi:
+                        mid = (lo + hi) // 2
+                        g, start, count = self._entry.unpack_from(self._map,
+                            self._data_start + mid * self._entry.size)
+                        if g < gram:
+                                lo = mid + 1
+                        elif g > gram:
+                                hi = mid
+                        else:
+                                return start, count
+                return None
+
+        def get_ids(self, literals):
+                """Returns the sorted positions in the token index of the
+                tokens which contain, ignoring case, every trigram of the
+                strings in literals.  Returns None if no trigrams can be used
+                to narrow the tokens."""
+
+                grams = set()
+                for lit in literals:
+                        if lit.isascii():
+                                lit = lit.lower()
+                                grams.update(lit[j:j + 3]
+                                    for j in range(len(lit) - 2))
+                if not grams:
+                        return None
+
+                found = []
+                for g in grams:
+                        loc = self.__find(g.encode("ascii"))
+                        if loc is None:
+                                return []
+                        found.append(loc)
+                # Intersect the shortest lists first.
+                found.sort(key=lambda loc: loc[1])
+                ids = None
+                for start, count in found:
+                        pos = struct.unpack_from(">{0:d}I".format(count),
+                            self._map, self._positions_start +
+                            start * self._position.size)
+                        if ids is None:
+                                ids = set(pos)
+                        else:
+                                ids.intersection_update(pos)
+                        if not ids:
+                                break
+                return sorted(ids)
+
+
 class IndexStoreListDict(IndexStoreBase):
         """Used when both a list and a dictionary are needed to
         store the information. Used for bidirectional lookup when
@@ -765,18 +1118,32 @@ class InvertedDict(IndexStoreBase):
 
                 inv = {}
                 for p_id in list(self._fmri_offsets.keys()):
-                        old_o = 0
-                        bucket = []
-                        for o in sorted(set(self._fmri_offsets[p_id])):
-                                bucket.append(o - old_o)
-                                old_o = o
-                        h = " ".join([str(o) for o in bucket])
+                        h = self._encode_offsets(
+                            sorted(set(self._fmri_offsets[p_id])))
                         del self._fmri_offsets[p_id]
                         if h not in inv:
                                 inv[h] = []
                         inv[h].append(p_id)
                 return inv
 
+        @staticmethod
+        def _encode_offsets(offsets):
+                """Returns the space separated differences between each of
+                the sorted offsets and the previous one."""
+
+                old_o = 0
+                bucket = []
+                for o in offsets:
+                        bucket.append(o - old_o)
+                        old_o = o
+                return " ".join([str(o) for o in bucket])
+
+        @classmethod
+        def _decode_offsets(cls, offs):
+                """Returns the offsets encoded by _encode_offsets."""
+
+                return cls.de_delta(offs.split())
+
         @staticmethod
         def __make_line(offset_str, p_ids, trans):
                 """For a given offset string, a list of package id numbers,
@@ -831,14 +1198,107 @@ class InvertedDict(IndexStoreBase):
                 desired fmri, return the offsets which are associated with the
                 fmris which match."""
 
-                offs = []
+                offs = set()
                 for fmris in self._dict.keys():
                         for p in fmris.split():
                                 if match_func(p):
-                                        offs.extend(self.de_delta(
-                                            self._dict[fmris].split()))
+                                        offs.update(self._decode_offsets(
+                                            self._dict[fmris]))
                                         break
-                return set(offs)
+                return offs
+
+
+class InvertedDictPacked(InvertedDict):
+        """Class used to store and process fmri to offset mappings in a
+        binary file.  Each set of offsets is stored as the first offset
+        followed by an array of the differences between successive offsets,
+        using the smallest of 1, 2, 4 or 8 bytes which can hold all of them.
+        Decoding a set is done by the array module and itertools instead of
+        parsing each offset in Python, which matters for tokens, such as
+        'usr' or 'bin', which are found in most lines of most packages."""
+
+        binary = True
+
+        # The width, in bytes, of the differences and the first offset.
+        _posting = struct.Struct("<BQ")
+        # The lengths of the fmris and of the encoded offsets.
+        _record = struct.Struct("<II")
+
+        # The array type codes for each width of difference.
+        _typecodes = dict((array(c).itemsize, c) for c in "QLIHB")
+
+        def __init__(self, file_name, p_id_trans):
+                InvertedDict.__init__(self, file_name, p_id_trans)
+                self._data = None
+
+        @classmethod
+        def _encode_offsets(cls, offsets):
+                """Returns the sorted offsets packed into a byte string."""
+
+                if not offsets:
+                        return b""
+                deltas = [b - a for a, b in zip(offsets, offsets[1:])]
+                width = 1
+                if deltas:
+                        m = max(deltas)
+                        while m >= 1 << (width * 8):
+                                width *= 2
+                a = array(cls._typecodes[width], deltas)
+                if sys.byteorder != "little":
+                        a.byteswap()
+                return cls._posting.pack(width, offsets[0]) + a.tobytes()
+
+        @classmethod
+        def _decode_offsets(cls, offs):
+                """Returns an iterator over the offsets packed by
+                _encode_offsets."""
+
+                if not offs:
+                        return iter(())
+                width, first = cls._posting.unpack_from(offs)
+                a = array(cls._typecodes[width])
+                a.frombytes(offs[cls._posting.size:])
+                if sys.byteorder != "little":
+                        a.byteswap()
+                return itertools.accumulate(itertools.chain((first,), a))
+
+        def write_dict_file(self, path, version_num):
+                """Write the mapping of package fmris to offset sets out
+                to the file."""
+
+                inv = self.invert_id_to_offsets_dict()
+                with open(os.path.join(path, self._name), "wb") as fh:
+                        fh.write(force_bytes(
+                            "VERSION: {0}\n".format(version_num)))
+                        for o in inv:
+                                fmris = " ".join(
+                                    self._p_id_trans.get_entity(
+                                        p_id).get_fmri(anarchy=True,
+                                        include_scheme=False)
+                                    for p_id in inv[o]
+                                ).encode("utf-8")
+                                fh.write(self._record.pack(len(fmris),
+                                    len(o)))
+                                fh.write(fmris)
+                                fh.write(o)
+
+        def read_dict_file(self):
+                """Read a file written by the above function and store the
+                information in a dictionary."""
+
+                assert self._file_handle
+                self._data = memoryview(self._file_handle.read())
+                pos = 0
+                end = len(self._data)
+                while pos < end:
+                        flen, olen = self._record.unpack_from(self._data, pos)
+                        pos += self._record.size
+                        fmris = self._data[pos:pos + flen].tobytes().decode(
+                            "utf-8")
+                        pos += flen
+                        self._dict[fmris] = self._data[pos:pos + olen]
+                        pos += olen
+                IndexStoreBase.read_dict_file(self)
 
 # Vim hints
 # vim:ts=8:sw=8:et:fdm=marker
@@ -28,6 +28,7 @@ import codecs
 import datetime
 import errno
 import hashlib
+import itertools
 import logging
 import os
 import os.path
@@ -36,7 +37,9 @@ import six
 import stat
 import sys
 import tempfile
+import threading
 import zlib
+from collections import OrderedDict
 from cryptography import x509
 from cryptography.hazmat.backends import default_backend
 from io import BytesIO
@@ -88,6 +91,10 @@ REPO_FIX_ITEM = 0
 REPO_FIX_FAILED = 1
 
 VERIFY_DEPENDENCY = "dependency"
+
+# The approximate amount of memory which may be used by each repository store
+# to cache search results.
+SEARCH_CACHE_MAX_SIZE = 32 * 1024 * 1024
 verify_default_checks = frozenset([
       VERIFY_DEPENDENCY,
 ])
@@ -375,6 +382,79 @@ class RepositorySigNoTrustAnchorDirError(RepositoryError):
                 return _("Unable to find trust anchor directory {0}").format(
                     self.data)
 
+
+class _SearchResultCache(object):
+        """A least recently used cache of search results which is bounded by
+        the approximate amount of memory used by the results."""
+
+        # The approximate size of a result in addition to its strings.
+        __RESULT_OVERHEAD = 256
+
+        def __init__(self, max_size=SEARCH_CACHE_MAX_SIZE):
+                self.__entries = OrderedDict()
+                self.__lock = threading.Lock()
+                self.__max_size = max_size
+                self.__size = 0
+
+        def clear(self):
+                """Discards all cached results."""
+
+                with self.__lock:
+                        self.__entries.clear()
+                        self.__size = 0
+
+        def get(self, key):
+                """Returns an iterator over the cached results for 'key' or
+                None if they aren't cached."""
+
+                with self.__lock:
+                        try:
+                                size, res = self.__entries[key]
+                        except KeyError:
+                                return None
+                        self.__entries.move_to_end(key)
+                return iter(res)
+
+        def gen_results(self, key, it):
+                """Yields the results from the iterator 'it' and caches them
+                for 'key' once all of them have been produced.  Results which
+                would use more than a quarter of the cache aren't cached."""
+
+                res = []
+                size = 0
+                for r in it:
+                        if res is not None:
+                                size += self.__result_size(r)
+                                if size > self.__max_size // 4:
+                                        res = None
+                                else:
+                                        res.append(r)
+                        yield r
+                if res is not None:
+                        self.__add(key, res, size)
+
+        @staticmethod
+        def __result_size(r):
+                v, return_type, vals = r
+                if return_type == qp.Query.RETURN_ACTIONS:
+                        fmri_str, fv, line = vals
+                        return len(fv) + len(line) + \
+                            _SearchResultCache.__RESULT_OVERHEAD
+                return _SearchResultCache.__RESULT_OVERHEAD
+
+        def __add(self, key, res, size):
+                with self.__lock:
+                        old = self.__entries.pop(key, None)
+                        if old:
+                                self.__size -= old[0]
+                        self.__entries[key] = (size, res)
+                        self.__size += size
+                        while self.__size > self.__max_size:
+                                k, (old_size, old_res) = \
+                                    self.__entries.popitem(last=False)
+                                self.__size -= old_size
+
+
 class _RepoStore(object):
         """The _RepoStore object provides an interface for performing operations
         on a set of package data contained within a repository.  This class is
@@ -387,8 +467,10 @@ class _RepoStore(object):
             sort_file_max_size=indexer.SORT_FILE_MAX_SIZE, writable_root=None):
                 """Prepare the repository for use."""
 
+                self.__bulk = False
                 self.__catalog = None
                 self.__catalog_root = None
+                self.__catalog_state = None
                 # FileManager supports multiple layouts, but realistically, it
                 # is desirable to only support one per repository format
                 # version.
@@ -426,6 +508,8 @@ class _RepoStore(object):
 
                 self.__search_available = False
                 self.__refresh_again = False
+                self.__merge_thread = None
+                self.__search_cache = _SearchResultCache()
 
                 self.__lock = pkg.nrlock.NRLock()
                 if self.__tmp_root:
@@ -1107,12 +1191,27 @@ class _RepoStore(object):
                 # catalog's location, and remove the old catalog data.
                 shutil.move(tmp_cat_root, old_cat_root)
                 self.__set_catalog_root(old_cat_root)
+                self.__catalog_state = self.__get_catalog_state()
                 if orig_cat_root:
                         shutil.rmtree(orig_cat_root)
 
                 # Set catalog version.
                 self.catalog_version = self.catalog.version
 
+        def __get_catalog_state(self):
+                """Returns a tuple identifying the version of the catalog that
+                is currently published on-disk, or None if there isn't one.
+                Since new versions are published by renaming a new catalog
+                directory into place, the identity of the catalog's attributes
+                file changes whenever a new version is published."""
+
+                try:
+                        st = os.stat(os.path.join(self.catalog_root,
+                            "catalog.attrs"))
+                except (EnvironmentError, TypeError):
+                        return None
+                return (st.st_ino, st.st_size, st.st_mtime_ns)
+
         def __set_catalog_root(self, root):
                 self.__catalog_root = root
                 if self.__catalog:
@@ -1181,11 +1280,40 @@ class _RepoStore(object):
                             self._get_manifest, self.manifest,
                             log=self.__index_log,
                             sort_file_max_size=self.__sort_file_max_size)
-                        index_inst.server_update_index(fmris)
+                        if index_inst.server_update_index_segmented(fmris):
+                                self.__merge_index_segments()
                         if not self.__search_available:
                                 self.__index_log("Search Available")
                         self.__search_available = True
 
+        def __merge_index_segments(self):
+                """Starts a thread which merges the delta segments of the
+                search index into the index, unless one is already running.
+                """
+
+                if self.__merge_thread and self.__merge_thread.is_alive():
+                        return
+
+                def merge():
+                        seg_dirs = indexer.Indexer.get_segment_dirs(
+                            self.index_root)
+                        ind = indexer.Indexer(self.index_root,
+                            self._get_manifest, self.manifest,
+                            log=self.__index_log,
+                            sort_file_max_size=self.__sort_file_max_size)
+                        try:
+                                ind.server_merge_segments()
+                        except (se.IndexingException, EnvironmentError) as e:
+                                self.__index_log(str(e))
+                        finally:
+                                for seg_dir in seg_dirs:
+                                        sqp.TermQuery.clear_cache(seg_dir)
+
+                self.__index_log("Merging search index segments")
+                self.__merge_thread = threading.Thread(target=merge,
+                    name="index-merge")
+                self.__merge_thread.start()
+
         def abandon(self, trans_id):
                 """Aborts a transaction with the specified Transaction ID.
                 Returns the current package state."""
@@ -1307,7 +1435,8 @@ class _RepoStore(object):
                 self.__lock_rstore(blocking=True)
                 try:
                         self.__add_package(pfmri)
-                        self.__save_catalog()
+                        if not self.__bulk:
+                                self.__save_catalog()
                 finally:
                         self.__unlock_rstore()
 
@@ -1329,13 +1458,57 @@ class _RepoStore(object):
                 finally:
                         self.__unlock_rstore()
 
+        def begin_bulk(self):
+                """Starts a bulk session for the repository's catalog.  Until
+                end_bulk() is called, packages added to the catalog (e.g. by
+                closing transactions) are journaled and the catalog is not
+                written; end_bulk() then adds them all and saves the catalog
+                once."""
+
+                if self.mirror:
+                        raise RepositoryMirrorError()
+                if self.read_only:
+                        raise RepositoryReadOnlyError()
+                if not self.catalog_root or self.catalog_version < 1:
+                        raise RepositoryUnsupportedOperationError()
+
+                self.__lock_rstore(blocking=True)
+                try:
+                        self.catalog.begin_bulk()
+                        self.__bulk = True
+                finally:
+                        self.__unlock_rstore()
+
+        def end_bulk(self):
+                """Ends the active bulk session for the repository's catalog,
+                saving any packages added during it."""
+
+                if not self.__bulk:
+                        return
+
+                self.__lock_rstore(blocking=True)
+                try:
+                        self.__bulk = False
+                        # Saving the catalog flushes its journal.
+                        self.__save_catalog()
+                        self.catalog.end_bulk()
+                finally:
+                        self.__unlock_rstore()
+
         @property
         def catalog(self):
                 """Returns the Catalog object for the repository's catalog."""
 
                 if self.__catalog:
-                        # Already loaded.
-                        return self.__catalog
+                        if not self.__catalog.read_only or \
+                            self.__catalog_state == self.__get_catalog_state():
+                                # Already loaded.
+                                return self.__catalog
+
+                        # A new version of the catalog has been published
+                        # (possibly by another process) since this one was
+                        # loaded, so discard it.
+                        self.__catalog = None
 
                 if self.mirror:
                         raise RepositoryMirrorError()
@@ -1346,8 +1519,14 @@ class _RepoStore(object):
                         return old_catalog.ServerCatalog(self.catalog_root,
                             read_only=True, publisher=self.publisher)
 
+                # Binary companions of the catalog parts are used so that
+                # package lookups can be satisfied using memory-mapped data
+                # shared by all of the processes serving the repository
+                # instead of each loading its own copy of the catalog.
+                self.__catalog_state = self.__get_catalog_state()
                 self.__catalog = catalog.Catalog(meta_root=self.catalog_root,
-                    log_updates=True, read_only=self.read_only)
+                    log_updates=True, read_only=self.read_only,
+                    binary_parts=True)
                 return self.__catalog
 
         def catalog_0(self):
@@ -1410,6 +1589,10 @@ class _RepoStore(object):
                         # Nothing to do.
                         return
                 sqp.TermQuery.clear_cache(self.index_root)
+                for seg_dir in indexer.Indexer.get_segment_dirs(
+                    self.index_root):
+                        sqp.TermQuery.clear_cache(seg_dir)
+                self.__search_cache.clear()
 
         def close(self, trans_id, add_to_catalog=True):
                 """Closes the transaction specified by 'trans_id'.
@@ -1924,21 +2107,74 @@ class _RepoStore(object):
                 if not self.search_available:
                         raise RepositorySearchUnavailableError()
 
-                def _search(q):
-                        assert self.index_root
+                def _search_index(q, index_dir, num_to_return, start_point):
                         l = sqp.QueryLexer()
                         l.build()
                         qqp = sqp.QueryParser(l)
                         query = qqp.parse(q.text)
-                        query.set_info(num_to_return=q.num_to_return,
-                            start_point=q.start_point,
-                            index_dir=self.index_root,
+                        query.set_info(num_to_return=num_to_return,
+                            start_point=start_point,
+                            index_dir=index_dir,
                             get_manifest_path=self.manifest,
                             case_sensitive=q.case_sensitive)
                         if q.return_type == sqp.Query.RETURN_PACKAGES:
                                 query.propagate_pkg_return()
                         return query.search(self.catalog.fmris)
 
+                def _search_segments(q, base_res, seg_dirs):
+                        # While segments are being merged, their packages
+                        # are also present in the index, so duplicate
+                        # results are dropped.
+                        seen = set()
+                        for r in base_res:
+                                seen.add(r)
+                                yield r
+                        for seg_dir in seg_dirs:
+                                try:
+                                        res = _search_index(q, seg_dir, None,
+                                            None)
+                                except se.NoIndexException:
+                                        # The segment was merged and removed
+                                        # after the search started.
+                                        continue
+                                for r in res:
+                                        if r not in seen:
+                                                seen.add(r)
+                                                yield r
+
+                def _search(q):
+                        assert self.index_root
+
+                        # Results are cached by the normalized query and the
+                        # generation of the index, so that they're no longer
+                        # used once the index has been updated by any
+                        # process.
+                        key = (q.text.strip(), q.case_sensitive,
+                            q.return_type, q.num_to_return, q.start_point,
+                            indexer.Indexer.get_generation(self.index_root))
+                        res = self.__search_cache.get(key)
+                        if res is None:
+                                res = self.__search_cache.gen_results(key,
+                                    _search_uncached(q))
+                        return res
+
+                def _search_uncached(q):
+                        seg_dirs = indexer.Indexer.get_segment_dirs(
+                            self.index_root)
+                        if not seg_dirs:
+                                return _search_index(q, self.index_root,
+                                    q.num_to_return, q.start_point)
+
+                        base_res = _search_index(q, self.index_root, None,
+                            None)
+                        start = q.start_point or 0
+                        stop = None
+                        if q.num_to_return is not None:
+                                stop = start + q.num_to_return
+                        return itertools.islice(
+                            _search_segments(q, base_res, seg_dirs),
+                            start, stop)
+
                 query_lst = []
                 try:
                         for s in queries:
@@ -3248,6 +3484,27 @@ class Repository(object):
                         raise
                 return rstore.append(client_release, pfmri)
 
+        def begin_bulk(self, pub=None):
+                """Starts a bulk session for the catalogs of the repository so
+                that packages added to them are only written when end_bulk()
+                is called.  This greatly reduces the cost of adding large
+                numbers of packages.
+
+                'pub' is an optional publisher prefix to limit the session
+                to.  If no repository storage object exists for it yet, one is
+                added, as it would be when a package is first published for
+                it."""
+
+                if pub and pub not in self.__rstores:
+                        self.__new_rstore(pub)
+
+                for rstore in self.rstores:
+                        if not rstore.publisher:
+                                continue
+                        if pub and rstore.publisher != pub:
+                                continue
+                        rstore.begin_bulk()
+
         def catalog_0(self, pub=None):
                 """Returns a generator object for the full version of
                 the catalog contents.  Incremental updates are not provided
@@ -3288,6 +3545,18 @@ class Repository(object):
                 rstore = self.get_trans_rstore(trans_id)
                 return rstore.close(trans_id, add_to_catalog=add_to_catalog)
 
+        def end_bulk(self, pub=None):
+                """Ends any active bulk sessions for the catalogs of the
+                repository, saving the packages added during them.
+
+                'pub' is an optional publisher prefix to limit the operation
+                to."""
+
+                for rstore in self.rstores:
+                        if pub and rstore.publisher != pub:
+                                continue
+                        rstore.end_bulk()
+
         def file(self, fhash, pub=None):
                 """Returns the absolute pathname of the file specified by the
                 provided SHA1-hash name.
@@ -250,7 +250,10 @@ class Version(object):
         v2 is a later release or branch.  The build_release DotSequence records
         the system on which the package binaries were constructed."""
 
-        __slots__ = ["release", "branch", "build_release", "timestr"]
+        # __weakref__ allows Version objects to be shared using a
+        # WeakValueDictionary (see pkg.catalog).
+        __slots__ = ["release", "branch", "build_release", "timestr",
+            "__weakref__"]
 
         def __init__(self, version_string, build_string=None):
                 # XXX If illegally formatted, raise exception.
@@ -394,6 +397,8 @@ class Version(object):
                 return datetime.datetime.utcfromtimestamp(calendar.timegm(t))
 
         def __ne__(self, other):
+                if self is other:
+                        return False
                 if not isinstance(other, Version):
                         return True
 
@@ -404,6 +409,8 @@ class Version(object):
                 return True
 
         def __eq__(self, other):
+                if self is other:
+                        return True
                 if not isinstance(other, Version):
                         return False
 
@@ -420,6 +427,8 @@ class Version(object):
                 then that version is less than the other.  The same applies to
                 the branch and timestamp components.
                 """
+                if self is other:
+                        return False
                 if not isinstance(other, Version):
                         return False
 
@@ -453,6 +462,8 @@ class Version(object):
                 then that version is less than the other.  The same applies to
                 the branch and timestamp components.
                 """
+                if self is other:
+                        return False
                 if not isinstance(other, Version):
                         return True
 
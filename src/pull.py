@@ -72,6 +72,7 @@ xport_cfg = None
 dest_xport = None
 targ_pub = None
 target = None
+bulk_pubs = []
 
 def error(text):
         """Emit an error message prefixed by the command name """
@@ -209,6 +210,10 @@ def cleanup(caller_error=False):
                         continue
                 shutil.rmtree(d, ignore_errors=True)
 
+        if caller_error and dest_xport:
+                # Save any packages already published during a bulk session.
+                end_bulk(ignore_errors=True)
+
         if caller_error and dest_xport and targ_pub and not archive:
                 try:
                         dest_xport.publish_refresh_packages(targ_pub)
@@ -217,6 +222,18 @@ def cleanup(caller_error=False):
                         # attempt anyway.
                         pass
 
+def end_bulk(ignore_errors=False):
+        """Ends the bulk publication sessions started for the publishers of
+        the target repository, saving the packages added to its catalog."""
+
+        while bulk_pubs:
+                pub = bulk_pubs.pop()
+                try:
+                        dest_xport.publish_end_bulk(pub)
+                except apx.TransportError:
+                        if not ignore_errors:
+                                raise
+
 def abort(err=None, retcode=1):
         """To be called when a fatal error is encountered."""
 
@@ -1580,6 +1597,15 @@ def transfer_pkgs(pargs, target, list_newest, all_versions, all_timestamps,
                         # compressed in the source.
                         keep_compressed, hashes = dest_xport.get_transfer_info(
                             new_targ_pubs[pkgs_to_get[0].publisher])
+
+                        # Packages published to a filesystem-based repository
+                        # are added to its catalog as their transactions are
+                        # closed, but the catalog is only written once at the
+                        # end of a bulk session instead of after each of them.
+                        if target.startswith("file://"):
+                                for pub in new_targ_pubs.values():
+                                        dest_xport.publish_begin_bulk(pub)
+                                        bulk_pubs.append(pub)
                 for nf in pkgs_to_get:
                         tracker.republish_start_pkg(nf)
                         # Processing republish.
@@ -1670,8 +1696,10 @@ def transfer_pkgs(pargs, target, list_newest, all_versions, all_timestamps,
                                                                     basename=fp)
                                                         else:
                                                                 t.add_file(fname)
-                                # Always defer catalog update.
-                                t.close(add_to_catalog=False)
+                                # Always defer catalog update; either until
+                                # the bulk session ends or the catalog is
+                                # refreshed.
+                                t.close(add_to_catalog=bool(bulk_pubs))
                         except trans.TransactionError as e:
                                 abort(err=e)
 
@@ -1697,11 +1725,13 @@ def transfer_pkgs(pargs, target, list_newest, all_versions, all_timestamps,
                 tracker.republish_done()
                 tracker.reset()
 
-                if processed > 0:
+                if bulk_pubs:
+                        end_bulk()
+                elif processed > 0:
                         # If any packages were published, trigger an update of
                         # the catalog.
-                        total_processed += processed
                         dest_xport.publish_refresh_packages(targ_pub)
+                total_processed += processed
 
                 # Prevent further use.
                 targ_pub = None
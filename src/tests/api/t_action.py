@@ -37,6 +37,8 @@ import pkg.actions.generic as generic
 import pkg.actions.signature as signature
 import pkg.client.api_errors as api_errors
 import pkg.digest
+import pkg.facet as facet
+import pkg.variant as variant
 from pkg.client.debugvalues import DebugValues
 from importlib import reload
 
@@ -518,6 +520,157 @@ Incorrect attribute list.
                 self.assertInvalid("file xyz789 hash=abc123 path=usr/bin/foo mode=0755 owner=root group=bin")
                 action.fromstr("file abc123 hash=abc123 path=usr/bin/foo mode=0755 owner=root group=bin")
 
+        def test_action_fromcontent(self):
+                """Verify that fromcontent() parses all of the actions found in
+                manifest content the same way as fromstr()."""
+
+                content = "\n".join(self.act_strings)
+                for c in (content, content.encode("utf-8"),
+                    content.replace("\n", "\r\n")):
+                        alist, errors = action.fromcontent(c)
+                        self.assertEqual(errors, [])
+                        self.assertEqual(
+                            [str(a) for a in alist],
+                            [str(action.fromstr(s)) for s in self.act_strings])
+
+                # Line continuation, comments and blank lines are handled and
+                # errors are reported for each line.
+                alist, errors = action.fromcontent("""\
+                    # comment
+                    set name=pkg.summary \\
+                        value="foo"
+
+                    moop bar=baz
+                    dir path=foo \\
+                      owner=root group=bin mode=0755 \\
+                      path=bar
+                    set name=foo value=bar""")
+                self.assertEqual([str(a) for a in alist], [
+                    "set name=pkg.summary value=foo",
+                    "set name=foo value=bar"
+                ])
+                self.assertEqual([type(e) for e in errors],
+                    [action.UnknownActionError,
+                    action.KeyAttributeMultiValueError])
+                self.assertEqual([e.lineno for e in errors], [5, 8])
+
+                # Actions not allowed by the excludes are omitted.
+                content = """\
+                    dir path=foo owner=root group=bin mode=0755 variant.arch=i386
+                    dir path=bar owner=root group=bin mode=0755 variant.arch=sparc
+                    dir path=baz owner=root group=bin mode=0755
+                """
+                def allow_i386(a, publisher):
+                        self.assertEqual(publisher, "test")
+                        return a.attrs.get("variant.arch", "i386") == "i386"
+                alist, errors = action.fromcontent(content,
+                    excludes=[allow_i386, lambda a, publisher: True],
+                    publisher="test")
+                self.assertEqual(errors, [])
+                self.assertEqual([a.attrs["path"] for a in alist],
+                    ["foo", "baz"])
+
+        def test_action_fromcontent_whitespace(self):
+                """Verify that fromcontent() ignores the same leading
+                whitespace as str.lstrip()."""
+
+                line = "set name=foo value=bar"
+                spaces = [c for c in map(six.unichr, range(sys.maxunicode + 1))
+                    if c.isspace() and len(("x" + c + "x").splitlines()) == 1]
+                self.assertTrue(u"\xa0" in spaces and u"\u3000" in spaces)
+                for c in spaces:
+                        content = c + line + "\n" + c + c + "\\\n" + c + "#"
+                        for cont in (content, content.encode("utf-8")):
+                                alist, errors = action.fromcontent(cont)
+                                self.assertEqual(errors, [])
+                                self.assertEqual([str(a) for a in alist],
+                                    [line])
+
+                # Characters that str.lstrip() keeps aren't ignored.
+                alist, errors = action.fromcontent(u"\u200b" + line)
+                self.assertEqual(alist, [])
+                self.assertEqual([type(e) for e in errors],
+                    [action.UnknownActionError])
+
+        def test_action_compact(self):
+                """Verify that compacted actions behave the same as those with
+                attributes stored in a dictionary."""
+
+                for s in self.act_strings:
+                        a1 = action.fromstr(s)
+                        a2 = action.fromstr(s).compact()
+                        self.assertTrue(isinstance(a2.attrs,
+                            generic.CompactAttrs))
+                        self.assertEqual(str(a1), str(a2))
+                        self.assertEqual(a1.attrs, a2.attrs)
+                        self.assertEqual(a2.attrs, a1.attrs)
+                        self.assertEqual(sorted(a1.attrs.items()),
+                            sorted(a2.attrs.items()))
+                        self.assertEqual(a1.differences(a2), set())
+                        self.assertTrue(not a1.different(a2))
+
+                # Attribute name tables are shared by actions with the same
+                # attributes.
+                a1 = action.fromstr("dir path=foo owner=root group=bin "
+                    "mode=0755").compact()
+                a2 = action.fromstr("dir path=bar owner=root group=bin "
+                    "mode=0755").compact()
+                self.assertTrue(a1.attrs._CompactAttrs__index is
+                    a2.attrs._CompactAttrs__index)
+                self.assertEqual(a2.attrs.get("path"), "bar")
+                self.assertEqual(a2.attrs.get("target"), None)
+                self.assertTrue("path" in a2.attrs)
+                self.assertEqual(len(a2.attrs), 4)
+
+                # Modifications only apply to the modified action.
+                a2.attrs["variant.arch"] = "sparc"
+                del a2.attrs["mode"]
+                self.assertEqual(str(a2),
+                    "dir group=bin owner=root path=bar variant.arch=sparc")
+                self.assertEqual(str(a1),
+                    "dir group=bin mode=0755 owner=root path=foo")
+                a2.strip()
+                self.assertEqual(str(a2), "dir group=bin owner=root path=bar")
+
+                # Variant and facet filtering is supported.
+                v = variant.Variants({ "variant.arch": "i386" })
+                a2.attrs["variant.arch"] = "sparc"
+                self.assertTrue(not v.allow_action(a2, None))
+                self.assertTrue(v.allow_action(a1, None))
+                f = facet.Facets({ "facet.doc": False })
+                for s, allowed in (
+                    ("variant.arch=i386 facet.doc=true", (True, False)),
+                    ("variant.arch=sparc facet.locale=true", (False, True)),
+                    ("variant.debug.foo=true facet.debug.foo=all",
+                        (False, False))):
+                        a1 = action.fromstr("dir path=foo owner=root "
+                            "group=bin mode=0755 " + s).compact()
+                        a2 = action.fromstr("dir path=bar " + s).compact()
+                        for a in (a1, a2):
+                                self.assertEqual((v.allow_action(a, None),
+                                    f.allow_action(a, None)), allowed)
+
+                # The cache of attribute name tables is bounded, but tables
+                # stay shared by the actions using them.
+                tables = generic.CompactAttrs._CompactAttrs__tables
+                max_tables = generic.CompactAttrs._CompactAttrs__max_tables
+                generic.CompactAttrs._CompactAttrs__max_tables = 2
+                try:
+                        tables.clear()
+                        alist = [action.fromstr("dir path=foo " + s).compact()
+                            for s in ("", "owner=root", "owner=root",
+                            "group=bin")]
+                finally:
+                        generic.CompactAttrs._CompactAttrs__max_tables = \
+                            max_tables
+                self.assertEqual(len(tables), 1)
+                self.assertTrue(alist[1].attrs._CompactAttrs__index is
+                    alist[2].attrs._CompactAttrs__index)
+                self.assertEqual([str(a) for a in alist], [
+                    "dir path=foo", "dir owner=root path=foo",
+                    "dir owner=root path=foo", "dir group=bin path=foo"
+                ])
+
         def test_validate(self):
                 """Verify that action validate() works as expected; currently
                 only used during publication or action execution failure."""
@@ -46,6 +46,7 @@ import pkg.client.api_errors as api_errors
 import pkg.manifest as manifest
 import pkg.misc as misc
 import pkg.portable as portable
+import pkg.server.repository as sr
 import pkg.variant as variant
 
 
@@ -1119,6 +1120,418 @@ class TestCatalog(pkg5unittest.Pkg5TestCase):
                         self.assertFalse(fname.startswith("catalog.") or \
                             fname.startswith("update."))
 
+        def test_11_binary_parts(self):
+                """Verify that binary catalog part companions are written,
+                used for stem lookups, and ignored once stale."""
+
+                cpath = self.create_test_dir("test-11")
+                c = catalog.Catalog(meta_root=cpath, binary_parts=True)
+                c.append(self.c)
+                c.finalize()
+                c.save()
+
+                bpath = os.path.join(cpath, "catalog.base.C.bin")
+                self.assertTrue(os.path.exists(bpath))
+
+                # Lookups for individual stems must not require the part
+                # to be loaded and must match the results of a fully
+                # loaded catalog.
+                nc = catalog.Catalog(meta_root=cpath, read_only=True)
+                base = nc.get_part("catalog.base.C", must_exist=True)
+                for f in self.c.fmris():
+                        self.assertEqual(nc.get_entry(f), self.c.get_entry(f))
+                self.assertEqual(nc.get_entry(fmri.PkgFmri(
+                    "pkg://opensolaris.org/nosuch@1.0")), None)
+                self.assertEqual(nc.get_entry(fmri.PkgFmri(
+                    "pkg://extra/test@1.0,5.11-1:20000101T120000Z")), None)
+                for name in ("apkg", "test", "zpkg", "nosuch"):
+                        self.assertEqual(list(nc.fmris_by_version(name)),
+                            list(self.c.fmris_by_version(name)))
+                        self.assertEqual(
+                            list(nc.fmris_by_version(name, pubs=["extra"])),
+                            list(self.c.fmris_by_version(name,
+                            pubs=["extra"])))
+                        self.assertEqual(list(nc.entries_by_version(name)),
+                            list(self.c.entries_by_version(name)))
+                self.assertFalse(base.loaded)
+
+                # Full iteration loads the part as usual.
+                self.assertEqual(set(nc.fmris()), set(self.c.fmris()))
+                self.assertTrue(base.loaded)
+
+                # Once the part has been changed, the companion must not be
+                # used, even though it is still present on-disk.
+                f = fmri.PkgFmri("pkg://opensolaris.org/"
+                    "test@1.0,5.11-1:20000101T120000Z")
+                nc = catalog.Catalog(meta_root=cpath)
+                nc.remove_package(f)
+                nc.save()
+                self.assertTrue(os.path.exists(bpath))
+
+                nc = catalog.Catalog(meta_root=cpath, read_only=True)
+                self.assertEqual(nc.get_entry(f), None)
+                self.assertEqual(
+                    sum(len(fl) for v, fl in nc.fmris_by_version("test")), 8)
+
+                # Destroying the catalog removes the companions as well.
+                nc.destroy()
+                self.assertFalse(os.path.exists(bpath))
+
+        def test_12_stem_index(self):
+                """Verify that the index of package stems is stored with the
+                catalog and that pattern matching using it works as
+                expected."""
+
+                cpath = self.create_test_dir("test-12")
+                c = catalog.Catalog(meta_root=cpath)
+                for s in ("library/zlib", "system/library/zlib",
+                    "library/zlib-devel", "web/zlibext", "zlib", "zsh"):
+                        c.add_package(fmri.PkgFmri(
+                            "pkg://opensolaris.org/{0}@1.0,5.11-1".format(s)))
+                c.add_package(fmri.PkgFmri(
+                    "pkg://extra/library/zlib@2.0,5.11-1"))
+                c.save()
+
+                spath = os.path.join(cpath, "catalog.stems")
+                self.assertTrue(os.path.exists(spath))
+
+                def gen_stems(cat, patterns, pubs=misc.EmptyI):
+                        return sorted(set(
+                            t[1]
+                            for t, states, attrs in cat.gen_packages(
+                                patterns=patterns, pubs=pubs)
+                        ))
+
+                for cat in (c, catalog.Catalog(meta_root=cpath)):
+                        self.assertEqual(gen_stems(cat, ["zlib"]),
+                            ["library/zlib", "system/library/zlib", "zlib"])
+                        self.assertEqual(gen_stems(cat, ["library/zlib"]),
+                            ["library/zlib", "system/library/zlib"])
+                        self.assertEqual(gen_stems(cat, ["pkg:/library/zlib"]),
+                            ["library/zlib"])
+                        self.assertEqual(gen_stems(cat, ["/zlib"]), ["zlib"])
+                        self.assertEqual(gen_stems(cat, ["library/z*"]),
+                            ["library/zlib", "library/zlib-devel"])
+                        self.assertEqual(gen_stems(cat, ["*/zlib"]),
+                            ["library/zlib", "system/library/zlib"])
+                        self.assertEqual(gen_stems(cat, ["*zlib*"]),
+                            ["library/zlib", "library/zlib-devel",
+                            "system/library/zlib", "web/zlibext", "zlib"])
+                        self.assertEqual(gen_stems(cat, ["z?h", "web/*"]),
+                            ["web/zlibext", "zsh"])
+                        self.assertEqual(gen_stems(cat, ["zlib"],
+                            pubs=["extra"]), ["library/zlib"])
+                        self.assertEqual(gen_stems(cat, ["nosuch", "n*"]), [])
+
+                        pdict, refs, unmatched = cat.get_matching_fmris(
+                            ["pkg:/zlib", "library/zlib-devel", "zs*",
+                            "library/zlib@2", "nosuch"])
+                        self.assertEqual(sorted(pdict.keys()),
+                            ["library/zlib", "library/zlib-devel", "zlib",
+                            "zsh"])
+                        self.assertEqual([str(f) for f in
+                            pdict["library/zlib"]],
+                            ["pkg://extra/library/zlib@2.0,5.11-1"])
+                        self.assertEqual(unmatched, set(["nosuch"]))
+
+                        # Ambiguous patterns are still detected.
+                        self.assertRaises(api_errors.PackageMatchErrors,
+                            cat.get_matching_fmris, ["zlib"])
+
+                # A stale index must not be used.
+                c.add_package(fmri.PkgFmri(
+                    "pkg://opensolaris.org/net/zlib@1.0,5.11-1"))
+                self.assertEqual(gen_stems(c, ["*/zlib"]),
+                    ["library/zlib", "net/zlib", "system/library/zlib"])
+                c.save()
+
+                shutil.copyfile(spath, spath + ".old")
+                c.remove_package(fmri.PkgFmri(
+                    "pkg://opensolaris.org/net/zlib@1.0,5.11-1"))
+                c.save()
+                shutil.copyfile(spath + ".old", spath)
+                nc = catalog.Catalog(meta_root=cpath)
+                self.assertEqual(gen_stems(nc, ["*/zlib"]),
+                    ["library/zlib", "system/library/zlib"])
+
+        def test_13_merged_updates(self):
+                """Verify that incremental updates applied to catalog parts
+                that haven't been loaded produce the same content as the
+                source catalog."""
+
+                opath = self.create_test_dir("test-13-orig")
+                orig = catalog.Catalog(meta_root=opath, log_updates=True)
+                for s in ("apkg@1.0,5.11-1:20000101T120000Z",
+                    "apkg@1.1,5.11-1:20000101T120000Z",
+                    "mpkg@1.0,5.11-1:20000101T120000Z",
+                    "zpkg@1.0,5.11-1:20000101T120000Z"):
+                        f = fmri.PkgFmri("pkg://opensolaris.org/" + s)
+                        orig.add_package(f, manifest=self.__gen_manifest(f))
+                orig.save()
+
+                dpath = os.path.join(self.test_root, "test-13-dup")
+                shutil.copytree(opath, dpath)
+
+                # Add a new version of an existing package, packages with new
+                # stems before, between, and after the existing ones, a new
+                # publisher, and remove every version of an existing package.
+                for s in ("opensolaris.org/apkg@1.0.1,5.11-1:20000101T120000Z",
+                    "opensolaris.org/0pkg@1.0,5.11-1:20000101T120000Z",
+                    "opensolaris.org/npkg@1.0,5.11-1:20000101T120000Z",
+                    "opensolaris.org/zzpkg@1.0,5.11-1:20000101T120000Z",
+                    "extra/mpkg@2.0,5.11-1:20000101T120000Z"):
+                        f = fmri.PkgFmri("pkg://" + s)
+                        orig.add_package(f, manifest=self.__gen_manifest(f))
+                orig.remove_package(fmri.PkgFmri("pkg://opensolaris.org/"
+                    "mpkg@1.0,5.11-1:20000101T120000Z"))
+                orig.save()
+
+                dup = catalog.Catalog(meta_root=dpath)
+                dup.apply_updates(opath)
+                self.assertEqual(sorted(dup.fmris()), sorted(orig.fmris()))
+
+                # The merged parts must be identical to those of the source.
+                for name in ("catalog.base.C", "catalog.dependency.C",
+                    "catalog.summary.C"):
+                        with open(os.path.join(opath, name), "rb") as f:
+                                expected = f.read()
+                        with open(os.path.join(dpath, name), "rb") as f:
+                                self.assertEqual(f.read(), expected)
+                        self.assertFalse(os.path.exists(
+                            os.path.join(dpath, name + ".new")))
+                dup = catalog.Catalog(meta_root=dpath)
+
+                # The stem index must have been updated as well.
+                self.assertEqual(sorted(set(
+                    t[1]
+                    for t, states, attrs in dup.gen_packages(
+                        patterns=["*pkg"])
+                )), ["0pkg", "apkg", "mpkg", "npkg", "zpkg", "zzpkg"])
+
+                # Content must be read correctly regardless of how it is
+                # buffered.
+                pathname = os.path.join(dpath, "catalog.summary.C")
+                with open(pathname, "rb") as f:
+                        data = json.load(f)
+                del data["_SIGNATURE"]
+                for bufsz in (1, 7, 4096):
+                        with open(pathname, "r", encoding="utf-8") as f:
+                                entries = {}
+                                for pub, stem, raw in catalog._JSONReader(f,
+                                    bufsz=bufsz).entries():
+                                        entries.setdefault(pub, {})[stem] = \
+                                            json.loads(raw)
+                        self.assertEqual(entries, data)
+
+                # Updates that don't match the source's signatures must be
+                # rejected without modifying the catalog.
+                shutil.rmtree(dpath)
+                shutil.copytree(opath, dpath)
+                orig.add_package(fmri.PkgFmri("pkg://opensolaris.org/"
+                    "bpkg@1.0,5.11-1:20000101T120000Z"))
+                orig.save()
+                attrs = catalog.CatalogAttrs(meta_root=opath)
+                attrs.parts["catalog.base.C"]["signature-sha-1"] = "0" * 40
+                attrs.save()
+
+                base = os.path.join(dpath, "catalog.base.C")
+                with open(base, "rb") as f:
+                        expected = f.read()
+                dup = catalog.Catalog(meta_root=dpath)
+                self.assertRaises(api_errors.BadCatalogSignatures,
+                    dup.apply_updates, opath)
+                with open(base, "rb") as f:
+                        self.assertEqual(f.read(), expected)
+                self.assertFalse(os.path.exists(base + ".new"))
+
+        def test_14_validate(self):
+                """Verify that catalog validation detects modified files and
+                that unchanged files aren't validated again."""
+
+                cpath = self.create_test_dir("test-14")
+                c = catalog.Catalog(meta_root=cpath, log_updates=True)
+                for f in self.c.fmris():
+                        c.add_package(f, manifest=self.__gen_manifest(f))
+                c.save()
+
+                tpath = os.path.join(cpath, "catalog.trusted")
+                self.assertFalse(os.path.exists(tpath))
+                catalog.Catalog(meta_root=cpath).validate()
+                self.assertTrue(os.path.exists(tpath))
+
+                # Parts are validated without being loaded.
+                c = catalog.Catalog(meta_root=cpath)
+                os.remove(tpath)
+                c.validate(require_signatures=True)
+                self.assertFalse(c.get_part("catalog.base.C").loaded)
+
+                # Modify a part in-place without changing its size, inode, or
+                # modification time; since it was already validated, it's
+                # trusted and not validated again.
+                pathname = os.path.join(cpath, "catalog.dependency.C")
+                st = os.stat(pathname)
+                with open(pathname, "rb+") as f:
+                        data = f.read().replace(b"foo@1.0", b"foo@1.1")
+                        f.seek(0)
+                        f.write(data)
+                os.utime(pathname, ns=(st.st_atime_ns, st.st_mtime_ns))
+                catalog.Catalog(meta_root=cpath).validate()
+
+                # Once the modification time changes, it must be validated
+                # again and the modification detected.
+                os.utime(pathname, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+                self.assertRaises(api_errors.BadCatalogSignatures,
+                    catalog.Catalog(meta_root=cpath).validate)
+
+                # The same should be true if there is no trusted state.
+                os.remove(tpath)
+                self.assertRaises(api_errors.BadCatalogSignatures,
+                    catalog.Catalog(meta_root=cpath).validate)
+
+                # Unsigned catalogs can still be validated.
+                upath = self.create_test_dir("test-14-unsigned")
+                c = catalog.Catalog(meta_root=upath, sign=False)
+                for f in self.c.fmris():
+                        c.add_package(f)
+                c.save()
+                catalog.Catalog(meta_root=upath).validate()
+
+        def test_15_interning(self):
+                """Verify that FMRIs produced by catalogs share the objects for
+                their versions, stems, and publishers."""
+
+                cpath = self.create_test_dir("test-15")
+                self.c.meta_root = cpath
+                self.c.save()
+
+                c1 = catalog.Catalog(meta_root=cpath)
+                c2 = catalog.Catalog(meta_root=cpath)
+                f1 = list(c1.fmris())
+                f2 = list(c2.fmris())
+                self.assertEqual(f1, f2)
+                for a, b in zip(f1, f2):
+                        self.assertTrue(a.version is b.version)
+                        self.assertTrue(a.pkg_name is b.pkg_name)
+                        self.assertTrue(a.publisher is b.publisher)
+
+                # The same version of a package from different publishers
+                # shares a single Version object.
+                for ver, fmris in c1.fmris_by_version("zpkg"):
+                        for f in fmris:
+                                self.assertTrue(f.version is ver)
+
+                # Modifying a FMRI parsed elsewhere must not affect those
+                # produced by the catalog.
+                f = fmri.PkgFmri(str(f1[0]))
+                f.version.timestr = None
+                self.assertTrue(f1[0].version.timestr is not None)
+                self.assertEqual(f1, list(c1.fmris()))
+
+        def test_16_bulk(self):
+                """Verify that packages added during a bulk session are added
+                and logged together when the session's journal is flushed."""
+
+                opath = self.create_test_dir("test-16-orig")
+                orig = catalog.Catalog(meta_root=opath, log_updates=True)
+                f = fmri.PkgFmri("pkg://opensolaris.org/"
+                    "base@1.0,5.11-1:20000101T120000Z")
+                orig.add_package(f, manifest=self.__gen_manifest(f))
+                orig.save()
+
+                dpath = os.path.join(self.test_root, "test-16-dup")
+                shutil.copytree(opath, dpath)
+
+                base = os.path.join(opath, "catalog.base.C")
+                st = os.stat(base)
+                orig.begin_bulk()
+                fmris = [
+                    fmri.PkgFmri("pkg://opensolaris.org/{0}@1.{1:d},5.11-1:"
+                        "20000101T120000Z".format(stem, i))
+                    for i in range(5)
+                    for stem in ("apkg", "zpkg")
+                ]
+                for f in fmris:
+                        orig.add_package(f, manifest=self.__gen_manifest(f))
+
+                # Packages are journaled until flushed.
+                self.assertEqual(orig.package_version_count, 1)
+                self.assertEqual(orig.get_entry(fmris[0]), None)
+                self.assertEqual(os.stat(base).st_mtime_ns, st.st_mtime_ns)
+                self.assertRaises(api_errors.DuplicateCatalogEntry,
+                    orig.add_package, fmris[0])
+                self.assertRaises(api_errors.DuplicateCatalogEntry,
+                    orig.add_package, fmri.PkgFmri("pkg://opensolaris.org/"
+                    "base@1.0,5.11-1:20000101T120000Z"))
+
+                orig.end_bulk()
+                self.assertEqual(orig.package_version_count, 11)
+                orig = catalog.Catalog(meta_root=opath)
+                orig.validate()
+                self.assertEqual(orig.package_version_count, 11)
+                for f in fmris:
+                        self.assertNotEqual(orig.get_entry(f), None)
+                        self.assertTrue(orig.get_entry(f,
+                            info_needed=[orig.DEPENDENCY])["actions"])
+
+                # All of the packages are logged as a single change.
+                times = set()
+                for name in orig.updates:
+                        ulog = catalog.CatalogUpdate(name, meta_root=opath)
+                        for f, op_type, op_time, md in ulog.updates():
+                                if f.pkg_name != "base":
+                                        times.add(op_time)
+                self.assertEqual(len(times), 1)
+                self.assertEqual(times.pop(), orig.last_modified)
+
+                # Clients can apply the change incrementally.
+                dup = catalog.Catalog(meta_root=dpath)
+                dup.apply_updates(opath)
+                self.assertEqual(sorted(dup.fmris()), sorted(orig.fmris()))
+
+                # Removing a package during a session flushes the journal
+                # first.
+                orig = catalog.Catalog(meta_root=opath, log_updates=True)
+                orig.begin_bulk()
+                f = fmri.PkgFmri("pkg://opensolaris.org/"
+                    "bpkg@1.0,5.11-1:20000101T120000Z")
+                orig.add_package(f)
+                orig.remove_package(f)
+                orig.end_bulk()
+                self.assertEqual(orig.get_entry(f), None)
+                self.assertEqual(orig.package_version_count, 11)
+
+        def test_17_repository_reload(self):
+                """Verify that a read-only repository keeps its loaded catalog
+                until a new version of it is published, and then loads the
+                new one."""
+
+                rpath = os.path.join(self.test_root, "test-17")
+                repo = sr.repository_create(rpath, properties={
+                    "publisher": { "prefix": "test" } })
+
+                def publish(pfmri):
+                        trans_id = repo.open("0.5.11", pfmri)
+                        repo.add(trans_id, pkg.actions.fromstr(
+                            "set name=pkg.summary value=test"))
+                        repo.close(trans_id)
+
+                publish("pkg://test/apkg@1.0")
+                ro_repo = sr.Repository(root=rpath, read_only=True)
+                cat = ro_repo.get_catalog("test")
+                self.assertEqual(cat.names(), set(["apkg"]))
+
+                # The catalog is unchanged, so the loaded one is used.
+                self.assertTrue(ro_repo.get_catalog("test") is cat)
+                self.assertTrue(ro_repo.get_catalog("test") is cat)
+
+                # Once another process has published a new version of the
+                # catalog, it's loaded instead.
+                publish("pkg://test/zpkg@1.0")
+                new_cat = ro_repo.get_catalog("test")
+                self.assertTrue(new_cat is not cat)
+                self.assertEqual(new_cat.names(), set(["apkg", "zpkg"]))
+                self.assertTrue(ro_repo.get_catalog("test") is new_cat)
+
         def test_legacy_description(self):
                 """Test that gen_packages does not traceback when a package
                 uses the legacy style of declaring package description metadata."""
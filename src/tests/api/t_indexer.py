@@ -28,12 +28,18 @@ if __name__ == "__main__":
 import pkg5unittest
 
 import unittest
+import pkg.fmri as fmri
 import pkg.indexer as indexer
+import pkg.query_parser as qp
 import pkg.search_errors as se
+import pkg.search_storage as ss
+import pkg.server.query_parser as sqp
+from pkg.choose import choose
 
 import os
 import sys
 import tempfile
+import threading
 import stat
 import shutil
 
@@ -75,6 +81,29 @@ class TestIndexer(pkg5unittest.Pkg5TestCase):
 
                 return ind
 
+        def __make_manifests(self, count, start=0):
+                """Writes manifests for 'count' packages and returns a
+                dictionary mapping their fmris to the manifest paths."""
+
+                mdir = os.path.join(self.test_root, "manifests")
+                if not os.path.exists(mdir):
+                        os.mkdir(mdir)
+                paths = {}
+                for i in range(start, start + count):
+                        pfmri = fmri.PkgFmri("pkg:/pkg{0:d}@1.{1:d},"
+                            "5.11-0:20200101T000000Z".format(i % 7, i))
+                        paths[pfmri] = os.path.join(mdir, str(i))
+                        with open(paths[pfmri], "w") as fh:
+                                fh.write("set name=pkg.fmri value={0}\n"
+                                    "set name=pkg.summary value=\"package "
+                                    "{1:d}\"\n".format(pfmri, i % 5))
+                                for j in range(i % 6):
+                                        fh.write("file {0} path=usr/lib/"
+                                            "lib{1:d}.so.{2:d} mode=0444 "
+                                            "owner=root group=bin\n".format(
+                                            "a" * 40, j, i))
+                return paths
+
         def test_indexworkingsize(self):
                 """Verify indexer sort_file_max_size works as expected."""
 
@@ -108,6 +137,536 @@ class TestIndexer(pkg5unittest.Pkg5TestCase):
                         self.assertTrue(len(open(os.path.join(ind._tmp_dir,
                             file)).readlines()) <= 1)
 
+        def test_token_index(self):
+                """Verify that the binary token index finds the offsets of
+                exact and glob matches."""
+
+                toks = ["Foo", "bar", "baz", "foo", "fooBar", "food",
+                    "\u0131nstall", "install", "\u00e9t\u00e9", "zebra"]
+                ti = ss.IndexStoreTokenIndex(ss.TOKEN_INDEX_FILE)
+                for i, tok in enumerate(sorted(toks)):
+                        ti.add_entity(tok, i * 10, i)
+                ti.write_dict_file(self.test_root, 3)
+
+                ti = ss.IndexStoreTokenIndex(ss.TOKEN_INDEX_FILE)
+                self.assertEqual(ti.open(self.test_root), 3)
+                ti.read_dict_file()
+                ti.close_file_handle()
+
+                entries = dict(
+                    (tok, (i * 10, i)) for i, tok in enumerate(sorted(toks)))
+                for tok in toks:
+                        self.assertEqual(ti.get_entry(tok), entries[tok])
+                for tok in ("FOO", "ba", "install2", "\u00e9t"):
+                        self.assertEqual(ti.get_entry(tok), None)
+
+                for pat in ("foo*", "FOO*", "ba?", "I*", "\u00c9*", "*a*",
+                    "z[a-f]bra"):
+                        prefix = qp.TermQuery.glob_prefix.match(pat).group()
+                        cands = dict((t, (o, c))
+                            for t, o, c in ti.gen_candidates(prefix))
+                        for t in cands:
+                                self.assertEqual(cands[t], entries[t])
+                        for cs in (True, False):
+                                self.assertEqualDiff(
+                                    sorted(choose(toks, pat, cs)),
+                                    sorted(choose(cands, pat, cs)))
+
+                # An index without the optional token index is still
+                # consistent.
+                os.unlink(os.path.join(self.test_root, ss.TOKEN_INDEX_FILE))
+                fo = ss.IndexStoreSet(ss.FULL_FMRI_FILE)
+                fo.write_dict_file(self.test_root, 3)
+                ti = ss.IndexStoreTokenIndex(ss.TOKEN_INDEX_FILE)
+                self.assertEqual(
+                    ss.consistent_open([fo, ti], self.test_root), 3)
+                fo.close_file_handle()
+                # Reading a mapped file which couldn't be opened reports an
+                # inconsistent index.
+                self.assertTrue(ti.should_reread())
+                self.assertRaises(se.InconsistentIndexException,
+                    ti.read_dict_file)
+
+        def test_token_trigrams(self):
+                """Verify that the token trigram index finds every token
+                which matches a glob that doesn't begin with literal
+                characters."""
+
+                toks = ["Foo", "bar", "baz", "foo", "fooBar", "food",
+                    "\u0131nstall", "install", "\u00e9t\u00e9", "zebra",
+                    "SUNWcs", "libfoo.so.1", "ab", "abc"]
+                ti = ss.IndexStoreTokenIndex(ss.TOKEN_INDEX_FILE)
+                tg = ss.IndexStoreTokenTrigrams(ss.TOKEN_TRIGRAMS_FILE)
+                for i, tok in enumerate(sorted(toks)):
+                        ti.add_entity(tok, i * 10, i)
+                        tg.add_entity(tok)
+                ti.write_dict_file(self.test_root, 3)
+                tg.write_dict_file(self.test_root, 3)
+
+                ti = ss.IndexStoreTokenIndex(ss.TOKEN_INDEX_FILE)
+                tg = ss.IndexStoreTokenTrigrams(ss.TOKEN_TRIGRAMS_FILE)
+                self.assertEqual(ss.consistent_open([ti, tg], self.test_root),
+                    3)
+                ti.read_dict_file()
+                tg.read_dict_file()
+                ti.close_file_handle()
+                tg.close_file_handle()
+
+                # Globs without three literal characters in a row can't be
+                # narrowed using trigrams.
+                self.assertEqual(tg.get_ids(["", "ab", "c"]), None)
+                self.assertEqual(tg.get_ids(["", "xyz", ""]), [])
+
+                for pat in ("*foo*", "*FOO", "*a?bar", "?oob[a-z]*", "*ebr*",
+                    "*nstall", "*bar", "*.so.*", "[Ss]unwcs", "*[*]foo*"):
+                        ids = tg.get_ids(qp.TermQuery.glob_special.split(pat))
+                        self.assertTrue(ids is not None, pat)
+                        cands = set(t
+                            for t, o, c in ti.gen_trigram_candidates(ids))
+                        for cs in (True, False):
+                                self.assertEqualDiff(
+                                    sorted(choose(toks, pat, cs)),
+                                    sorted(choose(cands, pat, cs)))
+                        # Only the tokens containing the trigrams are
+                        # candidates.
+                        self.assertTrue(len(cands) < len(toks), pat)
+
+        def test_packed_fmri_offsets(self):
+                """Verify that packed fmri offsets are read back correctly,
+                whatever the size of the differences between them, and that
+                indexes are written with them."""
+
+                class Trans(object):
+                        def get_entity(self, p_id):
+                                return fmri.PkgFmri(
+                                    "pkg:/p{0:d}@1.0".format(p_id))
+
+                sets = {
+                    0: [5],
+                    1: [0, 1, 2, 255],
+                    2: [10, 300, 301],
+                    3: [7, 70000, 2 ** 33, 2 ** 40 + 3],
+                    4: [0, 1, 2, 255],
+                }
+                fo = ss.InvertedDictPacked(ss.PACKED_FMRI_OFFSETS_FILE,
+                    Trans())
+                for p_id, offs in sets.items():
+                        for o in reversed(offs):
+                                fo.add_pair(p_id, o)
+                fo.write_dict_file(self.test_root, 3)
+
+                fo = ss.InvertedDictPacked(ss.PACKED_FMRI_OFFSETS_FILE, None)
+                self.assertEqual(fo.open(self.test_root), 3)
+                fo.read_dict_file()
+                fo.close_file_handle()
+                for p_id, offs in sets.items():
+                        name = "p{0:d}@".format(p_id)
+                        self.assertEqual(
+                            fo.get_offsets(lambda p: p.startswith(name)),
+                            set(offs))
+                self.assertEqual(fo.get_offsets(lambda p: False), set())
+
+                paths = self.__make_manifests(3)
+                index_dir = os.path.join(self.test_root, "index")
+                os.mkdir(index_dir)
+                ind = indexer.Indexer(index_dir, None, paths.get)
+                ind.server_update_index(list(paths))
+                self.assertTrue(os.path.exists(os.path.join(index_dir,
+                    ss.PACKED_FMRI_OFFSETS_FILE)))
+                self.assertFalse(os.path.exists(os.path.join(index_dir,
+                    ss.FMRI_OFFSETS_FILE)))
+
+        def test_legacy_fmri_offsets(self):
+                """Verify that an index with the fmri_offsets.v1 file written
+                before the packed file was introduced is still consistent and
+                can be searched and updated."""
+
+                paths = self.__make_manifests(20)
+                index_dir = os.path.join(self.test_root, "index")
+                os.mkdir(index_dir)
+                ind = indexer.Indexer(index_dir, None, paths.get)
+                ind.server_update_index(list(paths))
+
+                def search(text):
+                        l = sqp.QueryLexer()
+                        l.build()
+                        query = sqp.QueryParser(l).parse(text)
+                        query.set_info(num_to_return=None, start_point=None,
+                            index_dir=index_dir, get_manifest_path=paths.get,
+                            case_sensitive=False)
+                        return sorted((str(pfmri), fv, l)
+                            for v, rt, (pfmri, fv, l) in query.search(
+                            lambda: list(paths)))
+
+                full = search("*.so.1*")
+                self.assertTrue(full)
+
+                # Replace the packed file with the text version.
+                fo = ss.InvertedDictPacked(ss.PACKED_FMRI_OFFSETS_FILE, None)
+                version = fo.open(index_dir)
+                fo.read_dict_file()
+                fo.close_file_handle()
+                with open(os.path.join(index_dir, ss.FMRI_OFFSETS_FILE),
+                    "w") as fh:
+                        fh.write("VERSION: {0:d}\n".format(version))
+                        for fmris, offs in fo._dict.items():
+                                fh.write("{0}!{1}\n".format(fmris,
+                                    ss.InvertedDict._encode_offsets(
+                                    fo._decode_offsets(offs))))
+                os.unlink(os.path.join(index_dir,
+                    ss.PACKED_FMRI_OFFSETS_FILE))
+
+                ind = indexer.Indexer(index_dir, None, paths.get)
+                ind._file_timeout_secs = 1
+                self.assertEqual(ind.check_index_existence(), version)
+                self.assertEqual(search("*.so.1*"), full)
+
+                # Updating the index replaces the text file with the packed
+                # one.
+                paths.update(self.__make_manifests(5, start=20))
+                ind.server_update_index(list(paths)[20:])
+                self.assertTrue(os.path.exists(os.path.join(index_dir,
+                    ss.PACKED_FMRI_OFFSETS_FILE)))
+                self.assertFalse(os.path.exists(os.path.join(index_dir,
+                    ss.FMRI_OFFSETS_FILE)))
+                self.assertEqual(ind.check_index_existence(), version + 1)
+                self.assertEqual(len(search("lib3.so.22")), 1)
+                self.assertEqual(search("*.so.1*"), full)
+
+        def test_search_limit(self):
+                """Verify that searches return the requested window of results
+                and stop searching the index once it has been returned."""
+
+                paths = self.__make_manifests(20)
+                index_dir = os.path.join(self.test_root, "index")
+                os.mkdir(index_dir)
+                ind = indexer.Indexer(index_dir, None, paths.get)
+                ind.server_update_index(list(paths))
+
+                def search(text, num_to_return=None, start_point=None):
+                        l = sqp.QueryLexer()
+                        l.build()
+                        query = sqp.QueryParser(l).parse(text)
+                        query.set_info(num_to_return=num_to_return,
+                            start_point=start_point, index_dir=index_dir,
+                            get_manifest_path=paths.get,
+                            case_sensitive=False)
+                        return query, query.search(lambda: list(paths))
+
+                for text in ("lib*", "pkg.summary:* OR *.so.*"):
+                        query, res = search(text)
+                        full = list(res)
+                        self.assertTrue(len(full) > 10)
+                        for num, start in ((3, None), (3, 4), (None, 8),
+                            (0, 2), (5, len(full) - 2)):
+                                query, res = search(text, num, start)
+                                self.assertEqual(list(res),
+                                    full[start or 0:][:num])
+
+                # A negative window is rejected.
+                for s in ("False_2_-1_None_lib*", "False_2_None_-3_lib*",
+                    "False_2_2_-1_lib*"):
+                        self.assertRaises(qp.DetailedValueError,
+                            sqp.Query.fromstr, s)
+                self.assertRaises(qp.DetailedValueError, sqp.Query, "lib*",
+                    False, sqp.Query.RETURN_ACTIONS, -1, None)
+
+                # A search which has returned the requested results has
+                # closed the index, as has one which was abandoned.
+                query, res = search("lib*", 1)
+                self.assertEqual(len(list(res)), 1)
+                self.assertEqual(
+                    query.query._data_main_dict.get_file_handle(), None)
+                query, res = search("lib*")
+                next(res)
+                self.assertNotEqual(
+                    query.query._data_main_dict.get_file_handle(), None)
+                res.close()
+                self.assertEqual(
+                    query.query._data_main_dict.get_file_handle(), None)
+
+        def test_query_plan(self):
+                """Verify that the number of results for each token is
+                recorded and used to search the more selective side of an AND
+                query first, and that the other side only searches the
+                packages it found."""
+
+                paths = self.__make_manifests(20)
+                index_dir = os.path.join(self.test_root, "index")
+                os.mkdir(index_dir)
+                ind = indexer.Indexer(index_dir, None, paths.get)
+                ind.server_update_index(list(paths))
+
+                # The packages whose manifests results were read from.
+                read = set()
+                def get_manifest_path(pfmri):
+                        read.add(str(pfmri))
+                        return paths[pfmri]
+
+                def parse(text):
+                        l = sqp.QueryLexer()
+                        l.build()
+                        query = sqp.QueryParser(l).parse(text)
+                        query.set_info(num_to_return=None, start_point=None,
+                            index_dir=index_dir,
+                            get_manifest_path=get_manifest_path,
+                            case_sensitive=False)
+                        return query
+
+                def search(text, return_type=qp.Query.RETURN_ACTIONS):
+                        query = parse(text)
+                        if return_type == qp.Query.RETURN_PACKAGES:
+                                query.propagate_pkg_return()
+                        return query, sorted(query.search(lambda: list(paths)),
+                            key=str)
+
+                # The estimate for a term is the number of results it has.
+                for text in ("package", "lib*", "lib3.so.15", "nomatch"):
+                        query, res = search(text)
+                        self.assertEqual(query.query.estimate_cost(),
+                            len(res))
+                query, res = search("*")
+                self.assertEqual(query.query.estimate_cost(), None)
+
+                # When packages are returned, either order of the children
+                # finds the same results, and the child with fewer results is
+                # searched first.
+                for a, b in (("package", "lib3.so.1*"), ("lib*", "nomatch"),
+                    ("*", "lib1*")):
+                        rt = qp.Query.RETURN_PACKAGES
+                        q1, r1 = search("{0} AND {1}".format(a, b), rt)
+                        q2, r2 = search("{0} AND {1}".format(b, a), rt)
+                        self.assertEqual(r1, r2)
+                        and_query = q1.query
+                        self.assertTrue(and_query._plan()[0] is and_query.rc)
+
+                # When actions are returned, the right child filters the
+                # results of the left one, so the children are searched in
+                # the order given even if the right one is more selective.
+                for text in ("path:/usr/lib/lib3* AND lib3.so.16",
+                    "lib3.so.16 AND path:/usr/lib/lib3*",
+                    "package AND lib3.so.1*"):
+                        query, res = search(text)
+                        query = parse(text)
+                        and_query = query.query
+                        expected = sorted(query.finalize_results(
+                            and_query.rc.search(and_query.lc.search(None,
+                            lambda: list(paths)), lambda: list(paths))),
+                            key=str)
+                        self.assertEqual(res, expected)
+                query, res = search("path:/usr/lib/lib3* AND lib3.so.16")
+                self.assertTrue(query.query.rc.estimate_cost() <
+                    query.query.lc.estimate_cost())
+                self.assertEqual(len(res), 1)
+
+                # Only the packages found by the more selective child are
+                # searched by the other, whichever the order of the children
+                # and the type of the results.
+                def limits(q):
+                        if hasattr(q, "lc"):
+                                return [q._pfmris] + limits(q.lc) + \
+                                    limits(q.rc)
+                        if hasattr(q, "query"):
+                                return limits(q.query)
+                        return [q._pfmris]
+
+                pkg16 = [str(f) for f in paths if str(f.version).startswith(
+                    "1.16,")]
+                texts = ["* AND lib3.so.16", "lib* AND lib3.so.16",
+                    "lib3.so.16 AND lib*", "(lib* AND *) AND lib3.so.16",
+                    "lib3.so.16 AND (lib* OR package)"]
+                for rt, texts in ((qp.Query.RETURN_ACTIONS, texts),
+                    (qp.Query.RETURN_PACKAGES, texts + [
+                    "package AND lib3.so.16", "lib3.so.16 AND package"])):
+                        for text in texts:
+                                read.clear()
+                                query, res = search(text, rt)
+                                if rt == qp.Query.RETURN_ACTIONS:
+                                        found = set(str(r[2][0]) for r in res)
+                                else:
+                                        found = set(str(r[2]) for r in res)
+                                self.assertEqual(sorted(found), pkg16)
+                                self.assertEqual(sorted(read), pkg16)
+                                # The limit on the packages searched is
+                                # removed once the search is done.
+                                self.assertEqual(set(limits(query)),
+                                    set([None]))
+
+        def test_missing_token_trigrams(self):
+                """Verify that an index without the optional token trigram
+                file can still be searched."""
+
+                paths = self.__make_manifests(20)
+                index_dirs = []
+                for name in ("index", "index_no_trigrams"):
+                        index_dir = os.path.join(self.test_root, name)
+                        os.mkdir(index_dir)
+                        ind = indexer.Indexer(index_dir, None, paths.get)
+                        ind.server_update_index(list(paths))
+                        index_dirs.append(index_dir)
+
+                def search(index_dir, text):
+                        l = sqp.QueryLexer()
+                        l.build()
+                        query = sqp.QueryParser(l).parse(text)
+                        query.set_info(num_to_return=None, start_point=None,
+                            index_dir=index_dir, get_manifest_path=paths.get,
+                            case_sensitive=False)
+                        return sorted((str(pfmri), fv, l)
+                            for v, rt, (pfmri, fv, l) in query.search(
+                            lambda: list(paths)))
+
+                # The trigram file is removed both from an index which has
+                # already been searched and from one which hasn't.
+                index_dir = index_dirs[0]
+                full = search(index_dir, "*.so.1*")
+                self.assertTrue(full)
+                for d in index_dirs:
+                        os.unlink(os.path.join(d, ss.TOKEN_TRIGRAMS_FILE))
+                        self.assertEqual(search(d, "*.so.1*"), full)
+                        self.assertEqual(len(search(d, "lib3.so.16")), 1)
+
+        def test_parallel_rebuild(self):
+                """Verify that tokenizing manifests using several processes
+                produces the same index as doing so in one."""
+
+                paths = self.__make_manifests(40)
+                # Verify errors from the processes are logged.
+                os.unlink(paths[sorted(paths)[11]])
+
+                def canonical(val):
+                        if isinstance(val, list):
+                                return sorted(canonical(v) for v in val)
+                        if isinstance(val, tuple):
+                                return tuple(canonical(v) for v in val)
+                        return str(val)
+
+                def build(max_workers, name="index"):
+                        index_dir = os.path.join(self.test_root,
+                            "{0}{1:d}".format(name, max_workers))
+                        os.mkdir(index_dir)
+                        msgs = []
+                        ind = indexer.Indexer(index_dir, None, paths.get,
+                            log=msgs.append, sort_file_max_size=512,
+                            max_workers=max_workers)
+                        ind.server_update_index(sorted(paths))
+                        res = {}
+                        for name in os.listdir(index_dir):
+                                if name == "lock":
+                                        continue
+                                with open(os.path.join(index_dir, name),
+                                    "rb") as fh:
+                                        res[name] = fh.read()
+                        # The order in which the packages for a token are
+                        # listed depends on how the tokens were split into
+                        # temporary files.
+                        res[ss.MAIN_FILE] = [
+                            canonical(ss.IndexStoreMainDict.parse_main_dict_line(
+                                l))
+                            for l in res[ss.MAIN_FILE].decode().splitlines()
+                        ]
+                        return res, len(msgs)
+
+                def build_threaded(max_workers):
+                        # Build while another thread is running.
+                        res = []
+                        t = threading.Thread(target=lambda:
+                            res.append(build(max_workers, "threaded")))
+                        t.start()
+                        t.join()
+                        return res[0]
+
+                pool_sizes = []
+                process_parallel = \
+                    indexer.Indexer._Indexer__process_fmris_parallel
+                def record_parallel(ind, fmris):
+                        pool_sizes.append(ind.max_workers)
+                        return process_parallel(ind, fmris)
+
+                min_pkgs = indexer.PARALLEL_INDEX_MIN_PKGS
+                indexer.PARALLEL_INDEX_MIN_PKGS = 1
+                indexer.Indexer._Indexer__process_fmris_parallel = \
+                    record_parallel
+                try:
+                        serial = build(1)
+                        parallel = build(3)
+                        threaded = build_threaded(3)
+                finally:
+                        indexer.PARALLEL_INDEX_MIN_PKGS = min_pkgs
+                        indexer.Indexer._Indexer__process_fmris_parallel = \
+                            process_parallel
+                # Processes are only forked when no other threads are
+                # running.
+                self.assertEqual(pool_sizes, [3])
+                for res in (parallel, threaded):
+                        self.assertEqual(serial[1], 1)
+                        self.assertEqual(res[1], 1)
+                        self.assertEqual(sorted(serial[0]), sorted(res[0]))
+                        for name in serial[0]:
+                                self.assertEqual(serial[0][name],
+                                    res[0][name], name)
+
+        def test_index_segments(self):
+                """Verify that packages can be indexed in delta segments and
+                that the segments can be merged into the index."""
+
+                paths = self.__make_manifests(10)
+                new_paths = self.__make_manifests(6, start=10)
+                last_paths = self.__make_manifests(1, start=16)
+                all_paths = dict(paths)
+                all_paths.update(new_paths)
+                all_paths.update(last_paths)
+
+                class Catalog(object):
+                        def fmris(self):
+                                return iter(all_paths)
+
+                index_dir = os.path.join(self.test_root, "index")
+
+                def get_indexer():
+                        return indexer.Indexer(index_dir, None, all_paths.get)
+
+                get_indexer().server_update_index(sorted(paths))
+                self.assertEqual(indexer.Indexer.get_segment_dirs(index_dir),
+                    [])
+
+                new_fmris = sorted(new_paths)
+                gens = set([indexer.Indexer.get_generation(index_dir)])
+                for i in range(3):
+                        get_indexer().server_add_segment(
+                            new_fmris[i * 2:i * 2 + 2])
+                        gens.add(indexer.Indexer.get_generation(index_dir))
+                # The generation of the index changes with each segment.
+                self.assertEqual(len(gens), 4)
+                seg_dirs = indexer.Indexer.get_segment_dirs(index_dir)
+                self.assertEqual([os.path.basename(d) for d in seg_dirs],
+                    ["0", "1", "2"])
+                self.assertEqual(
+                    indexer.Indexer.check_for_updates(index_dir, Catalog()),
+                    set(last_paths))
+
+                # Packages are only added to a segment when rewriting the
+                # index would be costly.
+                self.assertEqual(get_indexer().server_update_index_segmented(
+                    list(last_paths)), False)
+                self.assertEqual(len(indexer.Indexer.get_segment_dirs(
+                    index_dir)), 3)
+                self.assertEqual(
+                    indexer.Indexer.check_for_updates(index_dir, Catalog()),
+                    set())
+
+                get_indexer().server_merge_segments()
+                self.assertEqual(indexer.Indexer.get_segment_dirs(index_dir),
+                    [])
+                self.assertTrue(indexer.Indexer.get_generation(index_dir)
+                    not in gens)
+                data = ss.IndexStoreSet(ss.FULL_FMRI_FILE)
+                data.open(index_dir)
+                data.read_dict_file()
+                data.close_file_handle()
+                self.assertEqual(sorted(data.get_set()),
+                    sorted(f.get_fmri(anarchy=True) for f in all_paths))
+
 if __name__ == "__main__":
         unittest.main()
 
@@ -26,6 +26,7 @@
 import unittest
 import tempfile
 import os
+import shutil
 import six
 import sys
 import types
@@ -371,6 +372,70 @@ dir mode=0755 owner=bin group=sys path=usr
                                 #print(" {0} {1}".format(kv, a))
                 self.assertEqual(acount, 3)
 
+        def test_lazy(self):
+                """Verify that manifests loaded lazily have the same content
+                as those loaded eagerly and only create actions as needed."""
+
+                dups = self.diverse_contents + """\
+dir mode=0755 owner=root group=sys path=/usr
+dir mode=0755 owner=root group=root path=usr
+dir owner=root path="opt/dir with spaces in value" group=bin mode=0700
+file 12345 mode=0555 owner=sch group=staff path=/usr/bin/i386/sort
+"""
+                for content in (self.m2_contents, self.diverse_contents, dups):
+                        eager = manifest.Manifest()
+                        eager.set_content(content)
+                        lazy = manifest.Manifest()
+                        lazy.set_content(content, lazy=True)
+
+                        # Package attributes are available immediately.
+                        self.assertEqual(eager.attributes, lazy.attributes)
+
+                        self.assertEqualDiff(
+                            sorted(eager.gen_key_attribute_value_by_type(
+                                "dir")),
+                            sorted(lazy.gen_key_attribute_value_by_type(
+                                "dir")))
+                        self.assertEqualDiff(
+                            sorted((k, sorted(str(a) for a in d))
+                                for k, d in eager.duplicates()),
+                            sorted((k, sorted(str(a) for a in d))
+                                for k, d in lazy.duplicates()))
+                        self.assertEqualDiff(
+                            [str(a) for a in eager.gen_actions_by_type("file")],
+                            [str(a) for a in lazy.gen_actions_by_type("file")])
+                        self.assertEqualDiff(
+                            "".join(eager.as_lines()),
+                            "".join(lazy.as_lines()))
+                        self.assertEqual(sorted(eager.actions_bytype),
+                            sorted(lazy.actions_bytype))
+
+                # Only actions of the requested type are created.
+                m = manifest.Manifest()
+                m.set_content(self.diverse_contents + "file 1234 path=foo bar\n",
+                    lazy=True)
+                self.assertEqual(len(list(m.gen_actions_by_type("dir"))), 3)
+                self.assertRaises(api_errors.InvalidPackageErrors, list,
+                    m.gen_actions_by_type("file"))
+
+                # Excludes are applied as actions are created.
+                v = variant.Variants({ "variant.arch": "sparc" })
+                excludes = [v.allow_action, lambda x, publisher: True]
+                eager = manifest.Manifest()
+                eager.set_content(self.diverse_contents, excludes=excludes)
+                lazy = manifest.Manifest()
+                lazy.set_content(self.diverse_contents, excludes=excludes,
+                    lazy=True)
+                self.assertEqualDiff(
+                    [str(a) for a in eager.gen_actions_by_type("dir")],
+                    [str(a) for a in lazy.gen_actions_by_type("dir")])
+                self.assertEqualDiff("".join(eager.as_lines()),
+                    "".join(lazy.as_lines()))
+
+                # Errors in set actions are reported immediately.
+                self.assertRaises(api_errors.InvalidPackageErrors,
+                    m.set_content, "set name=foo value=\"bar", lazy=True)
+
         def test_errors(self):
                 """Test that a variety of bogus manifests raise
                 InvalidPackageErrors.
@@ -531,7 +596,8 @@ dir owner=root path=fm group=bin mode=0755 facet.multi=true \\
                 do_get_dirs()
 
                 # Now repeat experiment using "cached" FactoredManifest.
-                cfile_path = os.path.join(self.cache_dir, "manifest.dircache")
+                cfile_path = os.path.join(self.cache_dir,
+                    manifest.FactoredManifest.CACHE_NAME)
                 self.assertTrue(os.path.isfile(cfile_path))
                 m1 = manifest.FactoredManifest("foo-content@1.0", self.cache_dir,
                     pathname=self.foo_content_p5m)
@@ -545,16 +611,18 @@ dir owner=root path=fm group=bin mode=0755 facet.multi=true \\
                 m1 = manifest.FactoredManifest("foo-content@1.0", self.cache_dir,
                     pathname=self.foo_content_p5m)
 
-                with open(cfile_path, "w") as f:
-                        for a in m1.gen_actions_by_type("dir"):
-                                f.write(
-                                    "dir path={0} {1}\n".format(a.attrs["path"],
-                                        " ".join(
-                                            "{0}={1}".format(attr, a.attrs[attr])
-                                            for attr in itertools.chain(
-                                                *a.get_varcet_keys())
-                                        )
-                                ))
+                dirs = [
+                    "dir path={0} {1}\n".format(a.attrs["path"],
+                        " ".join(
+                            "{0}={1}".format(attr, a.attrs[attr])
+                            for attr in itertools.chain(*a.get_varcet_keys())
+                        )
+                    )
+                    for a in m1.gen_actions_by_type("dir")
+                ]
+                with open(cfile_path, "wb") as f:
+                        f.write(manifest._ManifestCache.dump(
+                            [("dircache", dirs)]))
 
                 # Repeat tests again.
                 do_get_dirs()
@@ -569,6 +637,203 @@ dir owner=root path=fm group=bin mode=0755 facet.multi=true \\
                 do_get_dirs()
                 self.assertTrue(os.path.isfile(cfile_path))
 
+        def test_cache_file(self):
+                """Verify that FactoredManifest stores its cached data in a
+                single file and replaces the per-action type cache files
+                written by older versions."""
+
+                m1 = manifest.FactoredManifest("foo-content@1.0",
+                    self.cache_dir, pathname=self.foo_content_p5m)
+                expected = dict(
+                    (atype, sorted(str(a) for a in m1.gen_actions_by_type(
+                        atype)))
+                    for atype in ("dir", "set")
+                )
+                self.assertEqual(os.listdir(self.cache_dir),
+                    [manifest.FactoredManifest.CACHE_NAME])
+
+                # Actions of types not found in the manifest are cached as
+                # absent.
+                m1 = manifest.FactoredManifest("foo-content@1.0",
+                    self.cache_dir, pathname=self.foo_content_p5m)
+                self.assertEqual(list(m1.gen_actions_by_type("depend")), [])
+                for atype in expected:
+                        self.assertEqualDiff(expected[atype], sorted(
+                            str(a) for a in m1.gen_actions_by_type(atype)))
+                self.assertTrue(not m1.loaded)
+
+                # Simulate a cache written by an older version.
+                portable.remove(os.path.join(self.cache_dir,
+                    manifest.FactoredManifest.CACHE_NAME))
+                for atype in ("dircache", "file", "set"):
+                        self.make_file(os.path.join(self.cache_dir,
+                            "manifest.{0}".format(atype)), "")
+                m1 = manifest.FactoredManifest("foo-content@1.0",
+                    self.cache_dir, pathname=self.foo_content_p5m)
+                self.assertEqual(os.listdir(self.cache_dir),
+                    [manifest.FactoredManifest.CACHE_NAME])
+                for atype in expected:
+                        self.assertEqualDiff(expected[atype], sorted(
+                            str(a) for a in m1.gen_actions_by_type(atype)))
+
+        def test_packed_cache(self):
+                """Verify that PackedManifestCache stores the cached data of
+                multiple manifests and that FactoredManifest uses it."""
+
+                contents = """\
+                    set name=pkg.fmri value=pkg:/bar@1
+                    set name=variant.foo value=one value=two
+                    dir path=one group=sys owner=root variant.foo=one
+                    dir path=two group=sys owner=root variant.foo=two
+                """
+                bar_p5m = self.make_misc_files({ "bar.p5m": contents })[0]
+                bar_dir = tempfile.mkdtemp(dir=self.test_root)
+                foo_dir = tempfile.mkdtemp(dir=self.test_root)
+                manifest.FactoredManifest("bar@1", bar_dir, pathname=bar_p5m)
+                manifest.FactoredManifest("foo-content@1.0", foo_dir,
+                    pathname=self.foo_content_p5m)
+                cache_dirs = {
+                    "bar@1": bar_dir,
+                    "foo-content@1.0": foo_dir,
+                    "missing@1": os.path.join(self.test_root, "missing"),
+                }
+
+                ppath = os.path.join(self.test_root, "manifest.packed")
+                packed = manifest.PackedManifestCache(ppath)
+                self.assertEqual(len(packed), 0)
+                packed.update(["bar@1", "foo-content@1.0", "missing@1"],
+                    cache_dirs.get)
+                self.assertEqual(len(packed), 2)
+                self.assertTrue("bar@1" in packed)
+                self.assertTrue("missing@1" not in packed)
+
+                # The per-package cache files are no longer needed to retrieve
+                # actions.
+                shutil.rmtree(bar_dir)
+                shutil.rmtree(foo_dir)
+                packed = manifest.PackedManifestCache(ppath)
+                m1 = manifest.FactoredManifest("bar@1", bar_dir,
+                    pathname=bar_p5m, packed=packed)
+                self.assertEqual(len(list(m1.gen_actions_by_type("dir"))), 2)
+                self.assertEqual(m1["pkg.fmri"], "pkg:/bar@1")
+                v = variant.Variants({"variant.foo":"one"})
+                m1.exclude_content([v.allow_action, lambda x, publisher: True])
+                self.assertEqual(len(list(m1.gen_actions_by_type("dir"))), 1)
+                self.assertTrue(not m1.loaded)
+                self.assertTrue(not os.path.exists(bar_dir))
+
+                # Data for packages already in the store is retained.
+                packed.update(["bar@1", "foo-content@1.0"], cache_dirs.get)
+                self.assertEqual(len(packed), 2)
+                packed.update(["foo-content@1.0"], cache_dirs.get)
+                self.assertEqual(len(packed), 1)
+                self.assertEqual(packed.get("bar@1"), None)
+                m1 = manifest.FactoredManifest("foo-content@1.0", foo_dir,
+                    pathname=self.foo_content_p5m, packed=packed)
+                self.assertEqual(len(list(m1.gen_actions_by_type("dir"))), 8)
+                self.assertTrue(not m1.loaded)
+
+        def test_cached_difference(self):
+                """Verify that the difference between FactoredManifests using
+                cached action digests matches that of a full comparison."""
+
+                old = """\
+                    set name=pkg.fmri value=pkg:/bar@1
+                    set name=variant.foo value=one value=two
+                    dir path=one group=sys owner=root variant.foo=one
+                    dir path=one group=bin owner=root variant.foo=two
+                    dir path=same group=sys owner=root mode=0755
+                    dir path=changed group=sys owner=root mode=0755
+                    dir path="with spaces" group=sys owner=root mode=0755
+                    link path=l target=one
+                    dir path=removed group=sys owner=root mode=0755
+                """
+                new = """\
+                    set name=pkg.fmri value=pkg:/bar@2
+                    set name=variant.foo value=one value=two
+                    dir path=one group=bin owner=root variant.foo=one
+                    dir path=one group=bin owner=root variant.foo=two
+                    dir mode=0755 path=same group=sys owner=root
+                    dir path=changed group=sys owner=root mode=0700
+                    dir path="with spaces" group=sys owner=root mode=0755
+                    link path=l target=same
+                    dir path=added group=sys owner=root mode=0755
+                """
+                old_p5m, new_p5m = self.make_misc_files({
+                    "old.p5m": old, "new.p5m": new })
+                old_dir = tempfile.mkdtemp(dir=self.test_root)
+                new_dir = tempfile.mkdtemp(dir=self.test_root)
+
+                def get_diff(m1, m2, excludes=misc.EmptyI):
+                        diffs = m2.difference(m1, excludes, excludes)
+                        return [
+                            sorted(
+                                (str(o), str(d))
+                                for o, d in l
+                            )
+                            for l in diffs
+                        ]
+
+                m1 = manifest.Manifest()
+                m1.set_content(pathname=old_p5m)
+                m2 = manifest.Manifest()
+                m2.set_content(pathname=new_p5m)
+                self.assertEqual(m2._get_action_digests(), None)
+
+                v = variant.Variants({"variant.foo": "one"})
+                for excludes in (misc.EmptyI,
+                    [v.allow_action, lambda x, publisher: True]):
+                        expected = get_diff(m1, m2, excludes)
+                        self.assertEqual(len(expected[1]), 4 if excludes else 3)
+
+                        f1 = manifest.FactoredManifest("bar@1", old_dir,
+                            pathname=old_p5m)
+                        f2 = manifest.FactoredManifest("bar@2", new_dir,
+                            pathname=new_p5m)
+                        self.assertEqualDiff(expected,
+                            get_diff(f1, f2, excludes))
+
+                        # Actions sharing a key are never skipped.
+                        digests = f2._get_action_digests()
+                        self.assertTrue(("dir", "same") in digests)
+                        self.assertTrue(("dir", "with spaces") in digests)
+                        self.assertTrue(("dir", "one") not in digests)
+
+                        # If the digests say the actions are the same, no
+                        # comparison is performed.
+                        f1 = manifest.FactoredManifest("bar@1", old_dir,
+                            pathname=old_p5m)
+                        f2 = manifest.FactoredManifest("bar@2", new_dir,
+                            pathname=new_p5m)
+                        list(f1.gen_actions())
+                        list(f2.gen_actions())
+                        f1._get_action_digests()[("dir", "changed")] = \
+                            f2._get_action_digests()[("dir", "changed")]
+                        self.assertEqual(len(get_diff(f1, f2, excludes)[1]),
+                            len(expected[1]) - 1)
+
+        def test_cached_digests_newline(self):
+                """Verify that the digests of actions whose key value contains
+                a newline aren't cached, since they would span lines."""
+
+                m_p5m, = self.make_misc_files({ "m.p5m": """\
+                    set name=pkg.fmri value=pkg:/bar@1
+                    dir path=same group=sys owner=root mode=0755
+                """ })
+                cache_dir = tempfile.mkdtemp(dir=self.test_root)
+                m1 = manifest.FactoredManifest("bar@1", cache_dir,
+                    pathname=m_p5m)
+                list(m1.gen_actions())
+                m1.add_action(actions.fromstr("dir path=\"new\nline one\" "
+                    "group=sys owner=root mode=0755"), misc.EmptyI)
+                self.assertEqual(len(list(m1._gen_digests_to_str())), 2)
+                m1._FactoredManifest__storebytype()
+
+                m2 = manifest.FactoredManifest("bar@1", cache_dir,
+                    pathname=m_p5m)
+                self.assertEqual(sorted(m2._get_action_digests()),
+                    [("dir", "same"), ("set", "pkg.fmri")])
+
         def test_clear_cache(self):
                 """Verify that FactoredManifest.clear_cache() works as
                 expected."""
@@ -579,7 +844,8 @@ dir owner=root path=fm group=bin mode=0755 facet.multi=true \\
                     pathname=self.foo_content_p5m)
 
                 # Verify cache was created.
-                cfile_path = os.path.join(cache_dir, "manifest.dircache")
+                cfile_path = os.path.join(cache_dir,
+                    manifest.FactoredManifest.CACHE_NAME)
                 self.assertTrue(os.path.isfile(cfile_path))
 
                 # Create random file in cache_dir.
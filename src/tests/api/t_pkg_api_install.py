@@ -1090,7 +1090,8 @@ class TestPkgApiInstall(pkg5unittest.SingleDepotTestCase):
 
                 # Verify that manifest cache file exists after install.
                 mcdir = self.get_img_manifest_cache_dir(pfmri)
-                mcpath = os.path.join(mcdir, "manifest.set")
+                mcpath = os.path.join(mcdir,
+                    manifest.FactoredManifest.CACHE_NAME)
                 assert os.path.exists(mcpath)
 
                 # Verify that manifest cache file and directories do not exist
@@ -1132,7 +1133,8 @@ class TestPkgApiInstall(pkg5unittest.SingleDepotTestCase):
                 mpath = self.get_img_manifest_path(pfmri)
                 mdir = os.path.dirname(mpath)
                 mcdir = self.get_img_manifest_cache_dir(pfmri)
-                mcpath = os.path.join(mcdir, "manifest.set")
+                mcpath = os.path.join(mcdir,
+                    manifest.FactoredManifest.CACHE_NAME)
 
                 # Install foo again, then remove manifest cache files and then
                 # verify uninstall doesn't fail.
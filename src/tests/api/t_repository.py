@@ -0,0 +1,400 @@
+#!/usr/bin/python3
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+
+from . import testutils
+if __name__ == "__main__":
+        testutils.setup_environment("../../../proto")
+import pkg5unittest
+
+import os
+import re
+import unittest
+
+import pkg.actions as actions
+import pkg.indexer as indexer
+import pkg.server.query_parser as sqp
+import pkg.server.repository as sr
+
+
+class TestRepositorySearch(pkg5unittest.Pkg5TestCase):
+        """Tests for searching the index of a server repository."""
+
+        def setUp(self):
+                pkg5unittest.Pkg5TestCase.setUp(self)
+                self.repo_dir = os.path.join(self.test_root, "repo")
+                self.repo = self.__create_repo(self.repo_dir)
+
+        @staticmethod
+        def __create_repo(repo_dir):
+                return sr.repository_create(repo_dir, properties={
+                    "publisher": { "prefix": "test" } })
+
+        def __publish(self, repo, pfmri, acts):
+                """Publishes a package with the given actions to the
+                repository and returns its fmri."""
+
+                trans_id = repo.open("0.5.11", "pkg://test/{0}".format(pfmri))
+                for a in acts:
+                        repo.add(trans_id, actions.fromstr(a))
+                return repo.close(trans_id)[0]
+
+        def __publish_pkgs(self, repo, pkgs):
+                for pfmri, words in pkgs:
+                        name = pfmri.split("@")[0]
+                        self.__publish(repo, pfmri, [
+                            "set name=pkg.summary value=\"{0}\"".format(words),
+                            "dir path=usr/share/{0} mode=0755 owner=root "
+                            "group=bin".format(name)])
+                repo.refresh_index()
+
+        @staticmethod
+        def __search(repo, text, return_type=sqp.Query.RETURN_ACTIONS,
+            num_to_return=None, start_point=None):
+                """Returns the results of the search as a list of strings, in
+                the order the repository returned them."""
+
+                query = sqp.Query(text, False, return_type, num_to_return,
+                    start_point)
+                res = []
+                for v, rt, val in repo.search([query])[0]:
+                        if rt == sqp.Query.RETURN_ACTIONS:
+                                pfmri, fv, l = val
+                                res.append(" ".join((str(pfmri), fv,
+                                    l.strip())))
+                        else:
+                                res.append(str(val))
+                return res
+
+        def test_search_segments(self):
+                """Verify that searches combine the results from the index and
+                its delta segments without duplicates, and that the requested
+                window applies to the combined results."""
+
+                base_pkgs = [
+                    ("alpha@1.0", "common first"),
+                    ("beta@1.0", "common second"),
+                    ("gamma@1.0", "other"),
+                ]
+                seg_pkgs = [
+                    [("alpha@2.0", "common updated"),
+                    ("delta@1.0", "common fourth")],
+                    [("epsilon@1.0", "common updated")],
+                ]
+
+                # Packages published after the index reaches the minimum size
+                # are added to delta segments.
+                self.__publish_pkgs(self.repo, base_pkgs)
+                min_size = indexer.MIN_SEGMENTED_INDEX_SIZE
+                indexer.MIN_SEGMENTED_INDEX_SIZE = 0
+                try:
+                        for pkgs in seg_pkgs:
+                                self.__publish_pkgs(self.repo, pkgs)
+                finally:
+                        indexer.MIN_SEGMENTED_INDEX_SIZE = min_size
+                index_root = os.path.join(self.repo_dir, "publisher", "test",
+                    "index")
+                seg_dirs = indexer.Indexer.get_segment_dirs(index_root)
+                self.assertEqual(len(seg_dirs), 2)
+
+                # The same packages published to a repository whose index
+                # has no segments are the reference for the results.
+                ref_repo = self.__create_repo(os.path.join(self.test_root,
+                    "ref_repo"))
+                self.__publish_pkgs(ref_repo, base_pkgs + seg_pkgs[0] +
+                    seg_pkgs[1])
+
+                def strip_ts(res):
+                        # The packages in the two repositories were published
+                        # at different times.
+                        return sorted(re.sub(r":\d{8}T\d{6}Z", "", r)
+                            for r in res)
+
+                for text in ("common", "updated", "alpha", "usr/share/*",
+                    "other", "nomatch"):
+                        for rt in (sqp.Query.RETURN_ACTIONS,
+                            sqp.Query.RETURN_PACKAGES):
+                                res = self.__search(self.repo, text, rt)
+                                self.assertEqual(len(res), len(set(res)))
+                                self.assertEqualDiff(
+                                    strip_ts(self.__search(ref_repo, text,
+                                    rt)), strip_ts(res))
+
+                # Both versions of the updated package are found, but only
+                # the new one has the new value.
+                res = self.__search(self.repo, "alpha",
+                    sqp.Query.RETURN_PACKAGES)
+                self.assertEqual([r.split(",")[0] for r in res],
+                    ["pkg:/alpha@1.0", "pkg:/alpha@2.0"])
+                res = self.__search(self.repo, "updated",
+                    sqp.Query.RETURN_PACKAGES)
+                self.assertEqual([r.split(",")[0] for r in res],
+                    ["pkg:/alpha@2.0", "pkg:/epsilon@1.0"])
+
+                # The requested window of the combined results is returned.
+                full = self.__search(self.repo, "common")
+                self.assertEqual(len(full), 5)
+                for num, start in ((2, None), (2, 2), (None, 3), (0, 1),
+                    (3, 4), (1, 5), (None, 10)):
+                        self.assertEqual(self.__search(self.repo, "common",
+                            num_to_return=num, start_point=start),
+                            full[start or 0:][:num])
+
+                # While segments are being merged, their packages are in
+                # both the index and the segments, but are only returned
+                # once.
+                pfmris = [
+                    f for f in self.repo.get_catalog("test").fmris()
+                    if f.pkg_name in ("delta", "epsilon") or
+                    str(f.version).startswith("2.0")
+                ]
+                self.assertEqual(len(pfmris), 3)
+                rstore = self.repo.get_pub_rstore("test")
+                indexer.Indexer(index_root, None,
+                    rstore.manifest).server_update_index(pfmris)
+                self.repo.reset_search()
+                self.assertEqual(indexer.Indexer.get_segment_dirs(index_root),
+                    seg_dirs)
+                self.assertEqual(self.__search(self.repo, "common"), full)
+                self.assertEqual(self.__search(self.repo, "common",
+                    num_to_return=2, start_point=3), full[3:5])
+
+        def test_search_cache_generation(self):
+                """Verify that cached search results aren't returned once the
+                index has been updated."""
+
+                self.__publish_pkgs(self.repo, [("alpha@1.0", "common")])
+                self.assertEqual(len(self.__search(self.repo, "common")), 1)
+                # The second search is answered from the cache.
+                self.assertEqual(len(self.__search(self.repo, "common")), 1)
+
+                self.__publish_pkgs(self.repo, [("beta@1.0", "common")])
+                self.assertEqual(len(self.__search(self.repo, "common")), 2)
+
+                min_size = indexer.MIN_SEGMENTED_INDEX_SIZE
+                indexer.MIN_SEGMENTED_INDEX_SIZE = 0
+                try:
+                        self.__publish_pkgs(self.repo,
+                            [("gamma@1.0", "common")])
+                finally:
+                        indexer.MIN_SEGMENTED_INDEX_SIZE = min_size
+                self.assertEqual(len(self.__search(self.repo, "common")), 3)
+
+
+class TestRepositoryBulk(pkg5unittest.Pkg5TestCase):
+        """Tests for bulk sessions of the catalogs of server repositories."""
+
+        def setUp(self):
+                pkg5unittest.Pkg5TestCase.setUp(self)
+                self.repo_dir = os.path.join(self.test_root, "repo")
+                self.repo = sr.repository_create(self.repo_dir, properties={
+                    "publisher": { "prefix": "test" } })
+
+        def __open(self, pfmri):
+                trans_id = self.repo.open("0.5.11",
+                    "pkg://test/{0}".format(pfmri))
+                self.repo.add(trans_id, actions.fromstr("set "
+                    "name=pkg.summary value=\"{0}\"".format(pfmri)))
+                return trans_id
+
+        def __publish(self, pfmri):
+                return str(self.repo.close(self.__open(pfmri))[0])
+
+        def __saved_fmris(self):
+                """Returns the packages in the catalog saved to disk."""
+
+                repo = sr.Repository(root=self.repo_dir)
+                return sorted(str(f) for f in repo.get_catalog("test").fmris())
+
+        def test_bulk_commit(self):
+                """Verify that packages closed during a bulk session are only
+                saved to the catalog once the session ends."""
+
+                self.repo.begin_bulk()
+                pfmris = [self.__publish("alpha@1.0"),
+                    self.__publish("beta@1.0")]
+                self.assertEqual(self.__saved_fmris(), [])
+
+                self.repo.end_bulk()
+                self.assertEqual(self.__saved_fmris(), sorted(pfmris))
+
+                # Ending a session which isn't active does nothing, and
+                # packages are saved as they are closed once it has ended.
+                self.repo.end_bulk()
+                pfmris.append(self.__publish("gamma@1.0"))
+                self.assertEqual(self.__saved_fmris(), sorted(pfmris))
+
+                # Sessions can be limited to a publisher.
+                self.repo.begin_bulk(pub="other")
+                pfmris.append(self.__publish("delta@1.0"))
+                self.assertEqual(self.__saved_fmris(), sorted(pfmris))
+                self.repo.end_bulk()
+
+        def test_bulk_abort(self):
+                """Verify that abandoned transactions aren't added to the
+                catalog by a bulk session, and that the packages closed
+                before a publication fails are saved when the session is
+                ended."""
+
+                pfmris = []
+                self.repo.begin_bulk()
+                try:
+                        pfmris.append(self.__publish("alpha@1.0"))
+                        self.repo.abandon(self.__open("beta@1.0"))
+                        pfmris.append(self.__publish("gamma@1.0"))
+                        # Publication fails as obsolete packages can't
+                        # deliver content.
+                        trans_id = self.__open("delta@1.0")
+                        self.repo.add(trans_id, actions.fromstr(
+                            "set name=pkg.obsolete value=true"))
+                        self.assertRaises(sr.RepositoryError,
+                            self.repo.add, trans_id, actions.fromstr(
+                            "dir path=etc/delta mode=0755 owner=root "
+                            "group=bin"))
+                        self.assertEqual(self.__saved_fmris(), [])
+                        self.repo.abandon(trans_id)
+                finally:
+                        self.repo.end_bulk()
+                self.assertEqual(self.__saved_fmris(), sorted(pfmris))
+
+        def test_bulk_new_publisher(self):
+                """Verify that a bulk session can be started for a publisher
+                which has no packages in the repository yet."""
+
+                self.repo_dir = os.path.join(self.test_root, "repo_nopub")
+                self.repo = sr.repository_create(self.repo_dir)
+                self.assertEqual(self.repo.publishers, set())
+
+                self.repo.begin_bulk(pub="test")
+                self.assertEqual(self.repo.publishers, set(["test"]))
+                pfmris = [self.__publish("alpha@1.0"),
+                    self.__publish("beta@1.0")]
+                self.assertEqual(self.__saved_fmris(), [])
+
+                self.repo.end_bulk(pub="test")
+                self.assertEqual(self.__saved_fmris(), sorted(pfmris))
+
+
+class TestSearchResultCache(pkg5unittest.Pkg5TestCase):
+        """Tests for the cache of search results kept by repositories."""
+
+        # The approximate size of each result which returns a package.
+        result_size = sr._SearchResultCache._SearchResultCache__RESULT_OVERHEAD
+
+        @staticmethod
+        def __results(name, count):
+                return [
+                    (1, sqp.Query.RETURN_PACKAGES, "pkg:/{0}{1:d}".format(
+                    name, i))
+                    for i in range(count)
+                ]
+
+        def __add(self, cache, key, res):
+                """Streams the results through the cache and verifies that
+                they were all returned."""
+
+                self.assertEqual(list(cache.gen_results(key, iter(res))), res)
+
+        def test_get(self):
+                """Verify that results are only cached once all of them have
+                been returned."""
+
+                cache = sr._SearchResultCache(self.result_size * 40)
+                res = self.__results("a", 3)
+                self.assertEqual(cache.get("a"), None)
+
+                it = cache.gen_results("a", iter(res))
+                self.assertEqual(next(it), res[0])
+                self.assertEqual(cache.get("a"), None)
+                it.close()
+                self.assertEqual(cache.get("a"), None)
+
+                self.__add(cache, "a", res)
+                self.assertEqual(list(cache.get("a")), res)
+                self.assertEqual(list(cache.get("a")), res)
+
+                # Results for a different generation of the index are
+                # cached separately.
+                gen1 = ("common", False, 1, None, None, ("index", 1))
+                gen2 = ("common", False, 1, None, None, ("index", 2))
+                self.__add(cache, gen1, res)
+                self.assertEqual(cache.get(gen2), None)
+                self.__add(cache, gen2, res[:1])
+                self.assertEqual(list(cache.get(gen1)), res)
+                self.assertEqual(list(cache.get(gen2)), res[:1])
+
+                # An empty set of results is cached.
+                self.__add(cache, "empty", [])
+                self.assertEqual(list(cache.get("empty")), [])
+
+        def test_size(self):
+                """Verify that results which would use more than a quarter of
+                the cache aren't cached, and that the least recently used
+                results are discarded once the cache is full."""
+
+                cache = sr._SearchResultCache(self.result_size * 8)
+                self.__add(cache, "big", self.__results("big", 3))
+                self.assertEqual(cache.get("big"), None)
+
+                for key in ("a", "b", "c", "d"):
+                        self.__add(cache, key, self.__results(key, 2))
+                for key in ("a", "b", "c", "d"):
+                        self.assertNotEqual(cache.get(key), None)
+
+                # Using "a" makes "b" the least recently used.
+                cache.get("a")
+                self.__add(cache, "e", self.__results("e", 2))
+                self.assertEqual(cache.get("b"), None)
+                for key in ("a", "c", "d", "e"):
+                        self.assertNotEqual(cache.get(key), None)
+
+                # Replacing results doesn't count their old size.
+                self.__add(cache, "e", self.__results("e", 1))
+                self.assertEqual(len(list(cache.get("e"))), 1)
+                self.__add(cache, "f", self.__results("f", 1))
+                for key in ("a", "c", "d", "e", "f"):
+                        self.assertNotEqual(cache.get(key), None)
+
+                # The size of the actions is counted for action results.
+                line = "set name=pkg.summary value=\"{0}\"".format(
+                    "x" * self.result_size * 2)
+                self.__add(cache, "act", [(1, sqp.Query.RETURN_ACTIONS,
+                    ("pkg:/a", "x", line))])
+                self.assertEqual(cache.get("act"), None)
+
+        def test_clear(self):
+                """Verify that clearing the cache discards all results and
+                frees their space."""
+
+                cache = sr._SearchResultCache(self.result_size * 8)
+                for key in ("a", "b", "c", "d"):
+                        self.__add(cache, key, self.__results(key, 2))
+                cache.clear()
+                for key in ("a", "b", "c", "d"):
+                        self.assertEqual(cache.get(key), None)
+                for key in ("e", "f", "g", "h"):
+                        self.__add(cache, key, self.__results(key, 2))
+                for key in ("e", "f", "g", "h"):
+                        self.assertNotEqual(cache.get(key), None)
+
+
+if __name__ == "__main__":
+        unittest.main()
@@ -0,0 +1,810 @@
+#!/usr/bin/python3
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+
+from . import testutils
+if __name__ == "__main__":
+        testutils.setup_environment("../../../proto")
+import pkg5unittest
+
+import os
+import pycurl
+import threading
+import time
+import unittest
+
+from six.moves import BaseHTTPServer, http_client, socketserver
+
+import pkg.client.publisher as publisher
+import pkg.client.transport.exception as tx
+import pkg.client.transport.engine as engine
+import pkg.client.transport.stats as tstats
+import pkg.client.transport.transport as transport
+
+from pkg.client import global_settings
+
+
+class TestRepoStats(pkg5unittest.Pkg5TestCase):
+        """Tests for the statistics kept for each repository."""
+
+        repouri = publisher.TransportRepoURI("http://localhost/")
+
+        @staticmethod
+        def __complete_round(rs, nbytes=1000, seconds=1.0):
+                """Completes a round of requests to the repository, each of
+                which transferred nbytes in the given number of seconds, and
+                returns the resulting concurrency."""
+
+                conc = rs.get_concurrency(16, 32)
+                for i in range(conc):
+                        rs.record_completion(nbytes, seconds)
+                return rs.get_concurrency(16, 32)
+
+        def test_initial_concurrency(self):
+                """Verify that the initial number of requests is made until
+                requests have completed, within the bounds of the number of
+                requests which may be made at once."""
+
+                rs = tstats.RepoStats(self.repouri)
+                # Completions before the number is known are ignored.
+                rs.record_completion(1000, 1.0, overloaded=True)
+                self.assertEqual(rs.get_concurrency(8), 8)
+
+                rs = tstats.RepoStats(self.repouri)
+                self.assertEqual(rs.get_concurrency(0),
+                    tstats.MIN_CONCURRENCY)
+                rs = tstats.RepoStats(self.repouri)
+                self.assertEqual(rs.get_concurrency(8, 32), 8)
+                rs = tstats.RepoStats(self.repouri)
+                self.assertEqual(rs.get_concurrency(8, 4), 4)
+
+        def test_additive_increase(self):
+                """Verify that the concurrency grows by one for each round of
+                requests that completes without the throughput dropping, up
+                to the maximum given."""
+
+                rs = tstats.RepoStats(self.repouri)
+                self.assertEqual(rs.get_concurrency(8), 8)
+                rs.record_completion(1000, 1.0, overloaded=True)
+                self.assertEqual(rs.get_concurrency(8), 4)
+
+                # A round isn't complete until as many requests as the
+                # concurrency have completed.
+                for i in range(3):
+                        rs.record_completion(1000, 1.0)
+                self.assertEqual(rs.get_concurrency(8), 4)
+                rs.record_completion(1000, 1.0)
+                self.assertEqual(rs.get_concurrency(8), 5)
+
+                for conc in (6, 7, 8, 8, 8):
+                        conc_done = rs.get_concurrency(8)
+                        for i in range(conc_done):
+                                rs.record_completion(1000, 1.0)
+                        self.assertEqual(rs.get_concurrency(8), conc)
+
+                # Lowering the maximum lowers the concurrency.
+                self.assertEqual(rs.get_concurrency(3), 3)
+
+        def test_multiplicative_decrease(self):
+                """Verify that the concurrency is cut each time a request
+                fails because the repository is overloaded, down to the
+                minimum, and backs off when the throughput drops."""
+
+                rs = tstats.RepoStats(self.repouri)
+                self.assertEqual(rs.get_concurrency(16), 16)
+                for conc in (8, 4, 2, 1, 1):
+                        rs.record_completion(0, 5.0, overloaded=True)
+                        self.assertEqual(rs.get_concurrency(16),
+                            max(conc, tstats.MIN_CONCURRENCY))
+
+                rs = tstats.RepoStats(self.repouri)
+                rs.get_concurrency(16)
+                rs.record_completion(0, 5.0, overloaded=True)
+                self.assertEqual(self.__complete_round(rs), 9)
+                # An overloaded repository abandons the round in progress.
+                for i in range(8):
+                        rs.record_completion(1000, 1.0)
+                rs.record_completion(0, 5.0, overloaded=True)
+                self.assertEqual(rs.get_concurrency(16), 4)
+                self.assertEqual(self.__complete_round(rs), 5)
+
+                # A round whose throughput is much lower than that of the
+                # previous one backs off, but a smaller drop doesn't.  The
+                # round after a back off isn't compared with the one before.
+                self.assertEqual(self.__complete_round(rs, nbytes=100), 4)
+                self.assertEqual(self.__complete_round(rs, nbytes=100), 5)
+                self.assertEqual(self.__complete_round(rs, nbytes=90), 6)
+                self.assertEqual(self.__complete_round(rs, nbytes=10), 4)
+
+        def test_max_concurrency(self):
+                """Verify that the concurrency grows beyond the initial number
+                of requests, but never beyond the maximum."""
+
+                rs = tstats.RepoStats(self.repouri)
+                self.assertEqual(rs.get_concurrency(30, 32), 30)
+                for conc in (31, 32, 32, 32):
+                        self.assertEqual(self.__complete_round(rs), conc)
+                # Lowering the maximum lowers the concurrency, but the initial
+                # number no longer matters.
+                self.assertEqual(rs.get_concurrency(4, 8), 8)
+                self.assertEqual(rs.get_concurrency(32, 32), 8)
+
+
+class _HTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+        """A server for the content used by the tests, which handles each
+        request in its own thread."""
+
+        daemon_threads = True
+
+        def __init__(self):
+                BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0),
+                    _HTTPHandler)
+                # The content served for each path, the number of seconds
+                # to wait before responding to requests for it, and the
+                # status of the error to respond with instead.
+                self.content = {}
+                self.delays = {}
+                self.errors = {}
+                # For each path, the number of bytes of content to send
+                # before pausing for a number of seconds, and the number to
+                # send before dropping the connection the next time it's
+                # requested.
+                self.pauses = {}
+                self.cutoffs = {}
+                # How requests for a range of the content of each path are
+                # handled: if "ignore", all of it is sent, or if a status,
+                # that error is sent.  Otherwise, the range is sent.
+                self.ranges = {}
+                # The path and range of each request made.
+                self.requests = []
+                self.range_requests = []
+                self.url = "http://127.0.0.1:{0:d}/".format(
+                    self.server_address[1])
+
+        def handle_error(self, request, client_address):
+                # Clients drop connections when requests are cancelled.
+                pass
+
+
+class _HTTPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+                path = self.path.lstrip("/")
+                rng = self.headers.get("Range")
+                self.server.requests.append(path)
+                self.server.range_requests.append((path, rng))
+                time.sleep(self.server.delays.get(path, 0))
+
+                content = self.server.content.get(path)
+                if content is None or path in self.server.errors:
+                        self.send_error(self.server.errors.get(path, 404))
+                        return
+
+                handling = self.server.ranges.get(path)
+                if rng and handling != "ignore":
+                        if handling:
+                                self.send_error(handling)
+                                return
+                        start = int(rng.split("=")[1].split("-")[0])
+                        self.send_response(206)
+                        self.send_header("Content-Range",
+                            "bytes {0:d}-{1:d}/{2:d}".format(start,
+                            len(content) - 1, len(content)))
+                        content = content[start:]
+                else:
+                        self.send_response(200)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+
+                cutoff = self.server.cutoffs.pop(path, None)
+                if cutoff is not None:
+                        self.wfile.write(content[:cutoff])
+                        self.wfile.flush()
+                        self.close_connection = True
+                        return
+                nbytes, seconds = self.server.pauses.get(path, (0, 0))
+                self.wfile.write(content[:nbytes])
+                self.wfile.flush()
+                time.sleep(seconds)
+                self.wfile.write(content[nbytes:])
+
+        def log_message(self, *args):
+                pass
+
+
+class _Transport(object):
+        """The parts of a Transport used by the transport engine."""
+
+        def __init__(self):
+                self.stats = {}
+
+        def get_ca_dir(self):
+                return None
+
+
+class _EngineTestCase(pkg5unittest.Pkg5TestCase):
+        """The base class of tests for the transport engine, which make
+        requests to a local HTTP server."""
+
+        def setUp(self):
+                pkg5unittest.Pkg5TestCase.setUp(self)
+                self.server = _HTTPServer()
+                self.server_thread = threading.Thread(
+                    target=self.server.serve_forever)
+                self.server_thread.daemon = True
+                self.server_thread.start()
+                self.xport = _Transport()
+
+        def tearDown(self):
+                self.server.shutdown()
+                self.server.server_close()
+                self.server_thread.join()
+                pkg5unittest.Pkg5TestCase.tearDown(self)
+
+        def _repo(self, name):
+                """Returns the url of a repository served by the server, and
+                sets up its statistics."""
+
+                repourl = self.server.url + name
+                self.xport.stats[(repourl, None)] = tstats.RepoStats(
+                    publisher.TransportRepoURI(repourl))
+                return repourl
+
+        def _add(self, eng, repourl, name, content=b"content",
+            hedge_repourl=None, resumable=False):
+                """Adds a request for a file to the engine, and returns the
+                path it is downloaded to.  If hedge_repourl is given, the
+                request may be hedged by requesting the file from there."""
+
+                path = repourl.split("/")[-1] + "/" + name
+                self.server.content[path] = content
+                filepath = os.path.join(self.test_root, path)
+                if not os.path.exists(os.path.dirname(filepath)):
+                        os.makedirs(os.path.dirname(filepath))
+                hedge = None
+                if hedge_repourl:
+                        hedge = {
+                            "url": hedge_repourl + "/" + name,
+                            "repourl": hedge_repourl,
+                        }
+                eng.add_url(self.server.url + path, filepath=filepath,
+                    repourl=repourl, hedge=hedge, resumable=resumable)
+                return filepath
+
+        @staticmethod
+        def _in_progress(eng):
+                """Returns the sorted urls of the requests in progress."""
+
+                free = eng._CurlTransportEngine__freehandles
+                return sorted(
+                    h.url for h in eng._CurlTransportEngine__chandles
+                    if h not in free
+                )
+
+        @staticmethod
+        def _run(eng):
+                """Runs the engine until its requests are complete, and
+                returns the failures."""
+
+                while eng.pending:
+                        eng.run()
+                return eng.check_status()
+
+
+class TestCurlTransportEngine(_EngineTestCase):
+        """Tests for the limits of the requests made by the transport
+        engine."""
+
+        def test_request_limit(self):
+                """Verify that no more requests are made to a repository at
+                once than its limit, without holding up requests to other
+                repositories, and that the limit starts at max_conn and
+                never exceeds max_concurrency."""
+
+                eng = engine.CurlTransportEngine(self.xport, max_conn=4,
+                    http2_streams=1, max_concurrency=6)
+                self.assertEqual(len(eng._CurlTransportEngine__chandles), 6)
+
+                slow = self._repo("slow")
+                fast = self._repo("fast")
+                self.assertEqual(eng.request_limit((slow, None)), 4)
+                rs = self.xport.stats[(slow, None)]
+                for i in range(2):
+                        rs.record_completion(0, 1.0, overloaded=True)
+                self.assertEqual(eng.request_limit((slow, None)), 1)
+
+                # The limit grows beyond max_conn, up to max_concurrency.
+                self.assertEqual(eng.request_limit((fast, None)), 4)
+                rs = self.xport.stats[(fast, None)]
+                for i in range(10):
+                        for j in range(eng.request_limit((fast, None))):
+                                rs.record_completion(1000, 1.0)
+                self.assertEqual(eng.request_limit((fast, None)), 6)
+
+                # A max_concurrency below max_conn is raised to it.
+                eng2 = engine.CurlTransportEngine(self.xport, max_conn=4,
+                    http2_streams=1, max_concurrency=2)
+                self.assertEqual(len(eng2._CurlTransportEngine__chandles), 4)
+                eng2.shutdown()
+
+                fpaths = []
+                for path in ("slow/a", "slow/b", "slow/c", "fast/d"):
+                        self.server.delays[path] = 0.5
+                for name in ("a", "b", "c"):
+                        fpaths.append(self._add(eng, slow, name))
+                fpaths.append(self._add(eng, fast, "d"))
+
+                # The request to the second repository is made while those
+                # to the first wait for the one in progress.
+                eng.run()
+                self.assertEqual(self._in_progress(eng),
+                    [self.server.url + "fast/d", self.server.url + "slow/a"])
+
+                self.assertEqual(self._run(eng), [])
+                for fpath in fpaths:
+                        with open(fpath, "rb") as f:
+                                self.assertEqual(f.read(), b"content")
+                self.assertEqual(self.server.requests[-1], "slow/c")
+
+        def test_multiplexing(self):
+                """Verify that an engine which multiplexes requests over
+                HTTP/2 connections keeps a handle for every stream of
+                max_concurrency connections, but only uses the streams for repositories which
+                have been seen to multiplex requests."""
+
+                http2_supported = engine.http2_supported
+                engine.http2_supported = False
+                try:
+                        eng = engine.CurlTransportEngine(self.xport,
+                            max_conn=2, http2_streams=3, max_concurrency=2)
+                finally:
+                        engine.http2_supported = http2_supported
+                # Without HTTP/2 support, each connection carries one request.
+                self.assertEqual(len(eng._CurlTransportEngine__chandles), 2)
+
+                if not engine.http2_supported:
+                        # libcurl can't multiplex requests.
+                        return
+
+                eng = engine.CurlTransportEngine(self.xport, max_conn=2,
+                    http2_streams=3, max_concurrency=2)
+                self.assertEqual(len(eng._CurlTransportEngine__chandles), 6)
+
+                repourl = self._repo("repo")
+                key = (repourl, None)
+                rs = self.xport.stats[key]
+                self.assertEqual(eng.request_limit(key), 2)
+
+                def add_requests(prefix):
+                        fpaths = []
+                        for i in range(8):
+                                name = "{0}{1:d}".format(prefix, i)
+                                self.server.delays["repo/" + name] = 0.2
+                                fpaths.append(self._add(eng, repourl, name))
+                        return fpaths
+
+                # The local server only supports HTTP/1.1, so only max_conn
+                # requests are made to it at once, and it's recorded as not
+                # multiplexing them.
+                fpaths = add_requests("a")
+                eng.run()
+                self.assertEqual(len(self._in_progress(eng)), 2)
+                self.assertEqual(self._run(eng), [])
+                self.assertEqual(rs.multiplexing, False)
+
+                # Once a repository has been seen to multiplex requests, the
+                # streams of each connection are used, up to the number of
+                # handles.
+                rs.record_multiplexing(True)
+                self.assertEqual(eng.request_limit(key), 6)
+                fpaths.extend(add_requests("b"))
+                eng.run()
+                self.assertEqual(len(self._in_progress(eng)), 6)
+                self.assertEqual(self._run(eng), [])
+                for fpath in fpaths:
+                        with open(fpath, "rb") as f:
+                                self.assertEqual(f.read(), b"content")
+
+
+class TestHedging(_EngineTestCase):
+        """Tests for hedging requests which take longer than requests to
+        their repository usually do."""
+
+        def setUp(self):
+                _EngineTestCase.setUp(self)
+                self.__percentile = global_settings.PKG_CLIENT_HEDGE_PERCENTILE
+                self.__min_deadline = tstats.MIN_HEDGE_DEADLINE
+                global_settings.PKG_CLIENT_HEDGE_PERCENTILE = 90
+                tstats.MIN_HEDGE_DEADLINE = 0.1
+
+                # The engine may not start a hedge until up to a second
+                # after its deadline, so the requests which are hedged take
+                # longer than that.
+                self.eng = engine.CurlTransportEngine(self.xport, max_conn=4,
+                    http2_streams=1)
+                self.primary = self._repo("primary")
+                self.hedge = self._repo("hedge")
+                # Requests to the primary repository usually complete
+                # quickly, so the deadline for hedging them is the minimum.
+                rs = self.xport.stats[(self.primary, None)]
+                rs.get_concurrency(4)
+                for i in range(tstats.MIN_HEDGE_SAMPLES):
+                        rs.record_completion(100, 0.01)
+                self.assertEqual(rs.get_hedge_deadline(90),
+                    tstats.MIN_HEDGE_DEADLINE)
+
+        def tearDown(self):
+                global_settings.PKG_CLIENT_HEDGE_PERCENTILE = self.__percentile
+                tstats.MIN_HEDGE_DEADLINE = self.__min_deadline
+                _EngineTestCase.tearDown(self)
+
+        def __add_pair(self, primary_delay, hedge_delay, resumable=False):
+                """Adds a request for a file to the primary repository which
+                may be hedged by requesting it from the other one, and returns
+                the path it's downloaded to."""
+
+                self.server.content["hedge/file"] = b"hedge"
+                self.server.delays["primary/file"] = primary_delay
+                self.server.delays["hedge/file"] = hedge_delay
+                return self._add(self.eng, self.primary, "file",
+                    content=b"primary", hedge_repourl=self.hedge,
+                    resumable=resumable)
+
+        def __run(self):
+                return _EngineTestCase._run(self.eng)
+
+        def __check_files(self, fpath, content):
+                """Verifies that the file downloaded to fpath has the given
+                content, or doesn't exist if content is None, and that no
+                other files were left behind."""
+
+                names = sorted(os.listdir(os.path.dirname(fpath)))
+                if content is None:
+                        self.assertEqual(names, [])
+                        return
+                self.assertEqual(names, [os.path.basename(fpath)])
+                with open(fpath, "rb") as f:
+                        self.assertEqual(f.read(), content)
+
+        def test_primary_wins(self):
+                """Verify that the hedge of a request is cancelled when the
+                request completes first."""
+
+                fpath = self.__add_pair(2, 5)
+                self.assertEqual(self.__run(), [])
+                self.assertEqual(sorted(self.server.requests),
+                    ["hedge/file", "primary/file"])
+                self.__check_files(fpath, b"primary")
+
+        def test_hedge_wins(self):
+                """Verify that the content downloaded by the hedge of a
+                request is renamed into place when it completes first, and
+                that the request is reported as successful."""
+
+                fpath = self.__add_pair(5, 0)
+                while self.eng.pending:
+                        self.eng.run()
+                failures, success = self.eng.check_status(good_reqs=True)
+                self.assertEqual(failures, [])
+                self.assertEqual(success, [self.server.url + "primary/file"])
+                self.assertEqual(sorted(self.server.requests),
+                    ["hedge/file", "primary/file"])
+                self.__check_files(fpath, b"hedge")
+
+        def test_both_fail(self):
+                """Verify that the failure of a hedged request is only
+                reported once, under the url of the request, when both it
+                and its hedge fail."""
+
+                for primary_delay, hedge_delay in ((1.5, 0), (1.5, 3)):
+                        self.server.requests = []
+                        self.server.errors["primary/file"] = \
+                            http_client.NOT_FOUND
+                        self.server.errors["hedge/file"] = \
+                            http_client.NOT_FOUND
+                        fpath = self.__add_pair(primary_delay, hedge_delay)
+                        failures = self.__run()
+                        self.assertEqual(len(failures), 1)
+                        self.assertTrue(isinstance(failures[0],
+                            tx.TransportProtoError))
+                        self.assertEqual(failures[0].url,
+                            self.server.url + "primary/file")
+                        self.assertEqual(sorted(self.server.requests),
+                            ["hedge/file", "primary/file"])
+                        self.__check_files(fpath, None)
+
+                # A request which fails in a way that can't be retried is
+                # raised once.
+                self.server.requests = []
+                self.server.errors["primary/file"] = http_client.FORBIDDEN
+                self.server.errors["hedge/file"] = http_client.FORBIDDEN
+                fpath = self.__add_pair(1.5, 0)
+                self.assertRaises(tx.TransportProtoError, self.__run)
+                self.assertEqual(self.__run(), [])
+                self.assertEqual(sorted(self.server.requests),
+                    ["hedge/file", "primary/file"])
+                self.__check_files(fpath, None)
+
+        def test_hedged_out_partial(self):
+                """Verify that a resumable request which is hedged out
+                doesn't keep what it downloaded."""
+
+                self.server.pauses["primary/file"] = (3, 5)
+                fpath = self.__add_pair(0, 0.3, resumable=True)
+                self.assertEqual(self.__run(), [])
+                self.__check_files(fpath, b"hedge")
+
+        def test_cancel_pair(self):
+                """Verify that removing a hedged request removes its hedge
+                too, and that nothing either downloaded is left behind."""
+
+                fpath = self.__add_pair(5, 5)
+                while len(self.server.requests) < 2:
+                        self.eng.run()
+                self.assertEqual(sorted(self.server.requests),
+                    ["hedge/file", "primary/file"])
+                self.eng.remove_request(self.server.url + "primary/file",
+                    None)
+                self.assertEqual(self._in_progress(self.eng), [])
+                self.assertEqual(self.__run(), [])
+                self.__check_files(fpath, None)
+
+
+class TestResume(_EngineTestCase):
+        """Tests for resuming downloads which were cut short."""
+
+        content = bytes(bytearray(range(256))) * 64
+
+        def setUp(self):
+                _EngineTestCase.setUp(self)
+                self.eng = engine.CurlTransportEngine(self.xport, max_conn=4,
+                    http2_streams=1)
+                self.repo = self._repo("repo")
+
+        def __get(self, name, resumable=True):
+                """Downloads the named file, and returns the failures and the
+                files in the download directory."""
+
+                fpath = self._add(self.eng, self.repo, name,
+                    content=self.content, resumable=resumable)
+                failures = self._run(self.eng)
+                return failures, sorted(os.listdir(os.path.dirname(fpath)))
+
+        def __check_cut_off(self, name):
+                """Verifies that a download of the file which is cut short
+                fails in a way which can be retried, and that what was
+                downloaded is kept."""
+
+                self.server.cutoffs["repo/" + name] = 5000
+                failures, names = self.__get(name)
+                self.assertEqual(len(failures), 1)
+                self.assertTrue(isinstance(failures[0],
+                    tx.TransportFrameworkError))
+                self.assertEqual(failures[0].code, pycurl.E_PARTIAL_FILE)
+                self.assertTrue(failures[0].retryable)
+                self.assertEqual(names, [name + ".part"])
+                self.assertEqual(os.stat(os.path.join(self.test_root, "repo",
+                    name + ".part")).st_size, 5000)
+
+        def __check_downloaded(self, name, rng):
+                """Verifies that the file was downloaded in full, using the
+                given range."""
+
+                failures, names = self.__get(name)
+                self.assertEqual(failures, [])
+                self.assertEqual(names, [name])
+                self.assertEqual(self.server.range_requests[-1],
+                    ("repo/" + name, rng))
+                with open(os.path.join(self.test_root, "repo", name),
+                    "rb") as f:
+                        self.assertEqual(f.read(), self.content)
+                os.remove(os.path.join(self.test_root, "repo", name))
+
+        def test_resume(self):
+                """Verify that a download which is cut short is resumed from
+                where it stopped by the next request for the file."""
+
+                self.__check_cut_off("hash")
+                self.__check_downloaded("hash", "bytes=5000-")
+
+                # Nothing is kept for requests which aren't resumable, or
+                # which fail for other reasons.
+                self.server.cutoffs["repo/hash"] = 5000
+                failures, names = self.__get("hash", resumable=False)
+                self.assertEqual(len(failures), 1)
+                self.assertEqual(names, [])
+
+                self.server.errors["repo/hash"] = \
+                    http_client.GATEWAY_TIMEOUT
+                failures, names = self.__get("hash")
+                self.assertEqual(len(failures), 1)
+                self.assertEqual(names, [])
+
+        def test_range_error(self):
+                """Verify that a partial download is discarded if the
+                repository can't resume it, and the download is retried from
+                the start."""
+
+                for handling in (
+                    http_client.REQUESTED_RANGE_NOT_SATISFIABLE, "ignore"):
+                        self.__check_cut_off("hash")
+                        self.server.ranges["repo/hash"] = handling
+                        failures, names = self.__get("hash")
+                        self.assertEqual(self.server.range_requests[-1],
+                            ("repo/hash", "bytes=5000-"))
+                        self.assertEqual(len(failures), 1)
+                        self.assertTrue(failures[0].retryable)
+                        self.assertEqual(names, [])
+                        self.__check_downloaded("hash", None)
+
+        def test_cancel(self):
+                """Verify that a resumable request which is removed doesn't
+                keep what it downloaded."""
+
+                self.server.pauses["repo/hash"] = (5000, 5)
+                fpath = self._add(self.eng, self.repo, "hash",
+                    content=self.content, resumable=True)
+                url = self.server.url + "repo/hash"
+
+                def downloaded():
+                        for h in self.eng._CurlTransportEngine__chandles:
+                                if h.url == url:
+                                        return h.getinfo(pycurl.SIZE_DOWNLOAD)
+                        return 0
+
+                while downloaded() < 5000:
+                        self.eng.run()
+                self.eng.remove_request(url, None)
+                self.assertEqual(self._run(self.eng), [])
+                self.assertEqual(os.listdir(os.path.dirname(fpath)), [])
+
+        def test_transport_cleanup(self):
+                """Verify that the partial downloads in the incoming
+                directory are removed when the transport is reset or shut
+                down."""
+
+                incoming = os.path.join(self.test_root, "incoming")
+                os.makedirs(incoming)
+                xport = transport.Transport(transport.GenericTransportCfg(
+                    incoming_root=incoming))
+                for cleanup in (xport.reset, xport.shutdown):
+                        xport._Transport__setup()
+                        for name in ("hash", "hash.part", "other.part"):
+                                open(os.path.join(incoming, name), "w").close()
+                        cleanup()
+                        self.assertEqual(os.listdir(incoming), ["hash"])
+
+
+class TestChunkSize(pkg5unittest.Pkg5TestCase):
+        """Tests for the sizing of the chunks in which the transport
+        downloads files and manifests."""
+
+        def setUp(self):
+                pkg5unittest.Pkg5TestCase.setUp(self)
+                self.xport = transport.Transport(
+                    transport.GenericTransportCfg())
+                self.xport._Transport__setup()
+
+        def tearDown(self):
+                self.xport.shutdown()
+                pkg5unittest.Pkg5TestCase.tearDown(self)
+
+        def __chunk_size(self, pub, alt_repo=None, origin_only=False):
+                return self.xport._Transport__chunk_size(pub,
+                    alt_repo=alt_repo, origin_only=origin_only)
+
+        def __visit(self, url, request_time, errors=0):
+                """Clears the statistics of the repository at url, then
+                records a request to it which took request_time seconds and
+                the given number of failed requests, which lower the quality
+                of the repository.  At most four requests are made to the
+                repository at once."""
+
+                repouri = publisher.TransportRepoURI(url)
+                # Creates the statistics of the repository if needed.
+                self.xport.stats.get_num_visited([repouri])
+                rs = self.xport.stats[repouri.key()]
+                rs.reset()
+                rs.get_concurrency(4)
+                rs.record_tx()
+                rs.record_progress(1000, request_time)
+                for i in range(errors):
+                        rs.record_error()
+
+        @staticmethod
+        def __pub(origins, mirrors=None):
+                return publisher.Publisher("test",
+                    repository=publisher.Repository(origins=origins,
+                    mirrors=mirrors))
+
+        def test_unvisited(self):
+                """Verify the chunk size used before the statistics of
+                every repository are known."""
+
+                # A single repository gets the largest chunks.
+                pub = self.__pub(["http://origin1/"])
+                self.assertEqual(self.__chunk_size(pub), 1024)
+                self.assertEqual(self.__chunk_size(
+                    publisher.TransportRepoURI("http://origin1/")), 1024)
+
+                # Until each repository has been visited, the smallest
+                # chunks are used.
+                pub = self.__pub(["http://origin1/", "http://origin2/"])
+                self.__visit("http://origin1/", 0.1)
+                self.assertEqual(self.__chunk_size(pub), 10)
+
+                # Repositories which have been visited but which have no
+                # completed requests give no measure of their speed.
+                for url in ("http://origin1/", "http://origin2/"):
+                        self.__visit(url, 0)
+                        self.xport.stats[publisher.TransportRepoURI(
+                            url).key()].reset()
+                self.assertEqual(self.__chunk_size(pub), 100)
+
+        def test_measured(self):
+                """Verify that the chunk size is the number of requests which
+                the best repository can complete in ten seconds, within the
+                bounds of the chunk size."""
+
+                pub = self.__pub(["http://origin1/", "http://origin2/"])
+                self.__visit("http://origin2/", 0.1, errors=10)
+
+                # Four requests at once, each taking 0.5 seconds.
+                self.__visit("http://origin1/", 0.5)
+                self.assertEqual(self.__chunk_size(pub), 80)
+
+                # A fast repository is limited to the largest chunk size.
+                self.__visit("http://origin1/", 0.01)
+                self.assertEqual(self.__chunk_size(pub), 1024)
+
+                # A slow one is limited to the smallest.
+                self.__visit("http://origin1/", 10)
+                self.assertEqual(self.__chunk_size(pub), 10)
+
+        def test_selection(self):
+                """Verify that the chunk size is that of the repository with
+                the best quality of those which may be used."""
+
+                pub = self.__pub(["http://origin1/", "http://origin2/"],
+                    mirrors=["http://mirror1/"])
+                self.__visit("http://origin1/", 1, errors=10)
+                self.__visit("http://origin2/", 2, errors=5)
+                self.__visit("http://mirror1/", 0.5)
+                self.assertEqual(self.__chunk_size(pub), 80)
+                self.assertEqual(self.__chunk_size(pub, origin_only=True),
+                    20)
+
+                # An alternate repository is used in place of the
+                # publisher's.
+                alt_repo = publisher.Repository(
+                    origins=["http://alt1/", "http://alt2/"])
+                self.assertEqual(self.__chunk_size(pub, alt_repo=alt_repo),
+                    10)
+                self.__visit("http://alt1/", 0.25)
+                self.__visit("http://alt2/", 0.1, errors=10)
+                self.assertEqual(self.__chunk_size(pub, alt_repo=alt_repo),
+                    160)
+
+
+if __name__ == "__main__":
+        unittest.main()
@@ -574,16 +574,16 @@ class TestPkgrecvMulti(pkg5unittest.ManyDepotTestCase):
                 with open(os.path.join(pkgdir, "manifest")) as f:
                         mcontent = f.read()
                 self.assertTrue("testpub" in mcontent)
-                with open(os.path.join(os.path.join(pkgdir, "manifest.set"))) \
-                    as f:
+                with open(os.path.join(pkgdir,
+                    manifest.FactoredManifest.CACHE_NAME)) as f:
                         ms = f.read()
                 self.assertTrue("testpub" in ms)
                 pkgdir = xport_cfg.get_pkg_dir(amber)
                 with open(os.path.join(pkgdir, "manifest")) as f:
                         mcontent = f.read()
                 self.assertTrue("testpub" in mcontent)
-                with open(os.path.join(os.path.join(pkgdir, "manifest.set"))) \
-                    as f:
+                with open(os.path.join(pkgdir,
+                    manifest.FactoredManifest.CACHE_NAME)) as f:
                         ms = f.read()
                 self.assertTrue("testpub" in ms)
 
@@ -605,8 +605,8 @@ class TestPkgrecvMulti(pkg5unittest.ManyDepotTestCase):
                 with open(os.path.join(pkgdir, "manifest")) as f:
                         mcontent = f.read()
                 self.assertTrue("testname" in mcontent)
-                with open(os.path.join(os.path.join(pkgdir, "manifest.set"))) \
-                    as f:
+                with open(os.path.join(pkgdir,
+                    manifest.FactoredManifest.CACHE_NAME)) as f:
                         ms = f.read()
                 self.assertTrue("testname" in ms)
 
@@ -621,8 +621,8 @@ class TestPkgrecvMulti(pkg5unittest.ManyDepotTestCase):
                 with open(os.path.join(pkgdir, "manifest")) as f:
                         mcontent = f.read()
                 self.assertTrue("testname" in mcontent)
-                with open(os.path.join(os.path.join(pkgdir, "manifest.set"))) \
-                    as f:
+                with open(os.path.join(pkgdir,
+                    manifest.FactoredManifest.CACHE_NAME)) as f:
                         ms = f.read()
                 self.assertTrue("testname" in ms)
 
@@ -1381,8 +1381,9 @@ Estimated transfer size: 3.17 kB
                 with open(os.path.join(pkgdir, "manifest")) as f:
                         mcontent = f.read()
                 self.assertTrue("depend" in mcontent)
-                self.assertTrue(os.path.exists(os.path.join(pkgdir,
-                    "manifest.depend")))
+                mcache = manifest._ManifestCache.load(os.path.join(pkgdir,
+                    manifest.FactoredManifest.CACHE_NAME))
+                self.assertTrue("depend" in mcache)
 
                 # Drop the file.
                 self.pkgrecv(self.durl5, "--mog-file {0} -d {1} filetrans2"
@@ -1395,8 +1396,9 @@ Estimated transfer size: 3.17 kB
                 with open(os.path.join(pkgdir, "manifest")) as f:
                         mcontent = f.read()
                 self.assertTrue("path" not in mcontent)
-                self.assertTrue(not os.path.exists(os.path.join(pkgdir,
-                    "manifest.file")))
+                mcache = manifest._ManifestCache.load(os.path.join(pkgdir,
+                    manifest.FactoredManifest.CACHE_NAME))
+                self.assertTrue("file" not in mcache)
 
                 # With -v.
                 self.pkgrecv(self.durl5, "--mog-file {0} -d {1} -v filetrans2"
@@ -1430,10 +1432,10 @@ Estimated transfer size: 3.17 kB
                 with open(os.path.join(pkgdir, "manifest")) as f:
                         mcontent = f.read()
                 self.assertTrue("opt/bronze2" in mcontent)
-                self.assertTrue(os.path.exists(os.path.join(pkgdir,
-                    "manifest.file")))
-                with open(os.path.join(pkgdir, "manifest.file")) as f:
-                        mf = f.read()
+                mcache = manifest._ManifestCache.load(os.path.join(pkgdir,
+                    manifest.FactoredManifest.CACHE_NAME))
+                self.assertTrue("file" in mcache)
+                mf = "\n".join(mcache.lines("file"))
                 self.assertTrue("opt/bronze2" in mf)
 
                 self.pkgrecv(self.durl5, "--mog-file {0} -d {1} -v signature"